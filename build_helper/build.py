@@ -3,13 +3,13 @@
 import os
 import re
 import shutil
-import tarfile
 import zipfile
 
-import zstandard as zstd
 from actions_toolkit import core
 from actions_toolkit.github import Context
 
+from .utils.archive import create_archive, extract_archive_stream
+from .utils.build_timing import get_build_timer
 from .utils.logger import logger
 from .utils.openwrt import ImageBuilder, OpenWrt
 from .utils.paths import paths
@@ -38,25 +38,37 @@ def get_cache_restore_key(openwrt: OpenWrt, cfg: dict) -> str:
     return cache_restore_key
 
 
+def extract_artifact_archive(artifact_path: str, stem: str, dest: str) -> list[str]:
+    """将 Artifact 中的 {stem}.tar.* 直接流式解压到 dest, 不写出中间文件, 压缩格式自动识别, 返回归档中的路径
+
+    解压成功后删除 Artifact 的 zip
+    """
+    with zipfile.ZipFile(artifact_path, "r") as zip_ref:
+        if (name := next((name for name in zip_ref.namelist() if name.startswith(f"{stem}.tar")), None)) is None:
+            msg = f"Artifact中没有找到{stem}归档"
+            raise FileNotFoundError(msg)
+        with zip_ref.open(name) as member:
+            names = extract_archive_stream(member, dest)
+    os.remove(artifact_path)
+    return names
+
+
 def prepare(cfg: dict) -> None:
     context = Context()
     logger.debug("job: %s", context.job)
     setup_env(context.job in ("build-packages", "build-ImageBuilder", "build-images-releases"),
               context.job in ("build-packages", "build-ImageBuilder", "build-images-releases"))
 
-    tmpdir = paths.get_tmpdir()
-
     logger.info("还原openwrt源码...")
-    path = dl_artifact(f"openwrt-source-{cfg["name"]}", tmpdir.name)
-    with zipfile.ZipFile(path, "r") as zip_ref:
-        zip_ref.extract("openwrt-source.tar.gz", tmpdir.name)
-    with tarfile.open(os.path.join(tmpdir.name, "openwrt-source.tar.gz"), "r") as tar_ref:
-        tar_ref.extractall(paths.workdir)  # noqa: S202
+    path = dl_artifact(f"openwrt-source-{cfg["name"]}")
+    extract_artifact_archive(path, "openwrt-source", paths.workdir)
     openwrt = OpenWrt(os.path.join(paths.workdir, "openwrt"))
 
     if context.job == "base-builds":
         logger.info("构建toolchain缓存key...")
-        toolchain_key = f"toolchain-{hash_dirs((os.path.join(openwrt.path, "tools"), os.path.join(openwrt.path, "toolchain")))}"
+        toolchain_hash = hash_dirs((os.path.join(openwrt.path, "tools"), os.path.join(openwrt.path, "toolchain")),
+                                   cache_path=os.path.join(paths.workdir, "hash_cache.json"))
+        toolchain_key = f"toolchain-{toolchain_hash}"
         target, subtarget = openwrt.get_target()
         if target:
             toolchain_key += f"-{target}"
@@ -67,40 +79,24 @@ def prepare(cfg: dict) -> None:
     elif context.job in ("build-packages", "build-ImageBuilder"):
         if os.path.exists(os.path.join(openwrt.path, "staging_dir")):
             shutil.rmtree(os.path.join(openwrt.path, "staging_dir"))
-        base_builds_path = dl_artifact(f"base-builds-{cfg['name']}", tmpdir.name)
-        with zipfile.ZipFile(base_builds_path, "r") as zip_ref:
-            zip_ref.extract("builds.tar.gz", tmpdir.name)
-        with tarfile.open(os.path.join(tmpdir.name, "builds.tar.gz"), "r:gz") as tar:
-            tar.extractall(openwrt.path)  # noqa: S202
+        base_builds_path = dl_artifact(f"base-builds-{cfg['name']}")
+        extract_artifact_archive(base_builds_path, "builds", openwrt.path)
 
     elif context.job == "build-images-releases":
-        ib_path = dl_artifact(f"Image_Builder-{cfg["name"]}", tmpdir.name)
-        with zipfile.ZipFile(ib_path, "r") as zip_ref:
-            ext = "zst" if "openwrt-imagebuilder.tar.zst" in zip_ref.namelist() else "xz"
-            zip_ref.extract(f"openwrt-imagebuilder.tar.{ext}", tmpdir.name)
-
-        ib_path = os.path.join(tmpdir.name, f"openwrt-imagebuilder.tar.{ext}")
-
-        if ext == "zst":
-            with open(ib_path, 'rb') as f:
-                dctx = zstd.ZstdDecompressor()
-                with dctx.stream_reader(f) as reader, tarfile.open(fileobj=reader, mode="r|*") as tar:
-                    tar.extractall(paths.workdir)  # noqa: S202
-                    shutil.move(os.path.join(paths.workdir, tar.getnames()[0]), os.path.join(paths.workdir, "ImageBuilder"))
-        else:
-            with tarfile.open(os.path.join(tmpdir.name, "openwrt-imagebuilder.tar.xz"), "r:xz") as tar:
-                tar.extractall(paths.workdir)  # noqa: S202
-                shutil.move(os.path.join(paths.workdir, tar.getnames()[0]), os.path.join(paths.workdir, "ImageBuilder"))
+        ib_path = dl_artifact(f"Image_Builder-{cfg["name"]}")
+        names = extract_artifact_archive(ib_path, "openwrt-imagebuilder", paths.workdir)
+        shutil.move(os.path.join(paths.workdir, names[0]), os.path.join(paths.workdir, "ImageBuilder"))
 
         ib = ImageBuilder(os.path.join(paths.workdir, "ImageBuilder"))
 
-        pkgs_path = dl_artifact(f"packages-{cfg['name']}", tmpdir.name)
+        pkgs_path = dl_artifact(f"packages-{cfg['name']}")
         with zipfile.ZipFile(pkgs_path, "r") as zip_ref:
             for membber in zip_ref.infolist():
                 if not os.path.exists(os.path.join(ib.packages_path, membber.filename)) and not membber.is_dir():
                     with zip_ref.open(membber) as f, open(os.path.join(ib.packages_path, os.path.basename(membber.filename)), "wb") as fw:
                         shutil.copyfileobj(f, fw)
                         logger.debug("解压文件 %s到 %s", membber.filename, os.path.join(ib.packages_path, os.path.basename(membber.filename)))
+        os.remove(pkgs_path)
 
         shutil.copytree(os.path.join(openwrt.path, "files"), os.path.join(ib.path, "files"))
         if os.path.exists(os.path.join(ib.path, ".config")):
@@ -118,6 +114,11 @@ def prepare(cfg: dict) -> None:
     core.set_output("use-cache", cfg["compile"]["use_cache"])
     core.set_output("openwrt-path", openwrt.path)
 
+def upload_build_timing(openwrt: OpenWrt, name: str) -> None:
+    logger.info("生成编译耗时报告...")
+    report = get_build_timer().report(openwrt.path, os.path.join(paths.uploads, "build-timing", f"{name}.json"))
+    uploader.add(f"build-timing-{name}", report, retention_days=7)
+
 def base_builds(cfg: dict) -> None:
     openwrt = OpenWrt(os.path.join(paths.workdir, "openwrt"))
 
@@ -153,11 +154,11 @@ def base_builds(cfg: dict) -> None:
     openwrt.make("target/compile")
 
     logger.info("归档文件...")
-    tar_path = os.path.join(paths.uploads, "builds.tar.gz")
-    with tarfile.open(tar_path, "w:gz") as tar:
-        tar.add(os.path.join(openwrt.path, "staging_dir"), arcname="staging_dir")
-        tar.add(os.path.join(openwrt.path, "build_dir"), arcname="build_dir")
+    tar_path = os.path.join(paths.uploads, "builds.tar.zst")
+    create_archive(tar_path, {os.path.join(openwrt.path, "staging_dir"): "staging_dir",
+                              os.path.join(openwrt.path, "build_dir"): "build_dir"})
     uploader.add(f"base-builds-{cfg["name"]}", tar_path, retention_days=1, compression_level=0)
+    upload_build_timing(openwrt, f"base-builds-{cfg['name']}")
 
     logger.info("删除旧缓存...")
     del_cache(get_cache_restore_key(openwrt, cfg))
@@ -185,6 +186,7 @@ def build_packages(cfg: dict) -> None:
                 shutil.copy2(os.path.join(root, file), packages_path)
                 logger.debug(f"复制 {file} 到 {packages_path}")
     uploader.add(f"packages-{cfg['name']}", packages_path, retention_days=1)
+    upload_build_timing(openwrt, f"packages-{cfg['name']}")
 
     logger.info("删除旧缓存...")
     del_cache(get_cache_restore_key(openwrt, cfg))
@@ -254,6 +256,7 @@ def build_image_builder(cfg: dict) -> None:
     shutil.move(bl_path, os.path.join(paths.uploads, f"openwrt-imagebuilder.tar.{ext}"))
     bl_path = os.path.join(paths.uploads, f"openwrt-imagebuilder.tar.{ext}")
     uploader.add(f"Image_Builder-{cfg['name']}", bl_path, retention_days=1, compression_level=0)
+    upload_build_timing(openwrt, f"Image_Builder-{cfg['name']}")
 
     logger.info("删除旧缓存...")
     del_cache(get_cache_restore_key(openwrt, cfg))
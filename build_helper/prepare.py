@@ -5,20 +5,21 @@ import json
 import os
 import re
 import shutil
-import tarfile
 from datetime import datetime, timedelta, timezone
 from multiprocessing.pool import Pool
 from typing import Any
 
 import pygit2
 
-from .utils.downloader import DLTask, dl2, wait_dl_tasks
+from .utils.dl_extract import dl_extract
+from .utils.downloader import DLPriority, DLTask, dl2, wait_dl_tasks
 from .utils.error import ConfigError, ConfigParseError
 from .utils.logger import logger
 from .utils.network import get_gh_repo_last_releases, request_get
 from .utils.openwrt import OpenWrt
+from .utils.patch_store import prefetch_upstream_patches, wait_prefetched_patches
 from .utils.paths import paths
-from .utils.repo import compiler, get_release_suffix, user_repo
+from .utils.repo import get_compiler, get_release_suffix, user_repo
 from .utils.upload import uploader
 from .utils.utils import parse_config
 
@@ -191,15 +192,19 @@ def prepare(configs: dict[str, dict[str, Any]]) -> None:
     }
     dl_tasks: list[DLTask] = []
     for name, url in filters.items():
-        dl_tasks.append(dl2(url, os.path.join(adg_filters_path, name)))
+        dl_tasks.append(dl2(url, os.path.join(adg_filters_path, name), priority=DLPriority.LOW))
 
     dl_tasks.append(dl2("https://raw.githubusercontent.com/chenmozhijin/AdGuardHome-Rules/main/AdGuardHome-dnslist(by%20cmzj).yaml",
                      os.path.join(global_files_path, "etc", "AdGuardHome-dnslist(by cmzj).yaml")))
 
+    # 预先下载各配置需要的上游补丁, 各配置的处理进程直接从补丁库中读取
+    patch_tasks = prefetch_upstream_patches(openwrt.tag_branch for openwrt in openwrts.values())
+
     wait_dl_tasks(dl_tasks)
+    wait_prefetched_patches(patch_tasks)
 
     # 获取用户信息
-    logger.info("编译者：%s", compiler)
+    logger.info("编译者：%s", get_compiler())
 
     tasks = []
     for cfg_name, openwrt in openwrts.items():
@@ -280,11 +285,11 @@ def prepare_cfg(config: dict[str, Any],
     # 添加turboacc补丁
     turboacc_dir = os.path.join(cloned_repos[("https://github.com/chenmozhijin/turboacc", "package")])
     kernel_version = openwrt.get_kernel_version()
-    enable_sfe = (openwrt.get_package_config("kmod-shortcut-fe") in ("y", "m") or
-               openwrt.get_package_config("kmod-shortcut-fe-drv") in ("y", "m") or
-               openwrt.get_package_config("kmod-shortcut-fe-cm") in ("y", "m") or
-               openwrt.get_package_config("kmod-fast-classifier") in ("y", "m"))
-    enable_fullcone = openwrt.get_package_config("kmod-nft-fullcone") in ("y", "m")
+    package_configs = openwrt.get_package_configs(["kmod-shortcut-fe", "kmod-shortcut-fe-drv", "kmod-shortcut-fe-cm", "kmod-fast-classifier",
+                                                   "kmod-nft-fullcone", "luci-app-adguardhome", "luci-app-openclash"])
+    enable_sfe = any(package_configs[package] in ("y", "m")
+                     for package in ("kmod-shortcut-fe", "kmod-shortcut-fe-drv", "kmod-shortcut-fe-cm", "kmod-fast-classifier"))
+    enable_fullcone = package_configs["kmod-nft-fullcone"] in ("y", "m")
     if enable_fullcone or enable_sfe:
         logger.info("%s添加952补丁", cfg_name)
         patch925 = f"952{"-add" if kernel_version != "5.10" else ""}-net-conntrack-events-support-multiple-registrant.patch"
@@ -368,54 +373,36 @@ def prepare_cfg(config: dict[str, Any],
         case _:
             adg_arch, clash_arch = None, None
 
-    tmpdir = paths.get_tmpdir()
+    clash_core_path = os.path.join(files_path, "etc", "openclash", "core")
+    if not os.path.isdir(clash_core_path):
+        os.makedirs(clash_core_path)
+
+    # 边下载边解压, 只写出需要的文件
     dl_tasks: list[DLTask] = []
-    if adg_arch and openwrt.get_package_config("luci-app-adguardhome") == "y":
+    if adg_arch and package_configs["luci-app-adguardhome"] == "y":
         logger.info("%s下载架构为%s的AdGuardHome核心", cfg_name, adg_arch)
         releases = get_gh_repo_last_releases("AdguardTeam/AdGuardHome")
         if releases:
             for asset in releases["assets"]:
                 if asset["name"] == f"AdGuardHome_linux_{adg_arch}.tar.gz":
-                    dl_tasks.append(dl2(asset["browser_download_url"], os.path.join(tmpdir.name, "AdGuardHome.tar.gz")))
+                    # GitHub API 在 digest 字段中提供 "sha256:<hex>" 格式的资产哈希
+                    digest = asset.get("digest") or ""
+                    dl_tasks.append(dl_extract(asset["browser_download_url"],
+                                               {"./AdGuardHome/AdGuardHome": os.path.join(files_path, "usr", "bin", "AdGuardHome", "AdGuardHome")},
+                                               sha256=digest.removeprefix("sha256:") if digest.startswith("sha256:") else None,
+                                               mode=0o755))
                     break
             else:
                 logger.error("未找到可用的AdGuardHome二进制文件")
 
-    if clash_arch and openwrt.get_package_config("luci-app-openclash") == "y":
+    if clash_arch and package_configs["luci-app-openclash"] == "y":
         logger.info("%s下载架构为%s的OpenClash核心", cfg_name, clash_arch)
-        dl_tasks.append(dl2(f"https://raw.githubusercontent.com/vernesong/OpenClash/refs/heads/core/dev/meta/clash-{clash_arch}.tar.gz",
-                                os.path.join(tmpdir.name, "clash_meta.tar.gz")))
-        #dl_tasks.append(dl2(f"https://raw.githubusercontent.com/vernesong/OpenClash/refs/heads/core/dev/smart/clash-{clash_arch}.tar.gz",
-        #                        os.path.join(tmpdir.name, "clash.smart.tar.gz")))
+        dl_tasks.append(dl_extract(f"https://raw.githubusercontent.com/vernesong/OpenClash/refs/heads/core/dev/meta/clash-{clash_arch}.tar.gz",
+                                   {"clash": os.path.join(clash_core_path, "clash_meta")}, mode=0o755))
+        #dl_tasks.append(dl_extract(f"https://raw.githubusercontent.com/vernesong/OpenClash/refs/heads/core/dev/smart/clash-{clash_arch}.tar.gz",
+        #                           {"clash": os.path.join(clash_core_path, "clash")}, mode=0o755))
 
     wait_dl_tasks(dl_tasks)
-    # 解压
-    if os.path.isfile(os.path.join(tmpdir.name, "AdGuardHome.tar.gz")):
-        with tarfile.open(os.path.join(tmpdir.name, "AdGuardHome.tar.gz"), "r:gz") as tar:
-            if file := tar.extractfile("./AdGuardHome/AdGuardHome"):
-                with open(os.path.join(files_path, "usr", "bin", "AdGuardHome", "AdGuardHome"), "wb") as f:
-                    f.write(file.read())
-                os.chmod(os.path.join(files_path, "usr", "bin", "AdGuardHome", "AdGuardHome"), 0o755)  # noqa: S103
-
-    clash_core_path = os.path.join(files_path, "etc", "openclash", "core")
-    if not os.path.isdir(clash_core_path):
-        os.makedirs(clash_core_path)
-
-    if os.path.isfile(os.path.join(tmpdir.name, "clash_meta.tar.gz")):
-        with tarfile.open(os.path.join(tmpdir.name, "clash_meta.tar.gz"), "r:gz") as tar:
-            if file := tar.extractfile("clash"):
-                with open(os.path.join(clash_core_path, "clash_meta"), "wb") as f:
-                    f.write(file.read())
-                os.chmod(os.path.join(clash_core_path, "clash_meta"), 0o755)  # noqa: S103
-
-    #if os.path.isfile(os.path.join(tmpdir.name, "clash.smart.tar.gz")):
-    #    with tarfile.open(os.path.join(tmpdir.name, "clash.smart.tar.gz"), "r:gz") as tar:
-    #        if file := tar.extractfile("clash"):
-    #            with open(os.path.join(clash_core_path, "clash"), "wb") as f:
-    #                f.write(file.read())
-    #            os.chmod(os.path.join(clash_core_path, "clash"), 0o755)  # noqa: S103
-
-    tmpdir.cleanup()
 
     # 获取bt_trackers
     bt_tracker = request_get("https://github.com/XIU2/TrackersListCollection/raw/master/all_aria2.txt")
@@ -429,7 +416,7 @@ def prepare_cfg(config: dict[str, Any],
             elif line.startswith("uci set network.lan.ipaddr="):
                 f.write(f"uci set network.lan.ipaddr='{config["openwrtext"]["ipaddr"]}'\n")
             elif "Compiled by 沉默の金" in line:
-                f.write(line.replace("Compiled by 沉默の金", f"Compiled by {compiler}") + "\n")
+                f.write(line.replace("Compiled by 沉默の金", f"Compiled by {get_compiler()}") + "\n")
             else:
                 f.write(line + "\n")
 
@@ -452,16 +439,15 @@ def prepare_cfg(config: dict[str, Any],
     with open(os.path.join(openwrt.files, "etc", "openwrt-k_info"), "w", encoding="utf-8") as f:
         content = ""
         content += f'COMPILE_START_TIME="{datetime.now(timezone(timedelta(hours=8))).strftime('%y.%m.%d-%H')}"\n'
-        content += f'COMPILER="{compiler}"\n'
+        content += f'COMPILER="{get_compiler()}"\n'
         content += f'REPOSITORY_URL="https://github.com/{user_repo}"\n'
         content += f'TAG_SUFFIX="{get_release_suffix(config)[1]}"\n'
         f.write(content)
     logger.debug("openwrt-k_info: %s", content)
 
     logger.info("%s生成源代码归档", cfg_name)
-    shutil.rmtree(os.path.join(openwrt.path, ".git"))
     os.makedirs(os.path.join(paths.uploads, cfg_name), exist_ok=True)
-    tar_path = os.path.join(paths.uploads, cfg_name, "openwrt-source.tar.gz")
+    tar_path = os.path.join(paths.uploads, cfg_name, "openwrt-source.tar.zst")
     openwrt.archive(tar_path)
 
     return cfg_name, config, tar_path
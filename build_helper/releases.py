@@ -5,13 +5,11 @@ import os
 import shutil
 from datetime import datetime, timedelta, timezone
 
-from actions_toolkit.github import Context
-
 from .utils.logger import logger
 from .utils.network import request_get
 from .utils.openwrt import ImageBuilder, OpenWrt
 from .utils.paths import paths
-from .utils.repo import dl_artifact, get_current_commit, match_releases, new_release, repo, user_repo
+from .utils.repo import dl_artifact, get_current_commit, get_workflow_run, match_releases, new_release, user_repo
 
 
 def releases(cfg: dict) -> None:
@@ -19,16 +17,13 @@ def releases(cfg: dict) -> None:
     logger.info("下载artifact...")
 
 
-    tmpdir = paths.get_tmpdir()
-    pkgs_archive_path = dl_artifact(f"packages-{cfg['name']}", tmpdir.name)
+    pkgs_archive_path = dl_artifact(f"packages-{cfg['name']}")
     shutil.move(pkgs_archive_path, os.path.join(paths.uploads, "packages.zip"))
     pkgs_archive_path = os.path.join(paths.uploads, "packages.zip")
-    kmods_archive_path = dl_artifact(f"kmods-{cfg['name']}", tmpdir.name)
+    kmods_archive_path = dl_artifact(f"kmods-{cfg['name']}")
     shutil.move(kmods_archive_path, os.path.join(paths.uploads, "kmods.zip"))
     kmods_archive_path = os.path.join(paths.uploads, "kmods.zip")
 
-    tmpdir.cleanup()
-
     ib = ImageBuilder(os.path.join(paths.workdir, "ImageBuilder"))
     openwrt = OpenWrt(os.path.join(paths.workdir, "openwrt"))
     target, subtarget = ib.get_target()
@@ -62,17 +57,15 @@ def releases(cfg: dict) -> None:
 
     current_packages = {line.split(" - ")[0]: line.split(" - ")[1] for line in current_manifest.splitlines()} if current_manifest else None
 
-    context = Context()
-
     try:
         changelog = ""
         if release := match_releases(cfg):
             packages = openwrt.get_packageinfos()
 
             old_manifest = None
-            for asset in release.get_assets():
-                if asset.name.endswith(".manifest"):
-                    old_manifest = request_get(asset.browser_download_url)
+            for asset in release["assets"]:
+                if asset["name"].endswith(".manifest"):
+                    old_manifest = request_get(asset["browser_download_url"])
 
             if old_manifest and current_packages:
                 old_packages = {line.split(" - ")[0]: line.split(" - ")[1] for line in old_manifest.splitlines()}
@@ -92,8 +85,8 @@ def releases(cfg: dict) -> None:
 
         body = f"编译完成于: {datetime.now(timezone(timedelta(hours=8))).strftime('%Y-%m-%d %H:%M:%S')}\n"
         body += f"使用的配置: [{cfg['name']}](https://github.com/{user_repo}/tree/{get_current_commit()}/config/{cfg['name']})\n"
-        workflow_run = repo.get_workflow_run(context.run_id)
-        body += f"编译此固件的工作流运行: [{workflow_run.display_title}]({workflow_run.html_url}) ({workflow_run.event})\n"
+        workflow_run = get_workflow_run()
+        body += f"编译此固件的工作流运行: [{workflow_run['display_title']}]({workflow_run['html_url']}) ({workflow_run['event']})\n"
         if profiles:
             if (version_number := profiles.get("version_number")) and (version_code := profiles.get('version_code')):
                 body += f"OpenWrt版本: {version_number} {version_code}\n"
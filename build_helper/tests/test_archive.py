@@ -0,0 +1,70 @@
+# SPDX-FileCopyrightText: Copyright (c) 2024-2025 沉默の金 <cmzj@cmzj.org>
+# SPDX-License-Identifier: MIT
+import io
+import lzma
+import os
+import shutil
+import subprocess
+import tarfile
+import threading
+from collections.abc import Callable
+from pathlib import Path
+
+import pytest
+
+from build_helper.utils.archive import extract_archive_stream, open_archive_stream
+
+pytestmark = pytest.mark.skipif(shutil.which("xz") is None, reason="需要 xz 命令")
+
+
+def _tar_xz(size: int) -> bytes:
+    """生成包含一个随机内容文件的 .tar.xz, 随机内容使解压后的数据远大于管道缓冲区"""
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w") as tar:
+        info = tarfile.TarInfo("data.bin")
+        info.size = size
+        tar.addfile(info, io.BytesIO(os.urandom(size)))
+    return lzma.compress(buffer.getvalue())
+
+
+def _run_with_timeout(target: Callable[[], object], timeout: float = 30) -> BaseException | None:
+    errors: list[BaseException] = []
+
+    def run() -> None:
+        try:
+            target()
+        except BaseException as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), "解压在异常后没有退出"
+    return errors[0] if errors else None
+
+
+def test_xz_exception_in_consumer_does_not_hang() -> None:
+    data = _tar_xz(8 * 1024 * 1024)
+
+    def consume() -> None:
+        with open_archive_stream(io.BufferedReader(io.BytesIO(data))) as tar:
+            tar.next()
+            msg = "consumer failed"
+            raise RuntimeError(msg)
+
+    error = _run_with_timeout(consume)
+    assert isinstance(error, RuntimeError)
+
+
+def test_xz_corrupt_raises(tmp_path: Path) -> None:
+    data = bytearray(_tar_xz(1024 * 1024))
+    data[len(data) // 2:] = bytes(len(data) - len(data) // 2)
+
+    error = _run_with_timeout(lambda: extract_archive_stream(io.BufferedReader(io.BytesIO(bytes(data))), str(tmp_path)))
+    assert isinstance(error, subprocess.CalledProcessError)
+
+
+def test_xz_roundtrip(tmp_path: Path) -> None:
+    names = extract_archive_stream(io.BufferedReader(io.BytesIO(_tar_xz(1024))), str(tmp_path))
+    assert names == ["data.bin"]
+    assert os.path.getsize(os.path.join(tmp_path, "data.bin")) == 1024
@@ -0,0 +1,57 @@
+# SPDX-FileCopyrightText: Copyright (c) 2024-2025 沉默の金 <cmzj@cmzj.org>
+# SPDX-License-Identifier: MIT
+import hashlib
+import os
+import stat
+from pathlib import Path
+
+from build_helper.utils.dl_cache import DLCache
+
+URL = "https://example.com/file.tar.gz"
+DATA = b"cached content"
+
+
+def _cache(tmp_path: Path) -> DLCache:
+    return DLCache(str(tmp_path / "cache"), 1024 * 1024)
+
+
+def test_modifying_destination_does_not_corrupt_cache(tmp_path: Path) -> None:
+    cache = _cache(tmp_path)
+    path = tmp_path / "file.tar.gz"
+    path.write_bytes(DATA)
+    cache.store(URL, str(path), '"etag"', None)
+
+    entry = cache.get(URL)
+    assert entry is not None
+    blob = os.path.join(cache.blobs, entry["sha256"])
+    assert not os.path.samefile(blob, path)
+    assert stat.S_IMODE(os.stat(blob).st_mode) == 0o444
+
+    # 例如解压 core 后 chmod 或覆盖写入
+    path.chmod(0o755)
+    path.write_bytes(b"modified")
+
+    restored = tmp_path / "restored"
+    assert cache.restore(URL, str(restored)) == hashlib.sha256(DATA).hexdigest()
+    assert restored.read_bytes() == DATA
+    restored.write_bytes(b"modified again")
+    assert cache.restore(URL, str(restored)) is not None
+    assert restored.read_bytes() == DATA
+
+
+def test_damaged_blob_is_not_served(tmp_path: Path) -> None:
+    cache = _cache(tmp_path)
+    path = tmp_path / "file.tar.gz"
+    path.write_bytes(DATA)
+    cache.store(URL, str(path), None, "Mon, 01 Jan 2024 00:00:00 GMT")
+
+    entry = cache.get(URL)
+    assert entry is not None
+    blob = os.path.join(cache.blobs, entry["sha256"])
+    os.chmod(blob, 0o644)
+    with open(blob, "ab") as f:
+        f.write(b"garbage")
+
+    assert cache.get(URL) is None
+    assert cache.restore(URL, str(tmp_path / "restored")) is None
+    assert not (tmp_path / "restored").exists()
@@ -0,0 +1,131 @@
+# SPDX-FileCopyrightText: Copyright (c) 2024-2025 沉默の金 <cmzj@cmzj.org>
+# SPDX-License-Identifier: MIT
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from collections.abc import Iterator
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+
+DATA = os.urandom(8 * 1024 * 1024)
+ETAG = '"test-etag"'
+# 每个连接约 1.6MiB/s, 保证下载进程能在中途被结束
+SEND_SIZE = 16 * 1024
+SEND_INTERVAL = 0.01
+
+REPO_ROOT = Path(__file__).resolve().parents[2]
+DL_SCRIPT = """
+import sys
+sys.path.insert(0, {root!r})
+from build_helper.utils.downloader import dl2, wait_dl_tasks
+wait_dl_tasks([dl2({url!r}, {path!r}, cache=False, mirrors=[])])
+"""
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    """支持 Range 请求的限速服务器, 记录每个 GET 请求的字节范围"""
+
+    requests: list[tuple[int, int]]
+
+    def _headers(self, status: int, start: int, end: int) -> None:
+        self.send_response(status)
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", ETAG)
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(DATA)}")
+        self.end_headers()
+
+    def do_HEAD(self) -> None:
+        self._headers(200, 0, len(DATA) - 1)
+
+    def do_GET(self) -> None:
+        start, end = 0, len(DATA) - 1
+        status = 200
+        if (range_header := self.headers.get("Range")) and range_header.startswith("bytes="):
+            first, _, last = range_header.removeprefix("bytes=").partition("-")
+            start, end = int(first), min(int(last) if last else end, end)
+            status = 206
+        self.requests.append((start, end))
+        self._headers(status, start, end)
+        try:
+            for pos in range(start, end + 1, SEND_SIZE):
+                self.wfile.write(DATA[pos:min(pos + SEND_SIZE, end + 1)])
+                time.sleep(SEND_INTERVAL)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def log_message(self, format: str, *args: object) -> None:  # noqa: A002
+        pass
+
+
+@pytest.fixture
+def server() -> Iterator[tuple[str, list[tuple[int, int]]]]:
+    requests: list[tuple[int, int]] = []
+    handler = type("Handler", (RangeHandler,), {"requests": requests})
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    httpd.daemon_threads = True
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}/file.bin", requests
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def _start_download(tmp_path: Path, url: str, path: str) -> subprocess.Popen:
+    script = tmp_path / "dl.py"
+    script.write_text(DL_SCRIPT.format(root=str(REPO_ROOT), url=url, path=path), encoding="utf-8")
+    env = {**os.environ, "GITHUB_WORKSPACE": str(tmp_path)}
+    return subprocess.Popen([sys.executable, str(script)], cwd=tmp_path, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def _wait_journal(journal_path: str, timeout: float = 30) -> None:
+    """等待日志中出现已完成的范围"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with open(journal_path, encoding="utf-8") as f:
+                if json.load(f)["done"]:
+                    return
+        except (OSError, ValueError):
+            pass
+        time.sleep(0.01)
+    msg = "下载进程没有写入日志"
+    raise TimeoutError(msg)
+
+
+def test_resume_after_kill(tmp_path: Path, server: tuple[str, list[tuple[int, int]]]) -> None:
+    url, requests = server
+    path = str(tmp_path / "file.bin")
+    journal_path = path + ".part.json"
+
+    process = _start_download(tmp_path, url, path)
+    try:
+        _wait_journal(journal_path)
+    finally:
+        process.kill()
+        process.wait()
+    assert not os.path.exists(path), "下载在被结束前已经完成"
+
+    with open(journal_path, encoding="utf-8") as f:
+        done = [(start, end) for start, end in json.load(f)["done"]]
+    assert done
+    requests.clear()
+
+    process = _start_download(tmp_path, url, path)
+    assert process.wait(timeout=60) == 0
+
+    with open(path, "rb") as f:
+        assert f.read() == DATA
+    assert not os.path.exists(journal_path)
+    assert not os.path.exists(path + ".part")
+    # 续传时只请求日志中缺失的部分
+    assert requests
+    for start, end in requests:
+        assert all(end < done_start or start > done_end for done_start, done_end in done)
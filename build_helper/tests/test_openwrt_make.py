@@ -0,0 +1,114 @@
+# SPDX-FileCopyrightText: Copyright (c) 2024-2025 沉默の金 <cmzj@cmzj.org>
+# SPDX-License-Identifier: MIT
+import os
+import time
+from pathlib import Path
+
+import pytest
+
+from build_helper.utils.openwrt import FAILED_BUILD_PATTERN, BuildError, OpenWrtBase
+from build_helper.utils.paths import paths
+
+# package/compile 的输出片段, 失败时 include/subdir.mk 在末尾汇总失败的子目录
+MAKE_OUTPUT = """\
+ make[2] -C package/libs/toolchain compile
+ make[2] -C package/feeds/packages/foo compile
+ make[2] -C package/feeds/packages/rust host-compile
+make[3]: *** [Makefile:50: /openwrt/build_dir/target-x86_64_musl/foo-1.0/.built] Error 1
+    ERROR: package/feeds/packages/foo failed to build.
+    ERROR: package/feeds/packages/rust [host] failed to build.
+make[1]: *** [package/Makefile:129: package/compile] Error 1
+make: *** [/openwrt/include/toplevel.mk:233: package/compile] Error 2
+"""
+
+# 模拟 make: 第一次编译 target 时按 MAKE_OUTPUT 失败并写出 logs/, 单独编译子目录的结果由 SUBDIR_RESULT 决定
+FAKE_MAKE = """\
+#!/bin/sh
+echo "$@" >> calls.txt
+case "$1" in
+  package/compile)
+    if [ -e first-done ]; then exit 0; fi
+    touch first-done
+    mkdir -p logs/package/feeds/packages/foo logs/package/libs/toolchain
+    echo "make[3]: *** [Makefile:50: .built] Error 1" > logs/package/feeds/packages/foo/compile.txt
+    echo "done" > logs/package/libs/toolchain/compile.txt
+    cat make-output.txt
+    exit 2;;
+  */compile)
+    exit "$SUBDIR_RESULT";;
+esac
+exit 1
+"""
+
+
+@pytest.mark.parametrize(("line", "path", "host"), [
+    ("    ERROR: package/feeds/packages/foo failed to build.", "package/feeds/packages/foo", False),
+    ("    ERROR: package/feeds/packages/rust [host] failed to build.", "package/feeds/packages/rust", True),
+    ("ERROR: tools/cmake failed to build.", "tools/cmake", False),
+    ("make[1]: *** [package/Makefile:129: package/compile] Error 1", None, False),
+    ("WARNING: Makefile 'package/feeds/packages/foo/Makefile' has a dependency on 'bar', which does not exist", None, False),
+])
+def test_failed_build_pattern(line: str, path: str | None, host: bool) -> None:
+    match = FAILED_BUILD_PATTERN.search(line)
+    assert (match.group("path") if match else None) == path
+    assert bool(match and match.group("host")) is host
+
+
+def test_failed_from_logs(tmp_path: Path) -> None:
+    logs = tmp_path / "logs"
+    since = time.time()
+    samples = {
+        "package/feeds/packages/foo/compile.txt": "make[3]: *** [Makefile:50: .built] Error 1\n",
+        "package/libs/toolchain/compile.txt": "make[3]: Leaving directory '/openwrt/package/libs/toolchain'\n",
+        "package/feeds/packages/bar/dump.txt": "make[3]: *** [Makefile:10: dump] Error 2\n",
+        "tools/cmake/compile.txt": "x" * 8192 + "\nmake[2]: *** [Makefile:80: install] Error 2\n",
+        # 本次编译之前的日志不计入
+        "package/old/compile.txt": "make[3]: *** [Makefile:50: .built] Error 1\n",
+    }
+    for name, content in samples.items():
+        (logs / name).parent.mkdir(parents=True, exist_ok=True)
+        (logs / name).write_text(content, encoding="utf-8")
+    os.utime(logs / "package/old/compile.txt", (since - 60, since - 60))
+
+    failed = OpenWrtBase(str(tmp_path))._failed_from_logs(since)  # noqa: SLF001
+    assert sorted(failed) == ["package/feeds/packages/bar", "package/feeds/packages/foo", "tools/cmake"]
+
+
+@pytest.fixture
+def fake_make(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    openwrt = tmp_path / "openwrt"
+    bin_path = tmp_path / "bin"
+    openwrt.mkdir()
+    bin_path.mkdir()
+    (openwrt / "make-output.txt").write_text(MAKE_OUTPUT, encoding="utf-8")
+    (bin_path / "make").write_text(FAKE_MAKE, encoding="utf-8")
+    (bin_path / "make").chmod(0o755)
+    monkeypatch.setenv("PATH", f"{bin_path}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setattr(paths, "root", str(tmp_path))
+    return openwrt
+
+
+def _calls(openwrt: Path) -> list[str]:
+    return (openwrt / "calls.txt").read_text(encoding="utf-8").splitlines()
+
+
+def test_make_reports_failed_packages(fake_make: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setenv("SUBDIR_RESULT", "2")
+    with pytest.raises(BuildError) as e:
+        OpenWrtBase(str(fake_make)).make("package/compile")
+    assert e.value.failed == ["package/feeds/packages/foo", "package/feeds/packages/rust/host"]
+
+    calls = _calls(fake_make)
+    assert calls[0].startswith("package/compile ")
+    assert calls[0].endswith(" BUILD_LOG=1")
+    # 只单独重新编译失败的软件包, 不以 debug 模式重新编译整个 target
+    assert calls[1:] == ["package/feeds/packages/foo/compile -j1 V=s", "package/feeds/packages/rust/host/compile -j1 V=s"]
+
+
+def test_make_continues_when_failed_packages_build_alone(fake_make: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setenv("SUBDIR_RESULT", "0")
+    OpenWrtBase(str(fake_make)).make("package/compile")
+
+    calls = _calls(fake_make)
+    assert len(calls) == 4
+    assert calls[3] == calls[0]
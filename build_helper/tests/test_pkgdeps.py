@@ -0,0 +1,174 @@
+# SPDX-FileCopyrightText: Copyright (c) 2024-2025 沉默の金 <cmzj@cmzj.org>
+# SPDX-License-Identifier: MIT
+from pathlib import Path
+
+import pytest
+
+from build_helper.utils.dotconfig import DotConfig
+from build_helper.utils.metadata import parse_packageinfo
+from build_helper.utils.pkgdeps import Dependency, DepGraph, evaluate, parse_depends
+
+PACKAGEINFO = """\
+Source-Makefile: package/kernel/linux/Makefile
+Package: kmod-nls-base
+Section: kernel
+Category: Kernel modules
+Depends:
+Package: kmod-mii
+Depends:
+Package: kmod-usb-core
+Depends: @USB_SUPPORT +kmod-nls-base
+Package: kmod-usb-net
+Depends: @USB_SUPPORT +kmod-usb-core +kmod-mii
+Package: kmod-usb-net-cdc-ether
+Depends: +kmod-usb-net
+Package: kmod-usb-net-rndis
+Depends: +kmod-usb-net +kmod-usb-net-cdc-ether
+Package: kmod-sp5100-tco
+Depends: @TARGET_x86
+Package: kmod-ath
+Depends: +kmod-mac80211
+Package: kmod-hwmon-core
+Depends:
+Package: kmod-thermal
+Depends:
+Package: kmod-ath10k
+Depends: +kmod-ath +@DRIVER_11AC_SUPPORT @PCI_SUPPORT +ATH10K_THERMAL:kmod-hwmon-core +ATH10K_THERMAL:kmod-thermal
+Package: kmod-foo
+Depends: +kmod-not-exists +FOO:kmod-also-missing
+
+Source-Makefile: package/network/services/dnsmasq/Makefile
+Package: dnsmasq-full
+Provides: dnsmasq
+Depends: +libc +PACKAGE_dnsmasq_full_nftset:nftables-json
+
+Source-Makefile: feeds/luci/applications/luci-app-foo/Makefile
+Package: luci-app-foo
+Depends: +libc dnsmasq @(TARGET_x86||TARGET_armsr)
+Package: libc
+Depends:
+Package: nftables-json
+Depends: +libc
+"""
+
+DOTCONFIG = """\
+CONFIG_TARGET_x86=y
+CONFIG_TARGET_x86_64=y
+CONFIG_IPV6=y
+CONFIG_USB_SUPPORT=y
+CONFIG_PACKAGE_kmod-ipt-core=m
+CONFIG_TARGET_ARCH_PACKAGES="x86_64"
+# CONFIG_ATH10K_THERMAL is not set
+# CONFIG_SMALL_FLASH is not set
+"""
+
+
+@pytest.fixture
+def config(tmp_path: Path) -> DotConfig:
+    path = tmp_path / ".config"
+    path.write_text(DOTCONFIG, encoding="utf-8")
+    return DotConfig(str(path))
+
+
+@pytest.fixture
+def graph() -> DepGraph:
+    return DepGraph(parse_packageinfo(PACKAGEINFO.splitlines(keepends=True)))
+
+
+@pytest.mark.parametrize(("depends", "dependencies", "conditions"), [
+    (None, [], []),
+    ("", [], []),
+    ("+kmod-usb-net +kmod-usb-net-cdc-ether",
+     [Dependency("kmod-usb-net", True, None), Dependency("kmod-usb-net-cdc-ether", True, None)], []),
+    ("+libc dnsmasq", [Dependency("libc", True, None), Dependency("dnsmasq", False, None)], []),
+    ("@USB_SUPPORT +kmod-nls-base", [Dependency("kmod-nls-base", True, None)], ["USB_SUPPORT"]),
+    ("+kmod-ath +@DRIVER_11AC_SUPPORT @PCI_SUPPORT +ATH10K_THERMAL:kmod-thermal",
+     [Dependency("kmod-ath", True, None), Dependency("kmod-thermal", True, "ATH10K_THERMAL")],
+     ["DRIVER_11AC_SUPPORT", "PCI_SUPPORT"]),
+    ("@!SMALL_FLASH +!BUSYBOX_DEFAULT_IP:ip-tiny", [Dependency("ip-tiny", True, "!BUSYBOX_DEFAULT_IP")], ["!SMALL_FLASH"]),
+    ("+PACKAGE_kmod-ipt-core:kmod-ipt-conntrack", [Dependency("kmod-ipt-conntrack", True, "PACKAGE_kmod-ipt-core")], []),
+    ("+libc @(TARGET_x86||TARGET_armsr)", [Dependency("libc", True, None)], ["(TARGET_x86||TARGET_armsr)"]),
+    ("+(TARGET_x86 && IPV6):kmod-ip6tables kmod-nf-ipt", [Dependency("kmod-ip6tables", True, "(TARGET_x86 && IPV6)"),
+                                                           Dependency("kmod-nf-ipt", False, None)], []),
+    ("IPV6:@KERNEL_IPV6", [], ["!(IPV6) || (KERNEL_IPV6)"]),
+])
+def test_parse_depends(depends: str | None, dependencies: list[Dependency], conditions: list[str]) -> None:
+    assert parse_depends(depends) == (dependencies, conditions)
+
+
+@pytest.mark.parametrize(("expression", "expected"), [
+    ("TARGET_x86", True),
+    ("!TARGET_x86", False),
+    ("TARGET_ath79", False),
+    ("SMALL_FLASH", False),
+    ("!SMALL_FLASH", True),
+    ("PACKAGE_kmod-ipt-core", True),
+    ("PACKAGE_kmod-ipt-core=m", True),
+    ("PACKAGE_kmod-ipt-core=y", False),
+    ('TARGET_ARCH_PACKAGES="x86_64"', True),
+    ('TARGET_ARCH_PACKAGES!="x86_64"', False),
+    ("TARGET_x86 && !SMALL_FLASH", True),
+    ("TARGET_x86 && SMALL_FLASH", False),
+    ("TARGET_ath79 || TARGET_x86", True),
+    ("TARGET_ath79 && IPV6 || TARGET_x86", True),
+    ("TARGET_ath79 && (IPV6 || TARGET_x86)", False),
+    ("(TARGET_ath79||TARGET_ramips) && IPV6", False),
+    ("!(TARGET_ath79||TARGET_ramips) && IPV6", True),
+    ("!(IPV6) || (KERNEL_IPV6)", False),
+    # 无法解析时视为成立
+    ("TARGET_x86 &&", True),
+    ("(TARGET_ath79", True),
+])
+def test_evaluate(config: DotConfig, expression: str, expected: bool) -> None:
+    assert evaluate(expression, config) is expected
+
+
+def test_provides(graph: DepGraph) -> None:
+    assert graph.resolve("dnsmasq") == ["dnsmasq-full"]
+    assert graph.resolve("kmod-not-exists") == []
+    assert graph.dependencies("luci-app-foo") == ["libc", "dnsmasq-full"]
+
+
+@pytest.mark.parametrize(("package", "with_config", "expected"), [
+    ("kmod-ath10k", False, ["kmod-ath", "kmod-hwmon-core", "kmod-thermal"]),
+    ("kmod-ath10k", True, ["kmod-ath"]),
+    ("dnsmasq-full", False, ["libc", "nftables-json"]),
+    ("dnsmasq-full", True, ["libc"]),
+    ("kmod-sp5100-tco", True, []),
+])
+def test_conditional_dependencies(graph: DepGraph, config: DotConfig, package: str, with_config: bool, expected: list[str]) -> None:
+    assert graph.dependencies(package, config if with_config else None) == expected
+
+
+def test_conditions(graph: DepGraph, config: DotConfig) -> None:
+    assert graph.conditions["kmod-sp5100-tco"] == ["TARGET_x86"]
+    assert graph.conditions["luci-app-foo"] == ["(TARGET_x86||TARGET_armsr)"]
+    assert all(evaluate(condition, config) for condition in graph.conditions["luci-app-foo"])
+
+
+@pytest.mark.parametrize(("roots", "select_only", "expected"), [
+    (["kmod-usb-net-rndis"], False,
+     {"kmod-usb-net-rndis", "kmod-usb-net", "kmod-usb-net-cdc-ether", "kmod-usb-core", "kmod-mii", "kmod-nls-base"}),
+    (["luci-app-foo"], False, {"luci-app-foo", "libc", "dnsmasq-full"}),
+    (["luci-app-foo"], True, {"luci-app-foo", "libc"}),
+    (["dnsmasq"], False, {"dnsmasq-full", "libc"}),
+])
+def test_closure(graph: DepGraph, config: DotConfig, roots: list[str], select_only: bool, expected: set[str]) -> None:
+    assert graph.closure(roots, config, select_only=select_only) == expected
+
+
+def test_closure_without_config_is_upper_bound(graph: DepGraph) -> None:
+    assert graph.closure(["kmod-ath10k"]) == {"kmod-ath10k", "kmod-ath", "kmod-hwmon-core", "kmod-thermal"}
+
+
+def test_why(graph: DepGraph, config: DotConfig) -> None:
+    assert graph.why("kmod-nls-base", ["kmod-sp5100-tco", "kmod-usb-net-rndis"]) == \
+        ["kmod-usb-net-rndis", "kmod-usb-net", "kmod-usb-core", "kmod-nls-base"]
+    assert graph.why("dnsmasq-full", ["luci-app-foo"], config) == ["luci-app-foo", "dnsmasq-full"]
+    assert graph.why("dnsmasq-full", ["luci-app-foo"], config, select_only=True) is None
+    assert graph.why("kmod-thermal", ["kmod-ath10k"], config) is None
+
+
+def test_missing(graph: DepGraph) -> None:
+    # kmod-mac80211 不在示例中; 条件依赖不计入
+    assert graph.missing() == {"kmod-ath": ["kmod-mac80211"], "kmod-foo": ["kmod-not-exists"]}
@@ -0,0 +1,142 @@
+# SPDX-FileCopyrightText: Copyright (c) 2024-2025 沉默の金 <cmzj@cmzj.org>
+# SPDX-License-Identifier: MIT
+import contextlib
+import fnmatch
+import io
+import os
+import shutil
+import subprocess
+import tarfile
+import threading
+import zipfile
+from collections.abc import Callable, Iterable, Iterator
+from typing import BinaryIO
+
+import zstandard as zstd
+
+from .logger import logger
+
+# zstd 压缩等级与线程数, 线程数为 -1 时使用所有 CPU
+ZSTD_LEVEL = 6
+ZSTD_THREADS = -1
+
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+COPY_BUFFER_SIZE = 1024 * 1024
+
+
+def _exclude_filter(excludes: Iterable[str]) -> Callable[[tarfile.TarInfo], tarfile.TarInfo | None] | None:
+    """按归档内路径排除文件, 目录被排除时其中的内容不会被读取"""
+    patterns = list(excludes)
+    if not patterns:
+        return None
+
+    def _filter(tarinfo: tarfile.TarInfo) -> tarfile.TarInfo | None:
+        if any(fnmatch.fnmatchcase(tarinfo.name, pattern) for pattern in patterns):
+            logger.debug("归档时排除 %s", tarinfo.name)
+            return None
+        return tarinfo
+
+    return _filter
+
+
+def create_archive(path: str,
+                   sources: dict[str, str],
+                   excludes: Iterable[str] = (),
+                   level: int = ZSTD_LEVEL,
+                   threads: int = ZSTD_THREADS) -> None:
+    """将 sources(本地路径 -> 归档内路径)打包为 tar 归档
+
+    格式由 path 的扩展名决定: .tar.zst 使用多线程 zstd 流式压缩, 其他扩展名交给 tarfile 处理(如 .tar.gz);
+    excludes 为归档内路径的通配符, 如 "openwrt/.git"。
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tar_filter = _exclude_filter(excludes)
+    with contextlib.ExitStack() as stack:
+        if path.endswith(".tar.zst"):
+            f = stack.enter_context(open(path, "wb"))
+            writer = stack.enter_context(zstd.ZstdCompressor(level=level, threads=threads).stream_writer(f))
+            tar = stack.enter_context(tarfile.open(fileobj=writer, mode="w|"))
+        else:
+            compression = path.rsplit(".", 1)[-1]
+            tar = stack.enter_context(tarfile.open(path, f"w:{compression}" if compression in ("gz", "xz", "bz2") else "w"))
+        for source, arcname in sources.items():
+            tar.add(source, arcname=arcname, filter=tar_filter)
+    logger.debug("已生成归档 %s (%.1fMiB)", path, os.path.getsize(path) / 1024 / 1024)
+
+
+def detect_format(f: io.BufferedReader | zipfile.ZipExtFile) -> str:
+    """根据文件头判断压缩格式: zst/gz/xz/bz2/tar, 不消耗流中的数据"""
+    head = f.peek(6)[:6]
+    if head.startswith(ZSTD_MAGIC):
+        return "zst"
+    if head.startswith(b"\x1f\x8b"):
+        return "gz"
+    if head.startswith(b"\xfd7zXZ\x00"):
+        return "xz"
+    if head.startswith(b"BZh"):
+        return "bz2"
+    return "tar"
+
+
+@contextlib.contextmanager
+def _xz_decompress(f: BinaryIO, xz: str) -> Iterator[BinaryIO]:
+    """使用多线程的 xz 命令解压, 输入在线程中写入 xz 的标准输入"""
+    with subprocess.Popen([xz, "-d", "-c", "-T0"], stdin=subprocess.PIPE, stdout=subprocess.PIPE) as process:
+        stdin, stdout = process.stdin, process.stdout
+        if stdin is None or stdout is None:
+            msg = "无法连接xz进程"
+            raise RuntimeError(msg)
+
+        def feed() -> None:
+            with contextlib.suppress(BrokenPipeError), stdin:
+                shutil.copyfileobj(f, stdin, COPY_BUFFER_SIZE)
+
+        feeder = threading.Thread(target=feed, daemon=True)
+        feeder.start()
+        try:
+            yield stdout
+            # 读完剩余的输出, 保证 xz 能正常退出
+            while stdout.read(COPY_BUFFER_SIZE):
+                pass
+        except BaseException as e:
+            # 不再读取输出时 xz 会阻塞在写入上, 写入线程又阻塞在 xz 的输入上, 需要结束 xz 才能等待线程退出
+            stdout.close()
+            if process.poll() is None:
+                process.kill()
+            process.wait()
+            feeder.join()
+            if process.returncode > 0:
+                # xz 自行出错退出(如数据损坏)时, 解压得到的流是不完整的
+                raise subprocess.CalledProcessError(process.returncode, process.args) from e
+            raise
+        feeder.join()
+        if process.wait() != 0:
+            raise subprocess.CalledProcessError(process.returncode, process.args)
+
+
+@contextlib.contextmanager
+def open_archive_stream(f: io.BufferedReader | zipfile.ZipExtFile) -> Iterator[tarfile.TarFile]:
+    """以流模式打开 tar 归档, 自动识别压缩格式; f 只需顺序读取, 可以是 zip 中的成员"""
+    compression = detect_format(f)
+    if compression == "zst":
+        with zstd.ZstdDecompressor().stream_reader(f) as reader, tarfile.open(fileobj=reader, mode="r|") as tar:
+            yield tar
+    elif compression == "xz" and (xz := shutil.which("xz")):
+        with _xz_decompress(f, xz) as reader, tarfile.open(fileobj=reader, mode="r|") as tar:
+            yield tar
+    else:
+        with tarfile.open(fileobj=f, mode="r|*") as tar:
+            yield tar
+
+
+def extract_archive_stream(f: io.BufferedReader | zipfile.ZipExtFile, dest: str) -> list[str]:
+    """边读取边解压 tar 归档到 dest, 返回归档中的路径"""
+    with open_archive_stream(f) as tar:
+        tar.extractall(dest)  # noqa: S202
+        return tar.getnames()
+
+
+def extract_archive(path: str, dest: str) -> list[str]:
+    """解压 tar 归档到 dest, 返回归档中的路径"""
+    with open(path, "rb") as f:
+        return extract_archive_stream(f, dest)
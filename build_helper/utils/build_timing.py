@@ -0,0 +1,109 @@
+# SPDX-FileCopyrightText: Copyright (c) 2024-2025 沉默の金 <cmzj@cmzj.org>
+# SPDX-License-Identifier: MIT
+import json
+import os
+import re
+import threading
+import time
+from typing import NamedTuple
+
+from .logger import logger
+
+# make 默认输出中每个子目录步骤开始时的行, 如 " make[3] -C package/libs/toolchain compile"
+STEP_START_PATTERN = re.compile(r"^\s*make\[\d+\] -C (?P<subdir>\S+) (?P<step>\S+)")
+# 报告中列出的最慢步骤数
+TOP_N = 30
+
+
+class StepTiming(NamedTuple):
+    # 如 package/feeds/packages/rust/host/compile
+    step: str
+    start: float
+    end: float
+
+    @property
+    def duration(self) -> float:
+        return self.end - self.start
+
+
+class BuildTimer:
+    """记录各软件包编译步骤的耗时
+
+    开始时间取自 make 输出中的步骤开始行, 结束时间取自 BUILD_LOG 写入的 logs/<子目录>/<步骤>.txt 的最后修改时间。
+    """
+
+    def __init__(self) -> None:
+        self.starts: dict[str, float] = {}
+        # (make 目标, 开始时间, 结束时间)
+        self.targets: list[tuple[str, float, float]] = []
+        self.lock = threading.Lock()
+
+    def on_line(self, line: str) -> None:
+        if match := STEP_START_PATTERN.match(line):
+            step = f"{match.group('subdir')}/{match.group('step')}"
+            with self.lock:
+                self.starts.setdefault(step, time.time())
+
+    def add_target(self, target: str, start: float, end: float) -> None:
+        with self.lock:
+            self.targets.append((target, start, end))
+
+    def _start_of(self, step: str) -> float | None:
+        # 日志以 host/compile 保存的步骤在输出中可能显示为 host-compile
+        subdir, _, name = step.rpartition("/")
+        host_step = f"{os.path.dirname(subdir)}/host-{name}" if os.path.basename(subdir) == "host" else None
+        return self.starts.get(step) or (self.starts.get(host_step) if host_step else None)
+
+    def collect(self, openwrt_path: str) -> list[StepTiming]:
+        """从 logs/ 中取出本次编译的步骤耗时, 按耗时从长到短排序"""
+        if not self.targets:
+            return []
+        since = min(start for _, start, _ in self.targets)
+        logs_path = os.path.join(openwrt_path, "logs")
+        timings = []
+        for root, _, files in os.walk(logs_path):
+            for file in files:
+                path = os.path.join(root, file)
+                if not file.endswith(".txt") or (end := os.path.getmtime(path)) < since:
+                    continue
+                step = os.path.relpath(path, logs_path).removesuffix(".txt")
+                if (start := self._start_of(step)) is not None and end >= start:
+                    timings.append(StepTiming(step, start, end))
+        return sorted(timings, key=lambda timing: timing.duration, reverse=True)
+
+    def report(self, openwrt_path: str, path: str) -> list[str]:
+        """生成耗时报告, 写入 path(.json) 与同名的 .txt, 返回两个文件的路径"""
+        timings = self.collect(openwrt_path)
+        wall = sum(end - start for _, start, end in self.targets)
+        serial = sum(timing.duration for timing in timings)
+        report = {
+            "wall_time": round(wall, 1),
+            "serial_time": round(serial, 1),
+            "parallelism": round(serial / wall, 2) if wall else None,
+            "targets": [{"target": target, "duration": round(end - start, 1)} for target, start, end in self.targets],
+            "steps": [{"step": timing.step, "duration": round(timing.duration, 1)} for timing in timings],
+        }
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+        summary = [f"总耗时: {wall:.0f}s, 各步骤耗时之和: {serial:.0f}s, 平均并行度: {report['parallelism']}"]
+        summary.extend(f"{target}: {end - start:.0f}s" for target, start, end in self.targets)
+        slowest = [f"{timing.duration:8.0f}s  {timing.step}" for timing in timings[:TOP_N]]
+        text_path = os.path.splitext(path)[0] + ".txt"
+        with open(text_path, "w", encoding="utf-8") as f:
+            f.write("\n".join([*summary, "", f"耗时最长的{len(slowest)}个步骤:", *slowest]) + "\n")
+        logger.info("编译耗时:\n%s\n耗时最长的步骤:\n%s", "\n".join(summary), "\n".join(slowest[:10]))
+        return [path, text_path]
+
+
+_build_timer: BuildTimer | None = None
+_build_timer_lock = threading.Lock()
+
+
+def get_build_timer() -> BuildTimer:
+    global _build_timer  # noqa: PLW0603
+    with _build_timer_lock:
+        if _build_timer is None:
+            _build_timer = BuildTimer()
+        return _build_timer
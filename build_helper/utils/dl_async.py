@@ -0,0 +1,54 @@
+# SPDX-FileCopyrightText: Copyright (c) 2024-2025 沉默の金 <cmzj@cmzj.org>
+# SPDX-License-Identifier: MIT
+import asyncio
+import threading
+
+import httpx
+
+from .downloader import MAX_CONNECTIONS, MAX_TASKS, MAX_TASKS_PER_HOST, BaseDLScheduler, DLTask
+
+
+class AsyncDLScheduler(BaseDLScheduler):
+    """基于 asyncio 与 HTTP/2 的下载调度器
+
+    在后台线程中运行事件循环, 所有任务与分片复用同一个 httpx.AsyncClient,
+    同一主机的请求在少量 HTTP/2 连接上多路复用。对外接口与 DLScheduler 相同。
+    """
+
+    def __init__(self, max_tasks: int = MAX_TASKS, max_tasks_per_host: int = MAX_TASKS_PER_HOST, max_connections: int = MAX_CONNECTIONS) -> None:
+        super().__init__(max_tasks, max_tasks_per_host)
+        self.max_connections = max_connections
+        self.active = 0
+        # 保存运行中的 asyncio.Task 的引用, 防止被垃圾回收
+        self.running: set[asyncio.Task] = set()
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="dl-async", daemon=True)
+        self.thread.start()
+        self.client = asyncio.run_coroutine_threadsafe(self._create_client(), self.loop).result()
+
+    async def _create_client(self) -> httpx.AsyncClient:
+        return httpx.AsyncClient(http2=True,
+                                 follow_redirects=True,
+                                 limits=httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections))
+
+    def submit(self, task: DLTask) -> None:
+        super().submit(task)
+        self.loop.call_soon_threadsafe(self._dispatch)
+
+    def _dispatch(self) -> None:
+        """在事件循环中启动可运行的任务"""
+        with self.cond:
+            while self.active < self.max_tasks and (task := self._pop_task()) is not None:
+                self.active += 1
+                running = self.loop.create_task(self._run(task))
+                self.running.add(running)
+                running.add_done_callback(self.running.discard)
+
+    async def _run(self, task: DLTask) -> None:
+        try:
+            await task._run_async(self)  # noqa: SLF001
+        finally:
+            with self.cond:
+                self.active -= 1
+            self._release(task)
+            self._dispatch()
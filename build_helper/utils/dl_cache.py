@@ -0,0 +1,185 @@
+# SPDX-FileCopyrightText: Copyright (c) 2024-2025 沉默の金 <cmzj@cmzj.org>
+# SPDX-License-Identifier: MIT
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from collections.abc import Iterator
+
+from .logger import logger
+from .paths import paths
+
+# 缓存默认上限 (MiB), 可通过环境变量 BUILD_HELPER_DL_CACHE_SIZE 修改
+DEFAULT_MAX_SIZE_MB = 2048
+# linux/fs.h 中的 FICLONE, 在支持 reflink 的文件系统(btrfs/xfs)上共享数据块
+FICLONE = 0x40049409
+
+
+def _clone_file(src: str, dst: str) -> None:
+    """复制文件, 支持时使用 reflink; 与硬链接不同, 修改任一副本都不会影响另一个"""
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst, contextlib.suppress(OSError):
+        fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        return
+    shutil.copyfile(src, dst)
+
+
+class DLCache:
+    """按内容寻址的下载缓存
+
+    index.json 记录 url -> 校验器(ETag/Last-Modified)与内容哈希, 文件本体以 sha256 命名只读存放在 blobs 目录中,
+    存入与取出都复制文件, 下载目标之后被修改不会影响缓存。
+    索引的读写通过文件锁保护, 可以在 prepare 的多个进程间共享。
+    """
+
+    def __init__(self, root: str, max_size: int) -> None:
+        self.root = root
+        self.blobs = os.path.join(root, "blobs")
+        self.index_path = os.path.join(root, "index.json")
+        self.lock_path = os.path.join(root, ".lock")
+        self.max_size = max_size
+        self.thread_lock = threading.Lock()
+        os.makedirs(self.blobs, exist_ok=True)
+
+    @contextlib.contextmanager
+    def _locked_index(self) -> Iterator[dict[str, dict]]:
+        """在锁内读取索引, 退出时写回"""
+        with self.thread_lock, open(self.lock_path, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                index = self._read_index()
+                yield index
+                tmp_path = f"{self.index_path}.{os.getpid()}.tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(index, f)
+                os.replace(tmp_path, self.index_path)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _read_index(self) -> dict[str, dict]:
+        try:
+            with open(self.index_path, encoding="utf-8") as f:
+                index = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError):
+            logger.warning(f"Download cache index {self.index_path} is corrupted, reset.")
+            return {}
+        return index if isinstance(index, dict) else {}
+
+    def _blob_path(self, digest: str) -> str:
+        return os.path.join(self.blobs, digest)
+
+    def get(self, url: str) -> dict | None:
+        """获取 url 对应的缓存条目, 本体丢失或大小不符时视为未命中"""
+        entry = self._read_index().get(url)
+        if entry is None:
+            return None
+        blob = self._blob_path(entry["sha256"])
+        if not os.path.isfile(blob) or os.path.getsize(blob) != entry["size"]:
+            return None
+        return entry
+
+    def conditional_headers(self, url: str) -> dict[str, str]:
+        """生成条件请求头"""
+        headers = {}
+        if entry := self.get(url):
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def is_fresh(self, url: str, etag: str | None, last_modified: str | None) -> bool:
+        """服务器未返回 304 时, 比较校验器判断缓存是否仍然有效"""
+        if not (entry := self.get(url)):
+            return False
+        if etag and not etag.startswith("W/"):
+            return entry.get("etag") == etag
+        return bool(last_modified) and entry.get("last_modified") == last_modified
+
+    def restore(self, url: str, dest: str) -> str | None:
+        """将缓存的文件复制到目标路径, 返回其 sha256, 未命中时返回 None"""
+        with self._locked_index() as index:
+            entry = index.get(url)
+            if entry is None:
+                return None
+            blob = self._blob_path(entry["sha256"])
+            if not os.path.isfile(blob) or os.path.getsize(blob) != entry["size"]:
+                logger.warning(f"Download cache blob for {url} is missing or damaged, discarded.")
+                del index[url]
+                return None
+            if os.path.lexists(dest):
+                os.remove(dest)
+            _clone_file(blob, dest)
+            entry["atime"] = time.time()
+        logger.debug(f"Served {url} from download cache.")
+        return entry["sha256"]
+
+    def store(self, url: str, path: str, etag: str | None, last_modified: str | None, digest: str | None = None) -> None:
+        """将下载完成的文件加入缓存"""
+        if not etag and not last_modified:
+            # 没有校验器的响应无法重新验证, 不缓存
+            return
+        if digest is None:
+            with open(path, "rb") as f:
+                digest = hashlib.file_digest(f, "sha256").hexdigest()
+        blob = self._blob_path(digest)
+        if not os.path.exists(blob):
+            tmp_path = f"{blob}.{os.getpid()}.{threading.get_ident()}.tmp"
+            _clone_file(path, tmp_path)
+            os.chmod(tmp_path, 0o444)
+            os.replace(tmp_path, blob)
+        with self._locked_index() as index:
+            index[url] = {"etag": etag,
+                          "last_modified": last_modified,
+                          "sha256": digest,
+                          "size": os.path.getsize(blob),
+                          "atime": time.time()}
+            self._evict(index)
+
+    def _evict(self, index: dict[str, dict]) -> None:
+        """按最近使用时间淘汰条目, 并删除不再被引用的文件"""
+        referenced: dict[str, float] = {}
+        for entry in index.values():
+            referenced[entry["sha256"]] = max(referenced.get(entry["sha256"], 0), entry["atime"])
+        total = 0
+        for digest in os.listdir(self.blobs):
+            blob = self._blob_path(digest)
+            if digest.endswith(".tmp"):
+                continue
+            if digest not in referenced:
+                os.remove(blob)
+            else:
+                total += os.path.getsize(blob)
+
+        for digest, _atime in sorted(referenced.items(), key=lambda item: item[1]):
+            if total <= self.max_size:
+                break
+            blob = self._blob_path(digest)
+            if os.path.exists(blob):
+                total -= os.path.getsize(blob)
+                os.remove(blob)
+            for url in [url for url, entry in index.items() if entry["sha256"] == digest]:
+                logger.debug(f"Evicted {url} from download cache.")
+                del index[url]
+
+
+_dl_cache: DLCache | None = None
+_dl_cache_lock = threading.Lock()
+
+
+def cache_enabled() -> bool:
+    return os.getenv("BUILD_HELPER_DL_CACHE", "").lower() in ("1", "true")
+
+
+def get_dl_cache() -> DLCache:
+    global _dl_cache  # noqa: PLW0603
+    with _dl_cache_lock:
+        if _dl_cache is None:
+            max_size = int(os.getenv("BUILD_HELPER_DL_CACHE_SIZE", str(DEFAULT_MAX_SIZE_MB))) * 1024 * 1024
+            _dl_cache = DLCache(os.path.join(paths.workdir, "dl_cache"), max_size)
+        return _dl_cache
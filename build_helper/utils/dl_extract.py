@@ -0,0 +1,210 @@
+# SPDX-FileCopyrightText: Copyright (c) 2024-2025 沉默の金 <cmzj@cmzj.org>
+# SPDX-License-Identifier: MIT
+import asyncio
+import io
+import os
+import posixpath
+import shutil
+import tarfile
+from collections.abc import Iterator
+from typing import TYPE_CHECKING
+
+import httpx
+
+from .dl_mirrors import default_mirrors, expand_mirrors
+from .downloader import CHUNK_BUFFER_SIZE, DLPriority, DLTask, DownloadCancelledError, DownloadError, StreamHasher, get_scheduler
+
+if TYPE_CHECKING:
+    from .dl_async import AsyncDLScheduler
+    from .downloader import DLScheduler
+
+# async 后端中网络协程与解压线程之间最多缓冲的数据块数
+EXTRACT_QUEUE_SIZE = 8
+
+
+class _ChunkReader(io.RawIOBase):
+    """将数据块迭代器包装为只读流, 供 tarfile 的流模式读取"""
+
+    def __init__(self, chunks: Iterator[bytes]) -> None:
+        super().__init__()
+        self.chunks = chunks
+        self.buffer = memoryview(b"")
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b: bytearray | memoryview) -> int:
+        while not self.buffer:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                return 0
+            self.buffer = memoryview(chunk)
+        length = min(len(b), len(self.buffer))
+        b[:length] = self.buffer[:length]
+        self.buffer = self.buffer[length:]
+        return length
+
+
+def _normalize(name: str) -> str:
+    return posixpath.normpath(name).lstrip("/")
+
+
+class DLExtractTask(DLTask):
+    """边下载边解压 .tar.gz, 只把需要的成员直接写到目标路径, 不保留压缩包
+
+    tar 流只能顺序读取, 因此不使用分片与下载缓存; 失败时从头重新下载。
+    """
+
+    def __init__(self,
+                 url: str,
+                 members: dict[str, str],
+                 retry: int,
+                 headers: dict | None,
+                 priority: DLPriority = DLPriority.NORMAL,
+                 expected_sha256: str | None = None,
+                 mirrors: dict[str, str] | None = None,
+                 mode: int | None = None) -> None:
+        # path 使用第一个成员的目标路径, 用于日志与统计
+        super().__init__(url, next(iter(members.values())), retry, 1, headers, None, priority, expected_sha256, mirrors)
+        self.members = {_normalize(name): os.path.abspath(dest) for name, dest in members.items()}
+        self.mode = mode
+        for dest in self.members.values():
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+
+    def _cleanup(self) -> None:
+        for dest in self.members.values():
+            if os.path.exists(dest + ".part"):
+                os.remove(dest + ".part")
+
+    def _counted(self, chunks: Iterator[bytes]) -> Iterator[bytes]:
+        for chunk in chunks:
+            self._check_cancelled()
+            self.hasher.update(self.hasher.offset, chunk)
+            self.stats.record_bytes(len(chunk))
+            yield chunk
+
+    def _extract(self, chunks: Iterator[bytes]) -> None:
+        """从数据流中解压需要的成员, 全部写出后再替换到目标路径"""
+        self.hasher = StreamHasher()
+        pending = dict(self.members)
+        stream = self._counted(chunks)
+        try:
+            with tarfile.open(fileobj=_ChunkReader(stream), mode="r|gz") as tar:
+                for member in tar:
+                    if not member.isfile() or (dest := pending.pop(_normalize(member.name), None)) is None:
+                        continue
+                    if file := tar.extractfile(member):
+                        with open(dest + ".part", "wb") as f:
+                            shutil.copyfileobj(file, f, CHUNK_BUFFER_SIZE)
+                        os.chmod(dest + ".part", self.mode if self.mode is not None else member.mode & 0o777)
+                    if not pending:
+                        break
+            if pending:
+                msg = f"Members not found in archive: {', '.join(pending)}"
+                self._raise_download_error(DownloadError(msg, self))
+            if self.expected_sha256:
+                # 需要校验时读完剩余的数据, 否则直接丢弃
+                for _ in stream:
+                    pass
+                if (digest := self.hasher.hexdigest()) != self.expected_sha256:
+                    msg = f"SHA-256 mismatch: expected {self.expected_sha256}, got {digest}"
+                    self._raise_download_error(DownloadError(msg, self))
+                self.digest = digest
+        except BaseException:
+            self._cleanup()
+            raise
+        for dest in self.members.values():
+            self.stats.size += os.path.getsize(dest + ".part")
+            os.replace(dest + ".part", dest)
+
+    def _download(self, scheduler: "DLScheduler") -> None:
+        client = scheduler.client
+        if self.mirrors:
+            self._probe(client)
+        self.stats.mode = "stream"
+        for attempt in range(self.retry + 1):
+            url = self.sources[attempt % len(self.sources)]
+            try:
+                with client.stream("GET", url, headers=self._headers_for(url)) as response:
+                    response.raise_for_status()
+                    self._extract(response.iter_bytes(CHUNK_BUFFER_SIZE))
+                    return
+            except DownloadCancelledError:
+                raise
+            except Exception:
+                if attempt == self.retry:
+                    raise
+                self.stats.record_retry()
+                self._sleep_before_retry()
+
+    async def _extract_async(self, response: httpx.Response) -> None:
+        """网络数据在事件循环中接收, 解压在线程中进行, 两者通过有界队列衔接, 双方都阻塞等待而不轮询"""
+        loop = asyncio.get_running_loop()
+        chunks: asyncio.Queue[bytes | None] = asyncio.Queue(maxsize=EXTRACT_QUEUE_SIZE)
+
+        def receive() -> Iterator[bytes]:
+            # 在解压线程中等待事件循环中的队列
+            while (chunk := asyncio.run_coroutine_threadsafe(chunks.get(), loop).result()) is not None:
+                yield chunk
+
+        extractor = loop.run_in_executor(None, self._extract, receive())
+
+        async def feed(chunk: bytes | None) -> bool:
+            # 解压线程提前结束(已取得所需成员或出错)后不再写入队列
+            if extractor.done():
+                return False
+            put = asyncio.ensure_future(chunks.put(chunk))
+            await asyncio.wait([put, extractor], return_when=asyncio.FIRST_COMPLETED)
+            if not put.done():
+                put.cancel()
+                return False
+            return True
+
+        try:
+            async for chunk in response.aiter_bytes(CHUNK_BUFFER_SIZE):
+                if not await feed(chunk):
+                    break
+        finally:
+            await feed(None)
+            await asyncio.wait([extractor])
+        extractor.result()
+
+    async def _download_async(self, scheduler: "AsyncDLScheduler") -> None:
+        client = scheduler.client
+        if self.mirrors:
+            await self._probe_async(client)
+        self.stats.mode = "stream"
+        for attempt in range(self.retry + 1):
+            url = self.sources[attempt % len(self.sources)]
+            try:
+                async with client.stream("GET", url, headers=self._headers_for(url)) as response:
+                    response.raise_for_status()
+                    await self._extract_async(response)
+                    return
+            except DownloadCancelledError:
+                raise
+            except Exception:
+                if attempt == self.retry:
+                    raise
+                self.stats.record_retry()
+                await self._sleep_before_retry_async()
+
+
+def dl_extract(
+    url: str,
+    members: dict[str, str],
+    retry: int = 6,
+    headers: dict | None = None,
+    priority: DLPriority = DLPriority.NORMAL,
+    sha256: str | None = None,
+    mirrors: list[str] | None = None,
+    mode: int | None = None,
+) -> DLExtractTask:
+    """下载 .tar.gz 并直接解压其中的部分文件
+
+    members 为 压缩包内路径 -> 目标路径, 文件权限为 mode, 未指定时与压缩包内一致; 返回的任务同样使用 wait_dl_tasks 等待
+    """
+    mirror_urls = expand_mirrors(url, default_mirrors(url) if mirrors is None else mirrors)
+    task = DLExtractTask(url, members, retry, headers, priority, sha256, mirror_urls, mode)
+    get_scheduler().submit(task)
+    return task
@@ -0,0 +1,116 @@
+# SPDX-FileCopyrightText: Copyright (c) 2024-2025 沉默の金 <cmzj@cmzj.org>
+# SPDX-License-Identifier: MIT
+import contextlib
+import fcntl
+import json
+import os
+import threading
+from collections.abc import Iterator
+from urllib.parse import urlsplit
+
+from .logger import logger
+from .paths import paths
+
+# GitHub 文件的镜像模板, 多个模板以逗号分隔, 如 "https://ghfast.top/{url},jsdelivr"
+GH_MIRRORS_ENV = "BUILD_HELPER_GH_MIRRORS"
+GITHUB_HOSTS = ("github.com", "raw.githubusercontent.com")
+
+# 内置的模板别名
+BUILTIN_MIRRORS = {
+    # 仅适用于 raw.githubusercontent.com, jsDelivr 对分支有缓存, 建议配合 sha256 校验使用
+    "jsdelivr": "https://cdn.jsdelivr.net/gh/{owner}/{repo}@{ref}/{file}",
+}
+
+# 记录中表示直接访问原地址
+ORIGIN = "origin"
+
+
+def _template_fields(url: str) -> dict[str, str]:
+    """模板可用的字段: url 为原地址, path 为去掉协议的地址; raw.githubusercontent.com 的地址额外提供 owner/repo/ref/file"""
+    parts = urlsplit(url)
+    fields = {"url": url, "path": parts.netloc + parts.path}
+    if parts.netloc == "raw.githubusercontent.com":
+        segments = parts.path.strip("/").split("/")
+        # 兼容 /owner/repo/ref/file 与 /owner/repo/refs/heads/ref/file 两种形式
+        if len(segments) >= 6 and segments[2] == "refs" and segments[3] in ("heads", "tags"):
+            segments = [*segments[:2], segments[4], *segments[5:]]
+        if len(segments) >= 4:
+            fields.update(owner=segments[0], repo=segments[1], ref=segments[2], file="/".join(segments[3:]))
+    return fields
+
+
+def default_mirrors(url: str) -> list[str]:
+    """GitHub 地址默认使用环境变量中配置的镜像"""
+    if urlsplit(url).netloc not in GITHUB_HOSTS:
+        return []
+    return [template.strip() for template in os.getenv(GH_MIRRORS_ENV, "").split(",") if template.strip()]
+
+
+def expand_mirrors(url: str, templates: list[str]) -> dict[str, str]:
+    """将模板展开为 镜像地址 -> 模板, 缺少所需字段的模板会被跳过"""
+    fields = _template_fields(url)
+    mirrors = {}
+    for template in templates:
+        try:
+            mirror_url = BUILTIN_MIRRORS.get(template, template).format_map(fields)
+        except (KeyError, ValueError):
+            logger.debug(f"Mirror template {template} is not applicable to {url}, skipped.")
+            continue
+        if mirror_url != url:
+            mirrors[mirror_url] = template
+    return mirrors
+
+
+class MirrorRecord:
+    """记录每个源站上次最快的镜像, 供后续运行优先尝试"""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.lock_path = path + ".lock"
+        self.thread_lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def _locked(self) -> Iterator[dict[str, dict]]:
+        with self.thread_lock, open(self.lock_path, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                record = self._read()
+                yield record
+                tmp_path = f"{self.path}.{os.getpid()}.tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(record, f, ensure_ascii=False, indent=2)
+                os.replace(tmp_path, self.path)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _read(self) -> dict[str, dict]:
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        return record if isinstance(record, dict) else {}
+
+    def winner(self, host: str) -> str | None:
+        return self._read().get(host, {}).get("winner")
+
+    def record(self, host: str, template: str) -> None:
+        try:
+            with self._locked() as record:
+                entry = record.setdefault(host, {"winner": template, "wins": {}})
+                entry["winner"] = template
+                entry["wins"][template] = entry["wins"].get(template, 0) + 1
+        except OSError as e:
+            logger.warning(f"Failed to record mirror for {host}: {e}")
+
+
+_mirror_record: MirrorRecord | None = None
+_mirror_record_lock = threading.Lock()
+
+
+def get_mirror_record() -> MirrorRecord:
+    global _mirror_record  # noqa: PLW0603
+    with _mirror_record_lock:
+        if _mirror_record is None:
+            _mirror_record = MirrorRecord(os.path.join(paths.workdir, "dl_mirrors.json"))
+        return _mirror_record
@@ -0,0 +1,78 @@
+# SPDX-FileCopyrightText: Copyright (c) 2024-2025 沉默の金 <cmzj@cmzj.org>
+# SPDX-License-Identifier: MIT
+import os
+from collections.abc import Iterable, Iterator
+from typing import Literal
+
+
+class DotConfig:
+    """Kconfig .config 文件的只读索引
+
+    整个文件只解析一次为 符号(不含 CONFIG_ 前缀) -> 值 的字典, 按文件中的顺序保存;
+    每次查询前比较文件的 mtime、大小与 inode, 文件被 make defconfig 等修改后自动重新解析。
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._key: tuple[int, int, int] | None = None
+        self._symbols: dict[str, str] = {}
+        self._not_set: set[str] = set()
+
+    def _refresh(self) -> None:
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            self._key = None
+            self._symbols, self._not_set = {}, set()
+            return
+        key = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        if key == self._key:
+            return
+        symbols: dict[str, str] = {}
+        not_set: set[str] = set()
+        with open(self.path, encoding="utf-8", errors="replace") as f:
+            for line in f:
+                if line.startswith("CONFIG_"):
+                    symbol, sep, value = line.rstrip("\n").partition("=")
+                    if sep:
+                        symbols.setdefault(symbol[7:], value)
+                elif line.startswith("# CONFIG_") and line.rstrip().endswith(" is not set"):
+                    not_set.add(line[9:].rstrip().removesuffix(" is not set"))
+        self._symbols, self._not_set, self._key = symbols, not_set, key
+
+    @property
+    def exists(self) -> bool:
+        return os.path.isfile(self.path)
+
+    def raw(self, symbol: str) -> str | None:
+        """符号的原始值, 字符串值保留引号"""
+        self._refresh()
+        return self._symbols.get(symbol)
+
+    def get(self, symbol: str) -> str | None:
+        """符号的值, 字符串值去掉引号与转义"""
+        value = self.raw(symbol)
+        if value and len(value) >= 2 and value[0] == value[-1] == '"':
+            return value[1:-1].replace('\\"', '"').replace("\\\\", "\\")
+        return value
+
+    def is_not_set(self, symbol: str) -> bool:
+        self._refresh()
+        return symbol in self._not_set
+
+    def symbols(self) -> list[str]:
+        """按文件中的顺序返回所有已赋值的符号"""
+        self._refresh()
+        return list(self._symbols)
+
+    def items(self) -> Iterator[tuple[str, str]]:
+        """按文件中的顺序遍历所有已赋值的符号"""
+        self._refresh()
+        return iter(list(self._symbols.items()))
+
+    def get_package_config(self, package: str) -> Literal["y", "n", "m"] | None:
+        value = self.raw(f"PACKAGE_{package}")
+        return value if value in ("y", "n", "m") else None  # type: ignore[return-value]
+
+    def get_package_configs(self, packages: Iterable[str]) -> dict[str, Literal["y", "n", "m"] | None]:
+        return {package: self.get_package_config(package) for package in packages}
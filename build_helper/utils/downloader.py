@@ -1,14 +1,58 @@
 # SPDX-FileCopyrightText: Copyright (c) 2024-2025 沉默の金 <cmzj@cmzj.org>
 # SPDX-License-Identifier: MIT
+import asyncio
+import contextlib
+import hashlib
+import itertools
+import json
 import os
 import threading
 import time
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from collections.abc import Callable
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from enum import IntEnum
+from typing import TYPE_CHECKING, Any, BinaryIO
+from urllib.parse import urlsplit
 
 import httpx
 
+from .dl_cache import DLCache, cache_enabled, get_dl_cache
+from .dl_mirrors import ORIGIN, default_mirrors, expand_mirrors, get_mirror_record
 from .logger import logger
+from .paths import paths
 
+if TYPE_CHECKING:
+    from .dl_async import AsyncDLScheduler
+
+# 分片下载时每次从响应流中读取并写入的缓冲区大小
+CHUNK_BUFFER_SIZE = 256 * 1024
+
+# 动态分片: 每个分片请求的目标耗时与大小上下限, 可被窃取的最小剩余量, 以及判定分片停滞的时间
+RANGE_TARGET_SECONDS = 4
+MIN_RANGE_SIZE = 1024 * 1024
+MAX_RANGE_SIZE = 64 * 1024 * 1024
+MIN_STEAL_SIZE = 512 * 1024
+STALL_SECONDS = 10
+
+# 调度器的全局限制: 同时运行的任务数、单个主机同时运行的任务数、共享连接池的连接数
+MAX_TASKS = 8
+MAX_TASKS_PER_HOST = 4
+MAX_CONNECTIONS = 16
+
+# 多镜像竞速: 探测的总超时, 以及第一个镜像响应后继续等待其他镜像加入分片下载的时间
+PROBE_TIMEOUT = 10
+MIRROR_GRACE_SECONDS = 1
+
+# 探测结果: (状态码, 是否支持分片, 长度, ETag, Last-Modified)
+ProbeResult = tuple[int, bool, int, str | None, str | None]
+
+
+class DLPriority(IntEnum):
+    """下载任务优先级, 数值越小越先调度"""
+
+    HIGH = 0  # artifact 等后续步骤依赖的文件
+    NORMAL = 1
+    LOW = 2  # 过滤规则等小文件
 
 class DownloadError(Exception):
     def __init__(self, msg: str, task: "DLTask") -> None:
@@ -24,15 +68,336 @@ class DownloadError(Exception):
     def __repr__(self) -> str:
         return self.__str__()
 
+
+class DownloadCancelledError(DownloadError):
+    pass
+
+
+class DLJournal:
+    """记录 .part 文件中已完成并校验过长度的字节范围, 用于断点续传"""
+
+    def __init__(self, path: str, url: str, content_length: int, validator: str | None) -> None:
+        self.path = path
+        self.url = url
+        self.content_length = content_length
+        self.validator = validator
+        self.done: list[tuple[int, int]] = []
+        self.lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path: str, url: str, content_length: int, validator: str | None) -> "DLJournal":
+        """读取日志, 若与当前远程文件不匹配则返回空日志"""
+        journal = cls(path, url, content_length, validator)
+        if not os.path.isfile(path):
+            return journal
+        try:
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+            if (data["url"] == url and data["content_length"] == content_length and
+                    data["validator"] == validator):
+                for start, end in data["done"]:
+                    journal._add(int(start), int(end))
+            else:
+                logger.info(f"Journal {path} does not match the remote file, discarded.")
+        except (OSError, ValueError, KeyError, TypeError):
+            logger.warning(f"Journal {path} is corrupted, discarded.")
+        return journal
+
+    def _add(self, start: int, end: int) -> None:
+        # 插入并合并相邻/重叠的范围
+        ranges = sorted([*self.done, (start, end)])
+        merged: list[tuple[int, int]] = []
+        for s, e in ranges:
+            if merged and s <= merged[-1][1] + 1:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], e))
+            else:
+                merged.append((s, e))
+        self.done = merged
+
+    def mark_done(self, start: int, end: int) -> None:
+        with self.lock:
+            self._add(start, end)
+            self._save()
+
+    def _save(self) -> None:
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"url": self.url,
+                       "content_length": self.content_length,
+                       "validator": self.validator,
+                       "done": self.done}, f)
+        os.replace(tmp_path, self.path)
+
+    @property
+    def done_bytes(self) -> int:
+        with self.lock:
+            return sum(end - start + 1 for start, end in self.done)
+
+    def missing(self) -> list[tuple[int, int]]:
+        """返回尚未完成的字节范围"""
+        with self.lock:
+            missing = []
+            pos = 0
+            for start, end in self.done:
+                if start > pos:
+                    missing.append((pos, start - 1))
+                pos = end + 1
+            if pos < self.content_length:
+                missing.append((pos, self.content_length - 1))
+            return missing
+
+    @property
+    def contiguous_end(self) -> int:
+        """从文件开头起连续完成的字节数"""
+        with self.lock:
+            return self.done[0][1] + 1 if self.done and self.done[0][0] == 0 else 0
+
+    def remove(self) -> None:
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class StreamHasher:
+    """边下载边按顺序计算 sha256
+
+    恰好写在已哈希位置之后的数据直接参与计算, 乱序到达的范围在其之前的数据都完成后再从文件中补读,
+    此时这些数据通常仍在页缓存中, 不需要在下载结束后再完整读一遍文件。
+    """
+
+    def __init__(self) -> None:
+        self.hash = hashlib.sha256()
+        self.offset = 0
+        self.lock = threading.Lock()
+
+    def update(self, pos: int, data: bytes | memoryview) -> None:
+        with self.lock:
+            if pos == self.offset:
+                self.hash.update(data)
+                self.offset += len(data)
+
+    def catch_up(self, fd: int, end: int) -> None:
+        """从文件中补读 [offset, end) 的数据"""
+        with self.lock:
+            while self.offset < end:
+                data = os.pread(fd, min(CHUNK_BUFFER_SIZE, end - self.offset), self.offset)
+                if not data:
+                    break
+                self.hash.update(data)
+                self.offset += len(data)
+
+    def hexdigest(self) -> str:
+        with self.lock:
+            return self.hash.hexdigest()
+
+
+class RangeAssignment:
+    """分配给某个工作者的字节范围, end 可能因被其他工作者窃取而缩小"""
+
+    def __init__(self, start: int, end: int) -> None:
+        self.start = start
+        self.end = end
+        self.pos = start
+        self.last_progress = time.monotonic()
+
+    @property
+    def remaining(self) -> int:
+        return self.end - self.pos + 1
+
+
+class RangePlanner:
+    """动态分片调度
+
+    空闲的工作者按自身测得的吞吐量领取下一个子范围; 没有未分配的范围时, 从剩余最多的工作者处窃取后半部分,
+    停滞的工作者的剩余部分则整体重新发起。
+    """
+
+    def __init__(self, missing: list[tuple[int, int]], num_workers: int) -> None:
+        self.unassigned = list(missing)
+        self.active: list[RangeAssignment] = []
+        self.lock = threading.Lock()
+        self.aborted = False
+        self.assigned = 0
+        self.steals = 0
+        total = sum(end - start + 1 for start, end in missing)
+        self.initial_size = min(max(total // (max(num_workers, 1) * 4), MIN_RANGE_SIZE), MAX_RANGE_SIZE)
+
+    @property
+    def finished(self) -> bool:
+        with self.lock:
+            return self.aborted or (not self.unassigned and not self.active)
+
+    def next_range(self, throughput: float | None) -> RangeAssignment | None:
+        """领取下一个范围, 暂时没有可领取的范围时返回 None"""
+        size = self.initial_size if not throughput else min(max(int(throughput * RANGE_TARGET_SECONDS), MIN_RANGE_SIZE), MAX_RANGE_SIZE)
+        with self.lock:
+            if self.aborted:
+                return None
+            if self.unassigned:
+                start, end = self.unassigned[0]
+                chunk_end = min(end, start + size - 1)
+                # 避免在末尾留下过小的块
+                if end - chunk_end < MIN_RANGE_SIZE:
+                    chunk_end = end
+                if chunk_end == end:
+                    self.unassigned.pop(0)
+                else:
+                    self.unassigned[0] = (chunk_end + 1, end)
+                return self._assign(start, chunk_end)
+            return self._steal()
+
+    def _assign(self, start: int, end: int) -> RangeAssignment:
+        assignment = RangeAssignment(start, end)
+        self.active.append(assignment)
+        self.assigned += 1
+        return assignment
+
+    def _steal(self) -> RangeAssignment | None:
+        candidates = [a for a in self.active if a.remaining > 0]
+        if not candidates:
+            return None
+        now = time.monotonic()
+        if stalled := [a for a in candidates if now - a.last_progress > STALL_SECONDS]:
+            # 推测执行: 停滞分片的剩余部分整体交给新的工作者
+            victim = max(stalled, key=lambda a: a.remaining)
+            start = victim.pos
+        else:
+            victim = max(candidates, key=lambda a: a.remaining)
+            if victim.remaining < MIN_STEAL_SIZE * 2:
+                return None
+            start = victim.pos + victim.remaining // 2
+        end = victim.end
+        victim.end = start - 1
+        self.steals += 1
+        return self._assign(start, end)
+
+    def clip(self, assignment: RangeAssignment, pos: int, length: int) -> int:
+        """返回从 pos 开始最多还能写入多少字节"""
+        with self.lock:
+            if self.aborted:
+                return 0
+            return max(0, min(length, assignment.end - pos + 1))
+
+    def advance(self, assignment: RangeAssignment, pos: int) -> bool:
+        """记录进度, 返回该范围是否还有剩余"""
+        with self.lock:
+            assignment.pos = pos
+            assignment.last_progress = time.monotonic()
+            return not self.aborted and assignment.remaining > 0
+
+    def release(self, assignment: RangeAssignment) -> tuple[int, int] | None:
+        """结束一个范围, 未完成的部分放回队列, 返回已写入的范围"""
+        with self.lock:
+            self.active.remove(assignment)
+            if assignment.pos <= assignment.end:
+                self.unassigned.append((assignment.pos, assignment.end))
+                self.unassigned.sort()
+            if assignment.pos > assignment.start:
+                return assignment.start, min(assignment.pos, assignment.end + 1) - 1
+        return None
+
+    def abort(self) -> None:
+        with self.lock:
+            self.aborted = True
+
+
+class DLStats:
+    """单个任务的下载统计, 时间均为秒"""
+
+    def __init__(self) -> None:
+        self.mode = "pending"  # range / whole / cache
+        self.mirror: str | None = None  # 探测中最快的镜像模板, 直接访问原地址时为 None
+        self.bytes = 0  # 本次实际从网络接收的字节数, 不含续传前已有的部分
+        self.size = 0
+        self.submitted = time.monotonic()
+        self.started: float | None = None
+        self.finished: float | None = None
+        self.ttfb: float | None = None
+        self.ranges = 0
+        self.retries = 0
+        self.lock = threading.Lock()
+
+    def record_bytes(self, length: int) -> None:
+        with self.lock:
+            if self.ttfb is None and self.started is not None:
+                self.ttfb = time.monotonic() - self.started
+            self.bytes += length
+
+    def record_range(self) -> None:
+        with self.lock:
+            self.ranges += 1
+
+    def record_retry(self) -> None:
+        with self.lock:
+            self.retries += 1
+
+    @property
+    def queued(self) -> float:
+        return (self.started or self.submitted) - self.submitted
+
+    @property
+    def duration(self) -> float:
+        if self.started is None:
+            return 0
+        return (self.finished or time.monotonic()) - self.started
+
+    @property
+    def throughput(self) -> float:
+        """字节/秒"""
+        return self.bytes / self.duration if self.duration > 0 else 0
+
+    def as_dict(self) -> dict:
+        return {"mode": self.mode,
+                "mirror": self.mirror,
+                "bytes": self.bytes,
+                "size": self.size,
+                "queued": round(self.queued, 3),
+                "duration": round(self.duration, 3),
+                "ttfb": round(self.ttfb, 3) if self.ttfb is not None else None,
+                "throughput": round(self.throughput),
+                "ranges": self.ranges,
+                "retries": self.retries}
+
+
 class DLTask:
-    def __init__(self, url: str, path: str, retry: int, num_chunks: int, headers: dict | None) -> None:
+    def __init__(self,
+                 url: str,
+                 path: str,
+                 retry: int,
+                 num_chunks: int,
+                 headers: dict | None,
+                 cache: DLCache | None = None,
+                 priority: DLPriority = DLPriority.NORMAL,
+                 expected_sha256: str | None = None,
+                 mirrors: dict[str, str] | None = None) -> None:
         self.url = url
         self.path = os.path.abspath(path)
+        self.part_path = self.path + ".part"
+        self.journal_path = self.part_path + ".json"
         self.retry = retry
         self.num_chunks = num_chunks
         self.headers = headers or {}
+        self.cache = cache
+        self.priority = priority
+        self.expected_sha256 = expected_sha256.lower() if expected_sha256 else None
+        # 下载完成后文件的 sha256, 可供后续步骤校验或作为缓存键
+        self.digest: str | None = None
+        self.hasher = StreamHasher()
+        self.stats = DLStats()
+        self.host = urlsplit(url).netloc
+        # 镜像地址 -> 模板; 候选地址中上次最快的排在最前, 探测后 sources 为实际用于下载的地址
+        self.mirrors = mirrors or {}
+        self.candidates = [url, *self.mirrors]
+        if self.mirrors and (winner := get_mirror_record().winner(self.host)):
+            self.candidates.sort(key=lambda candidate: self.mirrors.get(candidate, ORIGIN) != winner)
+        self.sources = [url]
+        # 实际提供文件内容的地址, 只有来自原始地址时才以其校验器缓存
+        self.served_url: str | None = None
         self.error: Exception | None = None
         self.completed = False
+        self.cancel_event = threading.Event()
+        # async 后端中可在事件循环中等待的取消事件, 由 _run_async 创建
+        self.async_cancel: tuple[asyncio.AbstractEventLoop, asyncio.Event] | None = None
+        self.done_event = threading.Event()
 
         if os.path.exists(self.path):
             os.remove(self.path)
@@ -42,120 +407,755 @@ class DLTask:
             os.makedirs(os.path.dirname(self.path))
             logger.info(f"Directory {os.path.dirname(self.path)} created.")
 
-        self.thread = threading.Thread(target=self._download)
-        self.thread.start()
+    def cancel(self) -> None:
+        self.cancel_event.set()
+        if self.async_cancel is not None:
+            loop, event = self.async_cancel
+            # 事件循环已关闭时任务也已结束
+            with contextlib.suppress(RuntimeError):
+                loop.call_soon_threadsafe(event.set)
+
+    def wait(self, timeout: float | None = None) -> bool:
+        return self.done_event.wait(timeout)
 
-    def _download(self) -> None:
+    def _check_cancelled(self) -> None:
+        if self.cancel_event.is_set():
+            msg = "Download cancelled"
+            raise DownloadCancelledError(msg, self)
+
+    def _sleep_before_retry(self) -> None:
+        # 可被取消打断的等待
+        if self.cancel_event.wait(1):
+            self._check_cancelled()
+
+    def _run(self, scheduler: "DLScheduler") -> None:
+        """由调度器的工作线程调用"""
+        self.stats.started = time.monotonic()
         try:
-            with httpx.Client(headers=self.headers, follow_redirects=True) as client:
-                try:
-                    # 检查服务器是否支持分片下载
-                    resp = client.head(self.url)
-                    resp.raise_for_status()
-                    accept_ranges = resp.headers.get("Accept-Ranges") == "bytes"
-                    content_length = int(resp.headers.get("Content-Length", 0))
-                except (httpx.HTTPError, httpx.RequestError):
-                    accept_ranges = False
-                    content_length = 0
-
-                if accept_ranges and content_length > 0 and self.num_chunks > 1:
-                    try:
-                        self._download_chunks(client, content_length)
-                    except Exception:
-                        self._download_whole(client)
-                else:
-                    self._download_whole(client)
+            self._check_cancelled()
+            self._download(scheduler)
         except Exception as e:
-            self.error = RuntimeError(f"Download failed for {self.url} ({self.path}): {e}")
+            self._set_error(e)
         finally:
-            self.completed = True
-
-    def _download_chunks(self, client: httpx.Client, content_length: int) -> None:
-        # 计算块范围
-        num_chunks = min(self.num_chunks, content_length)
-        chunk_size = content_length // num_chunks
-        ranges = [
-            (
-                i * chunk_size,
-                (i + 1) * chunk_size - 1 if i < num_chunks - 1 else content_length - 1,
-            )
-            for i in range(num_chunks)
-        ]
-
-        # 预先分配文件
-        with open(self.path, "wb") as f:
-            f.truncate(content_length)
-
-        # 并行下载块
-        with ThreadPoolExecutor(max_workers=num_chunks) as executor:
-            futures = [executor.submit(self._download_chunk, client, start, end) for start, end in ranges]
+            self._set_completed()
 
-            for future in as_completed(futures):
+    def _set_error(self, e: Exception) -> None:
+        if isinstance(e, DownloadCancelledError):
+            self.error = e
+        else:
+            self.error = RuntimeError(f"Download failed for {self.url} ({self.path}): {e}")
+
+    def _set_completed(self) -> None:
+        self.stats.finished = time.monotonic()
+        if self.error is None and os.path.isfile(self.path):
+            self.stats.size = os.path.getsize(self.path)
+        self.completed = True
+        self.done_event.set()
+
+    def _headers_for(self, url: str) -> dict:
+        if url == self.url:
+            return self.headers.copy()
+        # 不把认证信息发送给第三方镜像
+        return {key: value for key, value in self.headers.items() if key.lower() != "authorization"}
+
+    def _probe_headers(self, url: str) -> dict:
+        # 启用缓存时在探测原地址的请求中同时进行条件请求
+        if self.cache and url == self.url:
+            return {**self.headers, **self.cache.conditional_headers(self.url)}
+        return self._headers_for(url)
+
+    def _parse_probe(self, resp: httpx.Response) -> ProbeResult:
+        """解析探测请求的响应"""
+        if resp.status_code == 304:
+            return 304, False, 0, None, None
+        resp.raise_for_status()
+        return (resp.status_code,
+                resp.headers.get("Accept-Ranges") == "bytes",
+                int(resp.headers.get("Content-Length", 0)),
+                resp.headers.get("ETag"),
+                resp.headers.get("Last-Modified"))
+
+    def _select_sources(self, results: list[tuple[str, ProbeResult]]) -> ProbeResult | None:
+        """根据按响应先后排列的探测结果选出下载地址
+
+        最快响应的地址作为主地址。长度一致不代表内容一致(镜像可能缓存了旧版本的可变文件),
+        因此只有指定了 sha256 可以校验拼接结果时, 其余支持分片且长度一致的地址才一同参与分片下载。
+        续传日志以主地址记录其校验器, 只有主地址为原始地址时校验器才用于缓存。
+        """
+        if not results:
+            self.sources = self.candidates.copy()
+            return None
+        for url, result in results:
+            if url == self.url and result[0] == 304:
+                return result
+        winner_url, winner = results[0]
+        self.sources = [winner_url]
+        if self.expected_sha256:
+            self.sources.extend(url for url, result in results[1:] if result[1] and result[2] == winner[2])
+        if self.mirrors:
+            template = self.mirrors.get(winner_url, ORIGIN)
+            self.stats.mirror = self.mirrors.get(winner_url)
+            get_mirror_record().record(self.host, template)
+            logger.debug(f"Fastest source for {self.url}: {winner_url} ({len(self.sources)} sources used).")
+        return winner
+
+    def _probe_one(self, client: httpx.Client, url: str) -> ProbeResult | None:
+        try:
+            return self._parse_probe(client.head(url, headers=self._probe_headers(url)))
+        except (httpx.HTTPError, httpx.RequestError):
+            return None
+
+    def _probe(self, client: httpx.Client) -> ProbeResult | None:
+        """探测所有候选地址, 返回最快响应的结果; 均失败时返回 None"""
+        if len(self.candidates) == 1:
+            result = self._probe_one(client, self.url)
+            return self._select_sources([(self.url, result)] if result else [])
+
+        results: list[tuple[str, ProbeResult]] = []
+        executor = ThreadPoolExecutor(max_workers=len(self.candidates), thread_name_prefix="dl-probe")
+        futures = {executor.submit(self._probe_one, client, url): url for url in self.candidates}
+        deadline = time.monotonic() + PROBE_TIMEOUT
+        pending = set(futures)
+        while pending and (timeout := deadline - time.monotonic()) > 0:
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                if (result := future.result()) is not None:
+                    if not results:
+                        deadline = min(deadline, time.monotonic() + MIRROR_GRACE_SECONDS)
+                    results.append((futures[future], result))
+        # 不等待仍未响应的镜像
+        executor.shutdown(wait=False, cancel_futures=True)
+        return self._select_sources(results)
+
+    def _serve_from_cache(self, status_code: int | None, etag: str | None, last_modified: str | None) -> bool:
+        if not self.cache:
+            return False
+        if self.sources[0] != self.url:
+            # 镜像的校验器与缓存中记录的原始地址的校验器不可比较
+            etag = last_modified = None
+        if self.expected_sha256 and (entry := self.cache.get(self.url)) and entry["sha256"] != self.expected_sha256:
+            return False
+        if status_code == 304 or self.cache.is_fresh(self.url, etag, last_modified):
+            self.digest = self.cache.restore(self.url, self.path)
+        if self.digest is not None:
+            self.stats.mode = "cache"
+        return self.digest is not None
+
+    def _use_ranges(self, accept_ranges: bool, content_length: int) -> bool:
+        return accept_ranges and content_length > 0 and self.num_chunks > 1
+
+    def _finish(self, etag: str | None, last_modified: str | None) -> None:
+        self.digest = self.hasher.hexdigest()
+        if self.expected_sha256 and self.digest != self.expected_sha256:
+            os.remove(self.part_path)
+            msg = f"SHA-256 mismatch: expected {self.expected_sha256}, got {self.digest}"
+            self._raise_download_error(DownloadError(msg, self))
+        os.replace(self.part_path, self.path)
+        if self.served_url != self.url:
+            # 内容来自镜像时不能以原始地址的校验器缓存, 只有 sha256 可用
+            etag = last_modified = None
+        if self.cache:
+            try:
+                self.cache.store(self.url, self.path, etag, last_modified, self.digest)
+            except OSError as e:
+                logger.warning(f"Failed to store {self.url} in download cache: {e}")
+
+    def _download(self, scheduler: "DLScheduler") -> None:
+        client = scheduler.client
+        # 检查服务器是否支持分片下载
+        status_code, accept_ranges, content_length, etag, last_modified = self._probe(client) or (None, False, 0, None, None)
+
+        if self._serve_from_cache(status_code, etag, last_modified):
+            return
+
+        if status_code != 304 and self._use_ranges(accept_ranges, content_length):
+            # 续传日志记录主地址与其校验器, 下次主地址不同时不会续传另一来源的内容
+            journal = DLJournal.load(self.journal_path, self.sources[0], content_length, etag or last_modified)
+            self.stats.mode = "range"
+            try:
+                self._download_chunks(scheduler, journal)
+                self.served_url = self.sources[0]
+            except DownloadCancelledError:
+                raise
+            except Exception:
+                logger.warning(f"Range download failed for {self.url}, falling back to whole download.")
+                journal.remove()
+                self.stats.mode = "whole"
+                self._download_whole(client)
+        else:
+            self.stats.mode = "whole"
+            self._download_whole(client)
+        self._finish(etag, last_modified)
+
+    def _open_part(self, journal: DLJournal) -> int:
+        """打开并预分配 .part 文件, 所有分片共用返回的文件描述符按偏移写入"""
+        content_length = journal.content_length
+        if journal.done and os.path.isfile(self.part_path) and os.path.getsize(self.part_path) == content_length:
+            logger.info(f"Resuming {self.url} ({journal.done_bytes}/{content_length} bytes already downloaded).")
+        else:
+            journal.done = []
+        fd = os.open(self.part_path, os.O_RDWR | os.O_CREAT, 0o644)
+        os.ftruncate(fd, content_length)
+        self.hasher = StreamHasher()
+        return fd
+
+    def _range_headers(self, journal: DLJournal, url: str, start: int, end: int) -> dict:
+        headers = self._headers_for(url)
+        headers["Range"] = f"bytes={start}-{end}"
+        if url == self.sources[0] and journal.validator and not journal.validator.startswith("W/"):
+            # 远程文件发生变化时服务器会返回 200 而不是 206
+            headers["If-Range"] = journal.validator
+        return headers
+
+    def _check_range_response(self, resp: httpx.Response) -> None:
+        if resp.status_code != 206:
+            msg = f"Unexpected status code {resp.status_code}"
+            self._raise_download_error(httpx.HTTPStatusError(
+                msg,
+                request=resp.request,
+                response=resp,
+            ))
+
+    def _write_range(self, fd: int, planner: RangePlanner, assignment: RangeAssignment, data: bytes, pos: int) -> tuple[int, bool]:
+        """将收到的数据写入对应的偏移, 返回新的偏移与该范围是否还需要继续接收"""
+        self._check_cancelled()
+        if length := planner.clip(assignment, pos, len(data)):
+            view = memoryview(data)[:length]
+            os.pwrite(fd, view, pos)
+            self.hasher.update(pos, view)
+            self.stats.record_bytes(length)
+        pos += length
+        return pos, planner.advance(assignment, pos) and length == len(data)
+
+    def _finish_range(self, fd: int, planner: RangePlanner, journal: DLJournal, assignment: RangeAssignment) -> None:
+        if done := planner.release(assignment):
+            journal.mark_done(*done)
+            self.hasher.catch_up(fd, journal.contiguous_end)
+
+    def _check_range_complete(self, planner: RangePlanner, assignment: RangeAssignment) -> None:
+        with planner.lock:
+            if planner.aborted:
+                msg = "Range download aborted"
+                self._raise_download_error(DownloadError(msg, self))
+            if assignment.remaining > 0:
+                msg = f"Incomplete range {assignment.start}-{assignment.end}: got {assignment.pos - assignment.start} bytes"
+                self._raise_download_error(DownloadError(msg, self))
+
+    @staticmethod
+    def _measure(assignment: RangeAssignment, started: float) -> float | None:
+        """计算刚结束的范围的吞吐量(字节/秒)"""
+        elapsed = time.monotonic() - started
+        downloaded = assignment.pos - assignment.start
+        return downloaded / elapsed if downloaded > 0 and elapsed > 0 else None
+
+    def _download_chunks(self, scheduler: "DLScheduler", journal: DLJournal) -> None:
+        fd = self._open_part(journal)
+        try:
+            # 每轮只下载缺失的范围, 某一轮没有任何进展时才放弃
+            for _ in range(self.retry + 1):
+                if not (missing := journal.missing()):
+                    break
+                done_before = journal.done_bytes
                 try:
-                    data, pos = future.result()
-                    self._write_chunk(pos, data)
+                    self._download_ranges(scheduler, fd, journal, RangePlanner(missing, self.num_chunks))
+                except DownloadCancelledError:
+                    raise
                 except Exception:
-                    executor.shutdown(wait=False, cancel_futures=True)
+                    if journal.done_bytes == done_before:
+                        raise
+                    logger.warning(f"Some ranges of {self.url} failed, resuming the missing ranges.")
+            if journal.missing():
+                msg = "Ranges still missing after retries"
+                self._raise_download_error(DownloadError(msg, self))
+            self.hasher.catch_up(fd, journal.content_length)
+        finally:
+            os.close(fd)
+        journal.remove()
+
+    def _download_ranges(self, scheduler: "DLScheduler", fd: int, journal: DLJournal, planner: RangePlanner) -> None:
+        # 在调度器共享的线程池中启动工作者, 工作者从 planner 中动态领取范围
+        futures = [scheduler.range_executor.submit(self._range_worker, scheduler.client, fd, journal, planner, i) for i in range(self.num_chunks)]
+        try:
+            for future in as_completed(futures):
+                future.result()
+        except Exception:
+            planner.abort()
+            for future in futures:
+                future.cancel()
+            # 等待仍在运行的工作者结束, 避免在关闭文件描述符后继续写入
+            for future in futures:
+                if not future.cancelled():
+                    future.exception()
+            raise
+
+    def _range_worker(self, client: httpx.Client, fd: int, journal: DLJournal, planner: RangePlanner, index: int) -> None:
+        # 工作者轮流分配到各个镜像, 失败后换下一个镜像; 较快的镜像会通过动态分片领取更多范围
+        source = index
+        throughput = None
+        failures = 0
+        while True:
+            self._check_cancelled()
+            if (assignment := planner.next_range(throughput)) is None:
+                if planner.finished:
+                    return
+                # 其他工作者仍在下载, 稍后再尝试窃取
+                if self.cancel_event.wait(0.5):
+                    self._check_cancelled()
+                continue
+            self.stats.record_range()
+            started = time.monotonic()
+            try:
+                self._download_range(client, self.sources[source % len(self.sources)], fd, journal, planner, assignment)
+            except DownloadCancelledError:
+                raise
+            except Exception:
+                failures += 1
+                if failures > self.retry:
                     raise
+                self.stats.record_retry()
+                source += 1
+                self._sleep_before_retry()
+                continue
+            failures = 0
+            throughput = self._measure(assignment, started) or throughput
 
-    def _download_chunk(self, client: httpx.Client, start: int, end: int) -> tuple[bytes, int]:
-        headers = self.headers.copy()
-        headers["Range"] = f"bytes={start}-{end}"
+    def _download_range(self,
+                        client: httpx.Client,
+                        url: str,
+                        fd: int,
+                        journal: DLJournal,
+                        planner: RangePlanner,
+                        assignment: RangeAssignment) -> None:
+        try:
+            with client.stream("GET", url, headers=self._range_headers(journal, url, assignment.start, assignment.end)) as resp:
+                self._check_range_response(resp)
+                # 边接收边写入到该范围对应的偏移, 内存中只保留当前缓冲区; 后半部分被窃取后提前结束
+                pos = assignment.start
+                for data in resp.iter_bytes(CHUNK_BUFFER_SIZE):
+                    pos, more = self._write_range(fd, planner, assignment, data, pos)
+                    if not more:
+                        break
+            self._check_range_complete(planner, assignment)
+        finally:
+            self._finish_range(fd, planner, journal, assignment)
 
+    def _write_whole(self, f: BinaryIO, chunk: bytes) -> None:
+        f.write(chunk)
+        self.hasher.update(self.hasher.offset, chunk)
+
+    def _download_whole(self, client: httpx.Client) -> None:
         for attempt in range(self.retry + 1):
+            # 每次重试换用下一个可用地址
+            url = self.sources[attempt % len(self.sources)]
             try:
-                resp = client.get(self.url, headers=headers)
-                if resp.status_code == 206:
-                    return resp.content, start
-                msg = f"Unexpected status code {resp.status_code}"
-                self._raise_download_error(httpx.HTTPStatusError(
-                    msg,
-                    request=resp.request,
-                    response=resp,
-                ))
+                with client.stream("GET", url, headers=self._headers_for(url)) as response:
+                    response.raise_for_status()
+                    self.hasher = StreamHasher()
+                    with open(self.part_path, "wb") as f:
+                        for chunk in response.iter_bytes(CHUNK_BUFFER_SIZE):
+                            self._check_cancelled()
+                            self._write_whole(f, chunk)
+                            self.stats.record_bytes(len(chunk))
+                    self.served_url = url
+                    return
+            except DownloadCancelledError:
+                raise
             except Exception:
                 if attempt == self.retry:
                     raise
-                time.sleep(1)
-        msg = "Chunk download failed after retries"
-        raise DownloadError(msg, self)
+                self.stats.record_retry()
+                self._sleep_before_retry()
 
-    def _write_chunk(self, pos: int, data: bytes) -> None:
-        with open(self.path, "r+b") as f:
-            f.seek(pos)
-            f.write(data)
+    # 以下为 async 后端(AsyncDLScheduler)使用的协程版本, 流程与上面的同步版本一一对应
 
-    def _download_whole(self, client: httpx.Client) -> None:
+    async def _run_async(self, scheduler: "AsyncDLScheduler") -> None:
+        self.stats.started = time.monotonic()
+        self.async_cancel = (asyncio.get_running_loop(), asyncio.Event())
+        try:
+            self._check_cancelled()
+            await self._download_async(scheduler)
+        except Exception as e:
+            self._set_error(e)
+        finally:
+            self._set_completed()
+
+    async def _wait_cancelled_async(self, seconds: float) -> None:
+        """可被取消打断的等待"""
+        if self.async_cancel is not None:
+            with contextlib.suppress(TimeoutError):
+                await asyncio.wait_for(self.async_cancel[1].wait(), seconds)
+        else:
+            await asyncio.sleep(seconds)
+        self._check_cancelled()
+
+    async def _sleep_before_retry_async(self) -> None:
+        await self._wait_cancelled_async(1)
+
+    @staticmethod
+    async def _in_thread(func: Callable[..., Any], *args: Any) -> Any:
+        """在线程池中执行文件读写、加锁等阻塞调用, 避免阻塞事件循环中的其他传输
+
+        调用方被取消时仍等待调用结束再退出, 避免在关闭文件描述符后继续写入。
+        """
+        future = asyncio.get_running_loop().run_in_executor(None, func, *args)
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            await asyncio.wait([future])
+            raise
+
+    async def _probe_one_async(self, client: httpx.AsyncClient, url: str) -> tuple[str, ProbeResult | None]:
+        try:
+            return url, self._parse_probe(await client.head(url, headers=self._probe_headers(url)))
+        except (httpx.HTTPError, httpx.RequestError):
+            return url, None
+
+    async def _probe_async(self, client: httpx.AsyncClient) -> ProbeResult | None:
+        probes = {asyncio.ensure_future(self._probe_one_async(client, url)) for url in self.candidates}
+        results: list[tuple[str, ProbeResult]] = []
+        deadline = time.monotonic() + PROBE_TIMEOUT
+        pending = probes
+        while pending and (timeout := deadline - time.monotonic()) > 0:
+            done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            for probe in done:
+                url, result = probe.result()
+                if result is not None:
+                    if not results:
+                        deadline = min(deadline, time.monotonic() + MIRROR_GRACE_SECONDS)
+                    results.append((url, result))
+        for probe in pending:
+            probe.cancel()
+        return await self._in_thread(self._select_sources, results)
+
+    async def _download_async(self, scheduler: "AsyncDLScheduler") -> None:
+        client = scheduler.client
+        status_code, accept_ranges, content_length, etag, last_modified = await self._probe_async(client) or (None, False, 0, None, None)
+
+        if await self._in_thread(self._serve_from_cache, status_code, etag, last_modified):
+            return
+
+        if status_code != 304 and self._use_ranges(accept_ranges, content_length):
+            # 续传日志记录主地址与其校验器, 下次主地址不同时不会续传另一来源的内容
+            journal = await self._in_thread(DLJournal.load, self.journal_path, self.sources[0], content_length, etag or last_modified)
+            self.stats.mode = "range"
+            try:
+                await self._download_chunks_async(client, journal)
+                self.served_url = self.sources[0]
+            except DownloadCancelledError:
+                raise
+            except Exception:
+                logger.warning(f"Range download failed for {self.url}, falling back to whole download.")
+                await self._in_thread(journal.remove)
+                self.stats.mode = "whole"
+                await self._download_whole_async(client)
+        else:
+            self.stats.mode = "whole"
+            await self._download_whole_async(client)
+        await self._in_thread(self._finish, etag, last_modified)
+
+    async def _download_chunks_async(self, client: httpx.AsyncClient, journal: DLJournal) -> None:
+        fd = await self._in_thread(self._open_part, journal)
+        try:
+            for _ in range(self.retry + 1):
+                if not (missing := journal.missing()):
+                    break
+                done_before = journal.done_bytes
+                planner = RangePlanner(missing, self.num_chunks)
+                chunks = [asyncio.ensure_future(self._range_worker_async(client, fd, journal, planner, i)) for i in range(self.num_chunks)]
+                try:
+                    await asyncio.gather(*chunks)
+                except DownloadCancelledError:
+                    raise
+                except Exception:
+                    if journal.done_bytes == done_before:
+                        raise
+                    logger.warning(f"Some ranges of {self.url} failed, resuming the missing ranges.")
+                finally:
+                    # 确保没有工作者在关闭文件描述符后继续写入
+                    planner.abort()
+                    for chunk in chunks:
+                        chunk.cancel()
+                    await asyncio.gather(*chunks, return_exceptions=True)
+            if journal.missing():
+                msg = "Ranges still missing after retries"
+                self._raise_download_error(DownloadError(msg, self))
+            await self._in_thread(self.hasher.catch_up, fd, journal.content_length)
+        finally:
+            os.close(fd)
+        await self._in_thread(journal.remove)
+
+    async def _range_worker_async(self, client: httpx.AsyncClient, fd: int, journal: DLJournal, planner: RangePlanner, index: int) -> None:
+        source = index
+        throughput = None
+        failures = 0
+        while True:
+            self._check_cancelled()
+            if (assignment := planner.next_range(throughput)) is None:
+                if planner.finished:
+                    return
+                await self._wait_cancelled_async(0.5)
+                continue
+            self.stats.record_range()
+            started = time.monotonic()
+            try:
+                await self._download_range_async(client, self.sources[source % len(self.sources)], fd, journal, planner, assignment)
+            except DownloadCancelledError:
+                raise
+            except Exception:
+                failures += 1
+                if failures > self.retry:
+                    raise
+                self.stats.record_retry()
+                source += 1
+                await self._sleep_before_retry_async()
+                continue
+            failures = 0
+            throughput = self._measure(assignment, started) or throughput
+
+    async def _download_range_async(self,
+                                    client: httpx.AsyncClient,
+                                    url: str,
+                                    fd: int,
+                                    journal: DLJournal,
+                                    planner: RangePlanner,
+                                    assignment: RangeAssignment) -> None:
+        try:
+            async with client.stream("GET", url, headers=self._range_headers(journal, url, assignment.start, assignment.end)) as resp:
+                self._check_range_response(resp)
+                pos = assignment.start
+                async for data in resp.aiter_bytes(CHUNK_BUFFER_SIZE):
+                    pos, more = await self._in_thread(self._write_range, fd, planner, assignment, data, pos)
+                    if not more:
+                        break
+            self._check_range_complete(planner, assignment)
+        finally:
+            await self._in_thread(self._finish_range, fd, planner, journal, assignment)
+
+    async def _download_whole_async(self, client: httpx.AsyncClient) -> None:
         for attempt in range(self.retry + 1):
+            url = self.sources[attempt % len(self.sources)]
             try:
-                with client.stream("GET", self.url, headers=self.headers) as response:
+                async with client.stream("GET", url, headers=self._headers_for(url)) as response:
                     response.raise_for_status()
-                    with open(self.path, "wb") as f:
-                        for chunk in response.iter_bytes():
-                            f.write(chunk)
+                    self.hasher = StreamHasher()
+                    f = await self._in_thread(open, self.part_path, "wb")
+                    try:
+                        async for chunk in response.aiter_bytes(CHUNK_BUFFER_SIZE):
+                            self._check_cancelled()
+                            await self._in_thread(self._write_whole, f, chunk)
+                            self.stats.record_bytes(len(chunk))
+                    finally:
+                        f.close()
+                    self.served_url = url
                     return
+            except DownloadCancelledError:
+                raise
             except Exception:
                 if attempt == self.retry:
                     raise
-                time.sleep(1)
+                self.stats.record_retry()
+                await self._sleep_before_retry_async()
 
     def _raise_download_error(self, e: Exception) -> None:
         raise e
 
+class BaseDLScheduler:
+    """调度器的公共部分: 按优先级排队、限制单个主机的并发任务数、取消与等待"""
+
+    def __init__(self, max_tasks: int, max_tasks_per_host: int) -> None:
+        self.pid = os.getpid()
+        self.max_tasks = max_tasks
+        self.max_tasks_per_host = max_tasks_per_host
+        self.cond = threading.Condition()
+        self.pending: list[tuple[int, int, DLTask]] = []
+        self.host_active: dict[str, int] = {}
+        self.counter = itertools.count()
+
+    def submit(self, task: DLTask) -> None:
+        with self.cond:
+            self.pending.append((task.priority, next(self.counter), task))
+            self.cond.notify_all()
+
+    def cancel(self, task: DLTask) -> None:
+        """取消任务: 未开始的任务直接移出队列, 运行中的任务在下一个缓冲区处中止"""
+        task.cancel()
+        with self.cond:
+            for i, (_, _, pending_task) in enumerate(self.pending):
+                if pending_task is task:
+                    self.pending.pop(i)
+                    msg = "Download cancelled"
+                    task.error = DownloadCancelledError(msg, task)
+                    task.completed = True
+                    task.done_event.set()
+                    break
+            self.cond.notify_all()
+
+    def _pop_task(self) -> DLTask | None:
+        """取出优先级最高且所属主机未达到并发上限的任务, 调用时需持有 self.cond"""
+        for item in sorted(self.pending):
+            task = item[2]
+            if self.host_active.get(task.host, 0) < self.max_tasks_per_host:
+                self.pending.remove(item)
+                self.host_active[task.host] = self.host_active.get(task.host, 0) + 1
+                return task
+        return None
+
+    def _release(self, task: DLTask) -> None:
+        with self.cond:
+            self.host_active[task.host] -= 1
+            self.cond.notify_all()
+
+    def wait_any(self, tasks: set[DLTask]) -> None:
+        """阻塞直到 tasks 中至少有一个任务完成"""
+        with self.cond:
+            self.cond.wait_for(lambda: any(task.completed for task in tasks))
+
+
+class DLScheduler(BaseDLScheduler):
+    """进程内共享的多线程下载调度器
+
+    所有任务共用一个 httpx 连接池与一个分片线程池, 按优先级调度, 并限制全局与单个主机的并发任务数。
+    """
+
+    def __init__(self, max_tasks: int = MAX_TASKS, max_tasks_per_host: int = MAX_TASKS_PER_HOST, max_connections: int = MAX_CONNECTIONS) -> None:
+        super().__init__(max_tasks, max_tasks_per_host)
+        self.client = httpx.Client(follow_redirects=True,
+                                   limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections))
+        self.range_executor = ThreadPoolExecutor(max_workers=max_connections, thread_name_prefix="dl-range")
+        self.workers: list[threading.Thread] = []
+
+    def submit(self, task: DLTask) -> None:
+        super().submit(task)
+        with self.cond:
+            if len(self.workers) < self.max_tasks:
+                worker = threading.Thread(target=self._worker, name=f"dl-task-{len(self.workers)}", daemon=True)
+                self.workers.append(worker)
+                worker.start()
+
+    def _next_task(self) -> DLTask:
+        with self.cond:
+            while (task := self._pop_task()) is None:
+                self.cond.wait()
+            return task
+
+    def _worker(self) -> None:
+        while True:
+            task = self._next_task()
+            try:
+                task._run(self)  # noqa: SLF001
+            finally:
+                self._release(task)
+
+
+_scheduler: BaseDLScheduler | None = None
+_scheduler_lock = threading.Lock()
+
+
+def get_backend() -> str:
+    """下载后端, 通过环境变量 BUILD_HELPER_DL_BACKEND 选择 thread(默认) 或 async"""
+    backend = os.getenv("BUILD_HELPER_DL_BACKEND", "thread").lower()
+    if backend not in ("thread", "async"):
+        logger.warning(f"Unknown download backend {backend}, using thread.")
+        return "thread"
+    return backend
+
+
+def get_scheduler() -> BaseDLScheduler:
+    global _scheduler  # noqa: PLW0603
+    with _scheduler_lock:
+        # fork 出的子进程(如 prepare_cfg 的进程池)中没有父进程的工作线程, 需要重新创建
+        if _scheduler is None or _scheduler.pid != os.getpid():
+            if get_backend() == "async":
+                # dl_async 在模块级导入本模块, 只在选用 async 后端时导入以避免循环导入
+                from .dl_async import AsyncDLScheduler  # noqa: PLC0415
+                _scheduler = AsyncDLScheduler()
+            else:
+                _scheduler = DLScheduler()
+            logger.debug(f"Using {get_backend()} download backend.")
+        return _scheduler
+
+
 def dl2(
     url: str,
     path: str,
     retry: int = 6,
     num_chunks: int = 4,
     headers: dict | None = None,
+    cache: bool | None = None,
+    priority: DLPriority = DLPriority.NORMAL,
+    sha256: str | None = None,
+    mirrors: list[str] | None = None,
 ) -> DLTask:
-    return DLTask(url, path, retry, num_chunks, headers)
+    """下载文件
+
+    cache 为 None 时由环境变量 BUILD_HELPER_DL_CACHE 决定是否使用下载缓存;
+    指定 sha256 时在下载过程中计算并校验文件的哈希, 结果保存在 DLTask.digest 中;
+    mirrors 为按优先级排列的镜像模板(如 "https://ghfast.top/{url}"), 为 None 时 GitHub 地址使用环境变量 BUILD_HELPER_GH_MIRRORS 中的镜像,
+    所有地址同时探测, 最快的地址作为主地址, 长度一致的镜像一同参与分片下载
+    """
+    if cache is None:
+        cache = cache_enabled()
+    mirror_urls = expand_mirrors(url, default_mirrors(url) if mirrors is None else mirrors)
+    task = DLTask(url, path, retry, num_chunks, headers, get_dl_cache() if cache else None, priority, sha256, mirror_urls)
+    get_scheduler().submit(task)
+    return task
+
+
+def _format_size(size: float) -> str:
+    for unit in ("B", "KiB", "MiB"):
+        if size < 1024:
+            return f"{size:.1f}{unit}"
+        size /= 1024
+    return f"{size:.1f}GiB"
+
+
+def report_dl_stats(dl_tasks: list[DLTask]) -> None:
+    """输出下载统计表(按耗时降序), 并以 JSON Lines 格式追加到错误信息目录的 download-stats.jsonl 中"""
+    if not dl_tasks:
+        return
+    tasks = sorted(dl_tasks, key=lambda task: task.stats.duration, reverse=True)
+    lines = [f"{'mode':<7} {'size':>10} {'time':>8} {'ttfb':>7} {'speed':>12} {'queued':>7} {'ranges':>6} {'retries':>7}  file"]
+    for task in tasks:
+        stats = task.stats
+        ttfb = f"{stats.ttfb:.2f}s" if stats.ttfb is not None else "-"
+        status = "" if task.error is None else " (cancelled)" if isinstance(task.error, DownloadCancelledError) else " (failed)"
+        lines.append(f"{stats.mode:<7} {_format_size(stats.size or stats.bytes):>10} {stats.duration:>7.2f}s {ttfb:>7} "
+                     f"{_format_size(stats.throughput) + '/s':>12} {stats.queued:>6.2f}s {stats.ranges:>6} {stats.retries:>7}  "
+                     f"{os.path.basename(task.path)}{status}")
+    logger.info("Download stats:\n" + "\n".join(lines))
+
+    records = [{"url": task.url,
+                "path": task.path,
+                "ok": task.error is None,
+                "pid": os.getpid(),
+                **task.stats.as_dict()} for task in tasks]
+    try:
+        # 一次写入整批记录, 多个进程同时追加时各自的行不会交错
+        with open(os.path.join(paths.errorinfo, "download-stats.jsonl"), "a", encoding="utf-8") as f:
+            f.write("".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records))
+    except OSError as e:
+        logger.warning(f"Failed to write download stats: {e}")
 
 
 def wait_dl_tasks(dl_tasks: list[DLTask]) -> None:
-    for task in dl_tasks:
-        task.thread.join()
+    """等待所有任务完成, 任一任务失败时取消其余任务并汇总报告所有错误"""
+    scheduler = get_scheduler()
+    pending = set(dl_tasks)
+    while pending:
+        scheduler.wait_any(pending)
+        finished = {task for task in pending if task.completed}
+        pending -= finished
+        if any(task.error is not None for task in finished):
+            for task in pending:
+                scheduler.cancel(task)
+            for task in pending:
+                task.wait()
+            break
 
-    for task in dl_tasks:
-        if task.error is not None:
-            raise task.error
+    report_dl_stats(dl_tasks)
+    errors = [task.error for task in dl_tasks if task.error is not None and not isinstance(task.error, DownloadCancelledError)]
+    if len(errors) == 1:
+        raise errors[0]
+    if errors:
+        msg = f"{len(errors)} downloads failed:\n" + "\n".join(str(error) for error in errors)
+        raise ExceptionGroup(msg, errors)
@@ -0,0 +1,138 @@
+# SPDX-FileCopyrightText: Copyright (c) 2024-2025 沉默の金 <cmzj@cmzj.org>
+# SPDX-License-Identifier: MIT
+import math
+import os
+import re
+from collections.abc import Iterable
+from typing import NamedTuple
+
+from .logger import logger
+
+CGROUP_ROOT = "/sys/fs/cgroup"
+# 强制指定 make 的并行任务数
+MAKE_JOBS_ENV = "BUILD_HELPER_MAKE_JOBS"
+# cgroup v1 中不限制内存时的值接近 2^63
+CGROUP_V1_UNLIMITED = 1 << 60
+GIB = 1 << 30
+
+
+class JobProfile(NamedTuple):
+    """一类 make 目标的并行策略
+
+    memory_per_job 为每个任务预留的内存, cpu_factor 为每个 CPU 的任务数, max_jobs 为任务数上限,
+    limit_load 表示是否使用 -l 按系统负载限制新任务
+    """
+
+    pattern: re.Pattern | None
+    memory_per_job: int
+    cpu_factor: float = 1
+    max_jobs: int | None = None
+    limit_load: bool = True
+
+
+# 按顺序匹配, 使用第一个匹配的策略; pattern 匹配 make 目标, 编译软件包时还匹配所选软件包的编译依赖(如 rust/host)
+JOB_PROFILES = [
+    # 下载受网络限制, 不占用多少 CPU 与内存
+    JobProfile(re.compile(r"(^|/)download$"), GIB // 4, cpu_factor=4, max_jobs=16, limit_load=False),
+    # 依赖这些编译器的软件包单个编译任务就可能占用数 GiB 内存
+    JobProfile(re.compile(r"^(rust|llvm[-\w]*)/host$"), 4 * GIB),
+    JobProfile(re.compile(r"^(golang|node)/host$"), 2 * GIB),
+    # 内核与工具链
+    JobProfile(re.compile(r"^(target|toolchain)/"), int(1.5 * GIB)),
+]
+DEFAULT_PROFILE = JobProfile(None, GIB)
+
+
+class JobPlan(NamedTuple):
+    jobs: int
+    load: float | None
+
+    @property
+    def args(self) -> list[str]:
+        args = [f"-j{self.jobs}"]
+        if self.load is not None:
+            args.append(f"-l{self.load:g}")
+        return args
+
+
+def _read(path: str) -> str | None:
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def _cgroup_dirs(controller: str) -> list[str]:
+    """当前进程所在 cgroup 中 controller 的目录, 兼容 cgroup v1 与 v2"""
+    dirs = []
+    for line in (_read("/proc/self/cgroup") or "").splitlines():
+        _, controllers, path = line.split(":", 2)
+        if not controllers:
+            dirs.append(os.path.join(CGROUP_ROOT, path.lstrip("/")))
+        elif controller in controllers.split(","):
+            dirs.append(os.path.join(CGROUP_ROOT, controllers, path.lstrip("/")))
+            dirs.append(os.path.join(CGROUP_ROOT, controller, path.lstrip("/")))
+    # 容器中通常只挂载了自己的 cgroup
+    dirs.extend((CGROUP_ROOT, os.path.join(CGROUP_ROOT, controller)))
+    return [path for path in dict.fromkeys(map(os.path.normpath, dirs)) if os.path.isdir(path)]
+
+
+def cpu_limit() -> float:
+    """可用的 CPU 数, 考虑 CPU 亲和性与 cgroup 配额"""
+    cpus: float = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+    for path in _cgroup_dirs("cpu"):
+        if cpu_max := _read(os.path.join(path, "cpu.max")):
+            quota, _, period = cpu_max.partition(" ")
+            if quota != "max" and period:
+                cpus = min(cpus, int(quota) / int(period))
+        elif (quota := _read(os.path.join(path, "cpu.cfs_quota_us"))) and int(quota) > 0 and \
+                (period := _read(os.path.join(path, "cpu.cfs_period_us"))):
+            cpus = min(cpus, int(quota) / int(period))
+    return max(cpus, 1)
+
+
+def memory_available() -> int | None:
+    """可用内存(字节), 取 MemAvailable 与 cgroup 剩余内存中较小的值"""
+    available = None
+    for line in (_read("/proc/meminfo") or "").splitlines():
+        if line.startswith("MemAvailable:"):
+            available = int(line.split()[1]) * 1024
+            break
+    for path in _cgroup_dirs("memory"):
+        if (limit := _read(os.path.join(path, "memory.max"))) and limit != "max":
+            usage = _read(os.path.join(path, "memory.current"))
+        elif (limit := _read(os.path.join(path, "memory.limit_in_bytes"))) and int(limit) < CGROUP_V1_UNLIMITED:
+            usage = _read(os.path.join(path, "memory.usage_in_bytes"))
+        else:
+            continue
+        remaining = max(int(limit) - int(usage or 0), 0)
+        available = remaining if available is None else min(available, remaining)
+    return available
+
+
+def plan_jobs(target: str, build_depends: Iterable[str] = ()) -> JobPlan:
+    """根据 CPU 配额、可用内存与目标类型决定 make 的 -j 与 -l
+
+    build_depends 为本次编译的软件包的编译依赖, 其中有 rust、golang 等时按对应的策略预留更多内存。
+    """
+    keys = [target, *build_depends]
+    profile = next((profile for profile in JOB_PROFILES if profile.pattern and any(profile.pattern.search(key) for key in keys)), DEFAULT_PROFILE)
+    cpus = cpu_limit()
+    # 与 -j 一样多留一个任务的余量
+    load = round(cpus + 1, 1) if profile.limit_load else None
+    if (forced := os.getenv(MAKE_JOBS_ENV, "").strip()).isdigit() and int(forced) > 0:
+        logger.info("make %s: 使用环境变量%s指定的任务数 -j%s", target, MAKE_JOBS_ENV, forced)
+        return JobPlan(int(forced), load)
+
+    jobs = math.floor(cpus * profile.cpu_factor) + 1
+    memory = memory_available()
+    if memory is not None:
+        jobs = min(jobs, memory // profile.memory_per_job)
+    if profile.max_jobs:
+        jobs = min(jobs, profile.max_jobs)
+    plan = JobPlan(max(jobs, 1), load)
+    logger.info("make %s: %s (CPU: %g, 可用内存: %s, 每任务预留: %.1fGiB, 当前负载: %.2f)",
+                target, " ".join(plan.args), cpus, f"{memory / GIB:.1f}GiB" if memory is not None else "未知",
+                profile.memory_per_job / GIB, os.getloadavg()[0])
+    return plan
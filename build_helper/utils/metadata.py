@@ -0,0 +1,199 @@
+# SPDX-FileCopyrightText: Copyright (c) 2024-2025 沉默の金 <cmzj@cmzj.org>
+# SPDX-License-Identifier: MIT
+import contextlib
+import hashlib
+import mmap
+import os
+import pickle
+import threading
+from collections.abc import Callable, Iterable
+
+from .logger import logger
+from .paths import paths
+
+# 解析结果的格式变化时递增, 使旧的缓存失效
+CACHE_VERSION = 4
+# 缓存目录中最多保留的文件数
+MAX_CACHE_FILES = 16
+
+# 与 scripts/metadata.pm 一致, 这些字段的内容持续到单独一行的 "@@"
+MULTILINE_FIELDS = ("Description", "Config", "Target-Description", "Target-Profile-Description", "Target-Profile-Config")
+
+# .packageinfo 中每个软件包需要的字段
+PACKAGE_FIELDS = {
+    "Version": "version",
+    "Section": "section",
+    "Category": "category",
+    "Title": "title",
+    "Depends": "depends",
+    "Type": "type",
+    "Provides": "provides",
+}
+# .packageinfo 中每个 Source-Makefile 的字段, 出现在其软件包之前, 属于其中的所有软件包
+SOURCE_FIELDS = {
+    "Build-Depends": "build_depends",
+}
+
+
+def _split_space(value: str) -> list[str]:
+    return value.split(" ")
+
+
+def _split_comma(value: str) -> list[str]:
+    return value.split(",")
+
+
+# .targetinfo 中每个目标的字段: 字段名 -> (键, 转换函数)
+TARGET_FIELDS: dict[str, tuple[str, Callable[[str], str | list[str]]]] = {
+    "Target-Board": ("board", str),
+    "Target-Name": ("name", str),
+    "Target-Arch": ("arch", str),
+    "Target-Arch-Packages": ("arch_packages", str),
+    "Target-Feature": ("feature", _split_space),
+    "Linux-Version": ("linux_version", str),
+    "Linux-Release": ("linux_release", str),
+    "Linux-Kernel-Arch": ("linux_kernel_arch", str),
+    "Default-Packages": ("default_packages", _split_space),
+}
+PROFILE_FIELDS: dict[str, tuple[str, Callable[[str], str | list[str]]]] = {
+    "Target-Profile-Name": ("name", str),
+    "Target-Profile-Packages": ("packages", _split_space),
+    "Target-Profile-SupportedDevices": ("supported_devices", _split_comma),
+}
+
+
+def _fields(lines: Iterable[str]) -> Iterable[tuple[str, str]]:
+    """将每行拆分为 (字段名, 值), 跳过多行字段的内容"""
+    multiline = False
+    for line in lines:
+        if multiline:
+            multiline = line.rstrip("\n") != "@@"
+            continue
+        key, sep, value = line.partition(":")
+        if not sep:
+            continue
+        if key in MULTILINE_FIELDS:
+            multiline = True
+            continue
+        yield key, value.strip()
+
+
+def parse_packageinfo(lines: Iterable[str]) -> dict[str, dict]:
+    packages: dict[str, dict] = {}
+    makefile = None
+    source: dict[str, str | None] = dict.fromkeys(SOURCE_FIELDS.values())
+    package = None
+    for key, value in _fields(lines):
+        if key == "Source-Makefile":
+            makefile = value
+            source = dict.fromkeys(SOURCE_FIELDS.values())
+            package = None
+        elif key == "Package":
+            package = packages[value] = {"makefile": makefile, **source, **dict.fromkeys(PACKAGE_FIELDS.values())}
+        elif package is None and (field := SOURCE_FIELDS.get(key)):
+            source[field] = value
+        elif package is not None and (field := PACKAGE_FIELDS.get(key)):
+            package[field] = value
+    return packages
+
+
+def parse_targetinfo(lines: Iterable[str]) -> dict[str, dict]:
+    targets: dict[str, dict] = {}
+    target = None
+    profile = None
+    for key, value in _fields(lines):
+        if key == "Target":
+            target = targets[value] = {**{field: None for field, _ in TARGET_FIELDS.values()}, "target_profile": {}}
+            profile = None
+        elif target is None:
+            continue
+        elif key == "Target-Profile":
+            profile = target["target_profile"][value] = {}
+        elif field := TARGET_FIELDS.get(key):
+            target[field[0]] = field[1](value)
+        elif profile is not None and (field := PROFILE_FIELDS.get(key)):
+            profile[field[0]] = field[1](value)
+    return targets
+
+
+PARSERS: dict[str, Callable[[Iterable[str]], dict[str, dict]]] = {
+    "packageinfo": parse_packageinfo,
+    "targetinfo": parse_targetinfo,
+}
+
+
+class MetadataCache:
+    """tmp/.packageinfo 与 tmp/.targetinfo 解析结果的缓存
+
+    以文件内容的 sha256 为键, 进程内保存在内存中, 同时序列化到磁盘供其他进程与后续任务使用。
+    返回的字典在进程内共享, 调用方不应修改。
+    """
+
+    def __init__(self, root: str) -> None:
+        self.root = root
+        self.memo: dict[tuple[str, str], dict[str, dict]] = {}
+        self.lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def _cache_path(self, kind: str, digest: str) -> str:
+        return os.path.join(self.root, f"{kind}-{CACHE_VERSION}-{digest}.pickle")
+
+    def _load_cached(self, path: str) -> dict[str, dict] | None:
+        try:
+            with open(path, "rb") as f:
+                # 缓存文件由本程序写入
+                result = pickle.load(f)  # noqa: S301
+        except FileNotFoundError:
+            return None
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ValueError):
+            logger.warning("元数据缓存%s损坏, 重新解析", path)
+            return None
+        return result if isinstance(result, dict) else None
+
+    def _store(self, path: str, result: dict[str, dict]) -> None:
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning("写入元数据缓存失败: %s", e)
+            return
+        caches = sorted((entry for entry in os.scandir(self.root) if entry.name.endswith(".pickle")),
+                        key=lambda entry: entry.stat().st_mtime, reverse=True)
+        for entry in caches[MAX_CACHE_FILES:]:
+            with contextlib.suppress(OSError):
+                os.remove(entry.path)
+
+    def load(self, kind: str, path: str) -> dict[str, dict]:
+        """读取并解析文件, 内容未变化时直接使用缓存"""
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return {}
+            # 哈希与解析共用同一个内存映射, 不需要把整个文件复制到内存中
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                digest = hashlib.sha256(mm).hexdigest()
+                with self.lock:
+                    if (result := self.memo.get((kind, digest))) is not None:
+                        return result
+                cache_path = self._cache_path(kind, digest)
+                if (result := self._load_cached(cache_path)) is None:
+                    result = PARSERS[kind](line.decode("utf-8", errors="replace") for line in iter(mm.readline, b""))
+                    self._store(cache_path, result)
+                else:
+                    logger.debug("使用%s的解析缓存", path)
+        with self.lock:
+            self.memo[(kind, digest)] = result
+        return result
+
+
+_metadata_cache: MetadataCache | None = None
+_metadata_cache_lock = threading.Lock()
+
+
+def get_metadata_cache() -> MetadataCache:
+    global _metadata_cache  # noqa: PLW0603
+    with _metadata_cache_lock:
+        if _metadata_cache is None:
+            _metadata_cache = MetadataCache(os.path.join(paths.workdir, "metadata_cache"))
+        return _metadata_cache
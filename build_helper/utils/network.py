@@ -1,6 +1,17 @@
 # SPDX-FileCopyrightText: Copyright (c) 2024-2025 沉默の金 <cmzj@cmzj.org>
 # SPDX-License-Identifier: MIT
+import contextlib
+import fcntl
+import hashlib
 import json
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+from collections.abc import Iterator
+from email.utils import parsedate_to_datetime
 
 import httpx
 
@@ -14,18 +25,189 @@ HEADER = {
 }
 
 
-def request_get(url: str, retry: int = 6, headers: dict | None = None) -> str | None:
+# 重试的指数退避: 首次等待的上限、单次等待的上限, 以及服务器要求等待的最长时间(超过则放弃)
+BACKOFF_BASE = 1
+BACKOFF_MAX = 30
+MAX_THROTTLE_WAIT = 300
+
+# GitHub API 缓存: 在此时间内的缓存直接使用, 不再发起条件请求
+GH_API_CACHE_FRESH_SECONDS = 60
+# 一次运行中内容基本不变的接口, 可以在进程内复用并在上述时间内不重新验证;
+# 其他接口(如 actions/runs/{id}、artifacts、caches)在运行中会变化, 每次都发起条件请求
+GH_API_STABLE_PATTERN = re.compile(r"https://api\.github\.com/repos/[^/?]+/[^/?]+/releases/latest")
+
+_client: httpx.Client | None = None
+_client_pid: int | None = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> httpx.Client:
+    """进程内共享的 HTTP 客户端, 复用连接并支持 HTTP/2"""
+    global _client, _client_pid  # noqa: PLW0603
+    with _client_lock:
+        # fork 出的子进程不能复用父进程的连接
+        if _client is None or _client_pid != os.getpid():
+            _client = httpx.Client(http2=True, timeout=10, follow_redirects=True)
+            _client_pid = os.getpid()
+        return _client
+
+
+def _throttle_delay(response: httpx.Response) -> float | None:
+    """服务器通过 Retry-After 或 X-RateLimit-* 要求的等待时间, 没有要求时返回 None"""
+    if retry_after := response.headers.get("Retry-After"):
+        try:
+            return max(float(retry_after), 0)
+        except ValueError:
+            try:
+                return max(parsedate_to_datetime(retry_after).timestamp() - time.time(), 0)
+            except (TypeError, ValueError):
+                pass
+    if response.headers.get("X-RateLimit-Remaining") == "0" and (reset := response.headers.get("X-RateLimit-Reset")):
+        try:
+            return max(float(reset) - time.time(), 0) + 1
+        except ValueError:
+            pass
+    return None
+
+
+def _should_retry(response: httpx.Response) -> bool:
+    """除超时、限流与服务器错误外的 4xx 错误重试也不会成功"""
+    return response.status_code >= 500 or response.status_code in (408, 429) or _throttle_delay(response) is not None
+
+
+def _backoff(attempt: int) -> float:
+    # 指数退避 + 完全随机抖动, 避免多个进程同时重试
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))  # noqa: S311
+
+
+def _request(url: str,
+             retry: int = 6,
+             headers: dict | None = None,
+             method: str = "GET",
+             json_data: dict | None = None) -> httpx.Response | None:
+    """发送请求, 成功(含 304)时返回响应"""
+    error: Exception | None = None
     for i in range(retry):
+        delay = None
         try:
-            response = httpx.get(url, timeout=10, follow_redirects=True, headers=headers)
+            response = get_client().request(method, url, headers=headers, json=json_data)
+            if response.status_code == 304:
+                return response
             response.raise_for_status()
-            return response.text  # noqa: TRY300
+            return response  # noqa: TRY300
+        except httpx.HTTPStatusError as e:
+            error = e
+            if not _should_retry(e.response):
+                logger.error("请求失败 %s", f"{e.__class__.__name__}: {e!s}")
+                return None
+            delay = _throttle_delay(e.response)
         except Exception as e:
-            logger.warning(f"请求{url}失败， 重试次数：{i + 1}")
             error = e
+        if i == retry - 1:
+            break
+        if delay is None:
+            delay = _backoff(i)
+        elif delay > MAX_THROTTLE_WAIT:
+            logger.error(f"请求{url}被限流, 需等待{delay:.0f}秒, 放弃重试")
+            return None
+        logger.warning(f"请求{url}失败， 重试次数：{i + 1}, {delay:.1f}秒后重试")
+        time.sleep(delay)
     logger.error("请求失败，重试次数已用完 %s", f"{error.__class__.__name__}: {error!s}")
     return None
 
+
+def request_get(url: str, retry: int = 6, headers: dict | None = None) -> str | None:
+    response = _request(url, retry, headers)
+    return response.text if response is not None else None
+
+
+class GHAPICache:
+    """GitHub API 响应的磁盘缓存
+
+    按 ETag 发起条件请求(304 不计入速率限制), 每个请求对应一个文件并由文件锁保护,
+    prepare_cfg 的多个进程同时请求同一地址时只有一个进程真正发出请求, 其余进程直接使用其结果。
+    只有 GH_API_STABLE_PATTERN 中的接口在进程内复用并在短时间内不重新验证。
+    """
+
+    def __init__(self, root: str) -> None:
+        self.root = root
+        self.memo: dict[str, str] = {}
+        self.locks: dict[str, threading.Lock] = {}
+        self.lock = threading.Lock()
+        # 缓存中有使用 token 请求的响应, 只允许当前用户读取
+        os.makedirs(root, mode=0o700, exist_ok=True)
+
+    @contextlib.contextmanager
+    def _locked(self, key: str) -> Iterator[None]:
+        with self.lock:
+            thread_lock = self.locks.setdefault(key, threading.Lock())
+        with thread_lock, open(os.path.join(self.root, f"{key}.lock"), "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _read(self, key: str) -> dict | None:
+        try:
+            with open(os.path.join(self.root, f"{key}.json"), encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return entry if isinstance(entry, dict) and isinstance(entry.get("body"), str) else None
+
+    def _write(self, key: str, entry: dict) -> None:
+        path = os.path.join(self.root, f"{key}.json")
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with os.fdopen(os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w", encoding="utf-8") as f:
+            json.dump(entry, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def get(self, url: str, headers: dict) -> str | None:
+        # 不同 token 可见的内容可能不同, token 参与缓存键但不写入缓存
+        key = hashlib.sha256(f"{url}\0{headers.get('Authorization', '')}".encode()).hexdigest()
+        stable = GH_API_STABLE_PATTERN.fullmatch(url) is not None
+        with self._locked(key):
+            if stable and key in self.memo:
+                return self.memo[key]
+            entry = self._read(key)
+            if stable and entry and time.time() - entry.get("time", 0) < GH_API_CACHE_FRESH_SECONDS:
+                body = entry["body"]
+            else:
+                conditional = {"If-None-Match": entry["etag"]} if entry and entry.get("etag") else {}
+                response = _request(url, headers={**headers, **conditional})
+                if response is None:
+                    if entry is None:
+                        return None
+                    logger.warning(f"请求{url}失败, 使用缓存的响应")
+                    body = entry["body"]
+                else:
+                    if response.status_code == 304 and entry:
+                        logger.debug(f"{url} 未变化, 使用缓存的响应")
+                        body = entry["body"]
+                    else:
+                        body = response.text
+                    etag = response.headers.get("ETag") or (entry or {}).get("etag")
+                    with contextlib.suppress(OSError):
+                        self._write(key, {"url": url, "etag": etag, "body": body, "time": time.time()})
+            if stable:
+                self.memo[key] = body
+            return body
+
+
+_gh_api_cache: GHAPICache | None = None
+_gh_api_cache_lock = threading.Lock()
+
+
+def get_gh_api_cache() -> GHAPICache:
+    global _gh_api_cache  # noqa: PLW0603
+    with _gh_api_cache_lock:
+        if _gh_api_cache is None:
+            # 缓存中有使用 token 请求的响应, 不能放在出错时会上传的目录(workdir、errorinfo)中
+            root = os.getenv("RUNNER_TEMP") or tempfile.gettempdir()
+            _gh_api_cache = GHAPICache(os.path.join(root, "build_helper-gh_api_cache"))
+        return _gh_api_cache
+
 def get_gh_repo_last_releases(repo: str, token: str | None = None) -> dict | None:
     return gh_api_request(f"https://api.github.com/repos/{repo}/releases/latest", token)
 
@@ -36,9 +218,24 @@ def gh_api_request(url: str, token: str | None = None) -> dict | None:
                 }
     if token:
         headers["Authorization"] = f'Bearer {token}'
-    response = request_get(url, headers=headers)
+    response = get_gh_api_cache().get(url, headers)
     if isinstance(response, str):
         obj = json.loads(response)
         if isinstance(obj, dict):
             return obj
     return None
+
+def graphql_request(query: str, variables: dict, token: str | None) -> dict | None:
+    """GitHub GraphQL API 查询, 返回 data 字段"""
+    if not token:
+        logger.error("GraphQL API 需要 token")
+        return None
+    headers = {"Authorization": f"Bearer {token}"}
+    response = _request("https://api.github.com/graphql", headers=headers, method="POST", json_data={"query": query, "variables": variables})
+    if response is None:
+        return None
+    obj = response.json()
+    if errors := obj.get("errors"):
+        logger.error("GraphQL 查询失败: %s", "; ".join(str(error.get("message")) for error in errors))
+    data = obj.get("data")
+    return data if isinstance(data, dict) else None
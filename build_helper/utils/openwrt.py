@@ -1,42 +1,69 @@
 # SPDX-FileCopyrightText: Copyright (c) 2024-2025 沉默の金 <cmzj@cmzj.org>
 # SPDX-License-Identifier: MIT
+import logging
 import os
 import re
-import shutil
 import subprocess
-import tarfile
+import time
 from typing import Literal
 
 import pygit2
 from actions_toolkit import core
 
+from .archive import create_archive
+from .build_timing import get_build_timer
+from .dotconfig import DotConfig
+from .jobs import plan_jobs
 from .logger import logger
-from .network import request_get
-from .utils import apply_patch
+from .metadata import get_metadata_cache
+from .patch_store import apply_upstream_patches
+from .pkgdeps import DepGraph, get_depgraph
+from .runner import MAKE_PROGRESS_PATTERN, run_logged
+
+ARM_VERSION_PATTERN = re.compile(r"arm_[0-9]+")
+KERNEL_VERSION_PATTERN = re.compile(r"LINUX_(?P<major>[0-9]+)_(?P<minor>[0-9]+)")
+PACKAGE_NAME_PATTERN = re.compile(r"PACKAGE_[-a-zA-Z0-9]+")
+PACKAGE_NOT_SET_PATTERN = re.compile(r"# CONFIG_PACKAGE_(?P<name>[^ ]+) is not set$")
+PACKAGE_SELECTED_PATTERN = re.compile(r"CONFIG_PACKAGE_(?P<name>[^=]+)=[ym]$")
+
+# 源码归档中不包含的目录
+ARCHIVE_EXCLUDES = ("openwrt/.git", "openwrt/tmp", "openwrt/dl")
+
+# enable_kmods 最多进行的轮数(与原来固定进行的轮数相同), 正常情况下两三轮即可稳定
+ENABLE_KMODS_MAX_ROUNDS = 5
+
+# include/subdir.mk 在子目录编译失败时输出的信息, 如 "ERROR: package/feeds/packages/foo failed to build."
+# 与 "ERROR: package/feeds/packages/foo [host] failed to build."
+FAILED_BUILD_PATTERN = re.compile(r"ERROR: (?P<path>\S+) (?P<host>\[host\] )?failed to build")
+# 需要 BUILD_LOG 将每个步骤的输出写入 logs/ 的编译目标
+BUILD_LOG_TARGET_PATTERN = re.compile(r"^(tools|toolchain)/install$|(^|/)compile$")
+MAKE_ERROR_PATTERN = re.compile(r"make\[\d+\]: \*\*\* .*Error \d+")
+# 检查 logs/ 中每个日志时读取的末尾长度
+LOG_TAIL_SIZE = 4096
+# 单独重新编译失败的软件包时输出的最后行数
+DEBUG_TAIL_LINES = 500
+
+
+class BuildError(subprocess.CalledProcessError):
+    """编译失败, failed 为定位到的失败的软件包(子目录)"""
+
+    def __init__(self, returncode: int, cmd: list[str], failed: list[str]) -> None:
+        super().__init__(returncode, cmd)
+        self.failed = failed
+
+    def __str__(self) -> str:
+        return f"{super().__str__()} 编译失败的软件包: {', '.join(self.failed)}"
 
 
 class OpenWrtBase:
     def __init__(self, path: str) -> None:
         self.path = path
         self.files = os.path.join(path, 'files')
+        self.config = DotConfig(os.path.join(path, '.config'))
 
     def get_arch(self) -> tuple[str | None, str | None]:
-        arch = None
-        version = None
-        if os.path.isfile(os.path.join(self.path, '.config')):
-            with open(os.path.join(self.path, '.config')) as f:
-                for line in f:
-                    if line.startswith('CONFIG_ARCH='):
-                        match = re.match(r'^CONFIG_ARCH="(?P<arch>.*)"$', line)
-                        if match:
-                            arch = match.group("arch")
-                    elif line.startswith('CONFIG_arm_'):
-                        match = re.match(r'^CONFIG_arm_(?P<ver>[0-9]+)=y$', line)
-                        if match:
-                            version = match.group("ver")
-
-                    if arch and version:
-                        break
+        arch = self.config.get("ARCH")
+        version = next((symbol[4:] for symbol, value in self.config.items() if ARM_VERSION_PATTERN.fullmatch(symbol) and value == "y"), None)
         logger.debug("仓库%s的架构为%s,版本为%s", self.path, arch, version)
         return arch, version
 
@@ -45,39 +72,95 @@ class OpenWrtBase:
             f.write(config)
 
     def get_target(self) -> tuple[str | None, str | None]:
-        target, subtarget = None, None
-        if os.path.isfile(os.path.join(self.path, '.config')):
-            with open(os.path.join(self.path, '.config')) as f:
-                for line in f:
-                    if line.startswith('CONFIG_TARGET_BOARD='):
-                        match = re.match(r'^CONFIG_TARGET_BOARD="(?P<target>.*)"$', line)
-                        if match:
-                            target = match.group("target")
-                    elif line.startswith('CONFIG_TARGET_SUBTARGET='):
-                        match = re.match(r'^CONFIG_TARGET_SUBTARGET="(?P<subtarget>.*)"$', line)
-                        if match:
-                            subtarget = match.group("subtarget")
-                    if target and subtarget:
-                        return target, subtarget
-        return target, subtarget
+        return self.config.get("TARGET_BOARD"), self.config.get("TARGET_SUBTARGET")
+
+    def _selected_build_depends(self) -> set[str]:
+        """.config 中选中的软件包的编译依赖(如 rust/host), 用于决定编译软件包时的并行任务数"""
+        path = os.path.join(self.path, "tmp", ".packageinfo")
+        if not os.path.isfile(path) or not self.config.exists:
+            return set()
+        packages = get_metadata_cache().load("packageinfo", path)
+        build_depends = set()
+        for symbol, value in self.config.items():
+            if value in ("y", "m") and symbol.startswith("PACKAGE_") and (package := packages.get(symbol[8:])) and package.get("build_depends"):
+                # 与 Depends 相同, 可能有 "+" 前缀与 "条件:" 前缀
+                build_depends.update(depend.removeprefix("+").rpartition(":")[2] for depend in package["build_depends"].split())
+        return build_depends
+
+    def _run_make(self, args: list[str]) -> tuple[int, list[str]]:
+        """运行 make 并输出进度, 返回 (返回码, 输出中报告编译失败的子目录)"""
+        failed: list[str] = []
+        timer = get_build_timer()
+
+        def on_line(line: str) -> None:
+            timer.on_line(line)
+            if match := FAILED_BUILD_PATTERN.search(line):
+                # 主机端软件包在 logs/ 与 make 目标中为 <子目录>/host
+                subdir = f"{match.group('path')}/host" if match.group("host") else match.group("path")
+                if subdir not in failed:
+                    failed.append(subdir)
+
+        start = time.time()
+        returncode = run_logged(args, self.path, name=args[1], progress=MAKE_PROGRESS_PATTERN, on_line=on_line).returncode
+        timer.add_target(args[1], start, time.time())
+        return returncode, failed
+
+    def _failed_from_logs(self, since: float) -> list[str]:
+        """从 since 之后更新的 logs/ 日志中找出以 make 错误结束的子目录"""
+        logs_path = os.path.join(self.path, "logs")
+        failed = []
+        for root, _, files in os.walk(logs_path):
+            for file in files:
+                path = os.path.join(root, file)
+                if not file.endswith(".txt") or os.path.getmtime(path) < since:
+                    continue
+                with open(path, "rb") as f:
+                    f.seek(max(0, os.path.getsize(path) - LOG_TAIL_SIZE))
+                    tail = f.read().decode("utf-8", errors="replace")
+                if MAKE_ERROR_PATTERN.search(tail) and (subdir := os.path.relpath(root, logs_path)) not in failed:
+                    failed.append(subdir)
+        return failed
 
     def make(self, target: str, debug: bool = False) -> None:
+        """编译 target, 失败时抛出 BuildError
+
+        失败时只以 debug 模式单独重新编译失败的软件包以收集错误信息, 无法定位时才以 debug 模式重新编译整个 target。
+        """
         args = ['make', target]
         if debug:
             args.extend(["-j1", "V=s"])
         else:
-            if not (cpu_count := os.cpu_count()):
-                cpu_count = 1
-            args.append(f"-j{cpu_count + 1}")
-        logger.debug("运行命令：%s", " ".join(args))
-        result = subprocess.run(args, cwd=self.path)
-        if result.returncode != 0:
-            if not debug:
-                logger.error("编译失败，尝试使用debug模式重新编译")
-                self.make(target, debug=True)
-            else:
-                logger.error("编译失败，请检查错误信息")
-                raise subprocess.CalledProcessError(result.returncode, result.args, result.stdout, result.stderr)
+            args.extend(plan_jobs(target, self._selected_build_depends() if target.startswith("package/") else ()).args)
+        if BUILD_LOG_TARGET_PATTERN.search(target):
+            # 每个步骤的输出写入 logs/, 用于定位失败的软件包与统计耗时
+            args.append("BUILD_LOG=1")
+        start = time.time()
+        returncode, failed = self._run_make(args)
+        if returncode == 0:
+            return
+        failed.extend(subdir for subdir in self._failed_from_logs(start) if subdir not in failed)
+        if debug:
+            logger.error("编译失败，请检查错误信息")
+            raise BuildError(returncode, args, failed)
+        if not failed:
+            logger.error("编译失败，未能定位失败的软件包，尝试使用debug模式重新编译")
+            self.make(target, debug=True)
+            return
+
+        logger.error("编译失败的软件包: %s", ", ".join(failed))
+        still_failed = []
+        for subdir in failed:
+            logger.info("使用debug模式重新编译%s以收集错误信息", subdir)
+            if run_logged(['make', f"{subdir}/compile", "-j1", "V=s"], self.path, name=f"{subdir}/compile", tail_lines=DEBUG_TAIL_LINES).returncode != 0:
+                still_failed.append(subdir)
+        if still_failed:
+            raise BuildError(returncode, args, still_failed)
+        logger.info("失败的软件包单独编译成功，继续编译%s", target)
+        if self._run_make(args)[0] == 0:
+            return
+        logger.error("编译失败，尝试使用debug模式重新编译")
+        self.make(target, debug=True)
+
 class OpenWrt(OpenWrtBase):
     def __init__(self, path: str, tag_branch: str | None = None) -> None:
         super().__init__(path)
@@ -109,34 +192,24 @@ class OpenWrt(OpenWrtBase):
         self.tag_branch = tag_branch
 
     def feed_update(self) -> None:
-        result = subprocess.run([os.path.join(self.path, "scripts", "feeds"), 'update', '-a'], cwd=self.path, capture_output=True, text=True)
-        if result.returncode != 0:
-            logger.error("运行命令：scripts/feeds update -a失败\nstdout: %s\nstderr: %s", result.stdout, result.stderr)
-            raise subprocess.CalledProcessError(result.returncode, result.args, result.stdout, result.stderr)
-        logger.debug("运行命令：scripts/feeds update -a成功\nstdout: %s\nstderr: %s", result.stdout, result.stderr)
+        result = run_logged([os.path.join(self.path, "scripts", "feeds"), 'update', '-a'], self.path, name="feeds-update", check=True)
+        logger.debug("运行命令：scripts/feeds update -a成功, 日志: %s", result.log_path)
 
     def feed_install(self) -> None:
-        result = subprocess.run([os.path.join(self.path, "scripts", "feeds"), 'install', '-a'], cwd=self.path, capture_output=True, text=True)
-        if result.returncode != 0:
-            logger.error("运行命令：scripts/feeds install -a失败\nstdout: %s\nstderr: %s", result.stdout, result.stderr)
-            raise subprocess.CalledProcessError(result.returncode, result.args, result.stdout, result.stderr)
-        logger.debug("运行命令：scripts/feeds install -a成功\nstdout: %s\nstderr: %s", result.stdout, result.stderr)
+        result = run_logged([os.path.join(self.path, "scripts", "feeds"), 'install', '-a'], self.path, name="feeds-install", check=True)
+        logger.debug("运行命令：scripts/feeds install -a成功, 日志: %s", result.log_path)
 
     def make_defconfig(self) -> None:
-        result = subprocess.run(['make', 'defconfig'], cwd=self.path, capture_output=True, text=True)
-        if result.returncode != 0:
-            logger.error("运行命令：make defconfig失败\nstdout: %s\nstderr: %s", result.stdout, result.stderr)
-            raise subprocess.CalledProcessError(result.returncode, result.args, result.stdout, result.stderr)
-        logger.debug("运行命令：make defconfig成功\nstdout: %s\nstderr: %s", result.stdout, result.stderr)
+        result = run_logged(['make', 'defconfig'], self.path, name="defconfig", check=True)
+        logger.debug("运行命令：make defconfig成功, 日志: %s", result.log_path)
 
     def make_download(self, debug: bool = False, taget: str = "download") -> None:
         args = ['make', taget]
         if debug:
             args.extend(["-j1", "V=s"])
         else:
-            args.append("-j16")
-        logger.debug("运行命令：%s", " ".join(args))
-        subprocess.run(args, cwd=self.path, check=True)
+            args.extend(plan_jobs(taget).args)
+        run_logged(args, self.path, name=taget, progress=MAKE_PROGRESS_PATTERN, check=True)
 
     def download_source(self, taget: str = "download") -> None:
         for i in range(2):
@@ -153,33 +226,27 @@ class OpenWrt(OpenWrtBase):
 
     def get_kernel_version(self) -> str | None:
         kernel_version = None
-        if os.path.isfile(os.path.join(self.path, '.config')):
-            with open(os.path.join(self.path, '.config')) as f:
-                for line in f:
-                    if line.startswith('CONFIG_LINUX_'):
-                        match = re.match(r'^CONFIG_LINUX_(?P<major>[0-9]+)_(?P<minor>[0-9]+)=y$', line)
-                        if match:
-                            kernel_version = f"{match.group("major")}.{match.group("minor")}"
-                            break
+        for symbol, value in self.config.items():
+            if value == "y" and (match := KERNEL_VERSION_PATTERN.fullmatch(symbol)):
+                kernel_version = f"{match.group("major")}.{match.group("minor")}"
+                break
         logger.debug("配置%s的内核版本为%s", self.path, kernel_version)
         return kernel_version
 
     def get_package_config(self, package: str) -> Literal["y", "n", "m"] | None:
-        package_config = None
-        if os.path.isfile(os.path.join(self.path, '.config')):
-            with open(os.path.join(self.path, '.config')) as f:
-                for line in f:
-                    if line.startswith(f'CONFIG_PACKAGE_{package}='):
-                        match = re.match(fr'^CONFIG_PACKAGE_{package}=(?P<config>[ymn])$', line)
-                        if match:
-                            package_config = match.group("config")
-                            if  package_config in ("y", "n", "m"):
-                                break
-                            package_config = None
-        else:
+        if not self.config.exists:
             logger.warning("仓库%s的配置文件不存在", self.path)
+        package_config = self.config.get_package_config(package)
         logger.debug("仓库%s的软件包%s的配置为%s", self.path, package, package_config)
-        return package_config # type: ignore[]
+        return package_config
+
+    def get_package_configs(self, packages: list[str]) -> dict[str, Literal["y", "n", "m"] | None]:
+        """批量获取软件包的配置"""
+        if not self.config.exists:
+            logger.warning("仓库%s的配置文件不存在", self.path)
+        package_configs = self.config.get_package_configs(packages)
+        logger.debug("仓库%s的软件包配置为%s", self.path, package_configs)
+        return package_configs
 
     def check_package_dependencies(self) -> bool:
         subprocess.run(['gmake', '-s', 'prepare-tmpinfo'], cwd=self.path)
@@ -189,14 +256,8 @@ class OpenWrt(OpenWrtBase):
         return True
 
     def fix_problems(self) -> None:
-        if self.tag_branch.startswith("v") and self.tag_branch[1:3].isdigit() and int(self.tag_branch[1:3]) < 24:
-            #https://github.com/openwrt/openwrt/commit/ecc53240945c95bc77663b79ccae6e2bd046c9c8
-            patch = request_get("https://github.com/openwrt/openwrt/commit/ecc53240945c95bc77663b79ccae6e2bd046c9c8.patch")
-            if patch:
-                if not apply_patch(patch, self.path):
-                    core.error("修复内核模块依赖失败, 这可能会导致编译错误。\nhttps://github.com/openwrt/openwrt/commit/ecc53240945c95bc77663b79ccae6e2bd046c9c8")
-            else:
-                core.error("获取内核模块依赖修复补丁失败, 这可能会导致编译错误。\nhttps://github.com/openwrt/openwrt/commit/ecc53240945c95bc77663b79ccae6e2bd046c9c8")
+        # 应用上游修复补丁
+        apply_upstream_patches(self.path, self.tag_branch)
 
         # 替换dnsmasq为dnsmasq-full
         logger.info("替换dnsmasq为dnsmasq-full")
@@ -217,26 +278,6 @@ class OpenWrt(OpenWrtBase):
         with open(os.path.join(self.path, "feeds", "packages", "lang", "rust", "Makefile"), 'w', encoding='utf-8') as f:
             f.write(content)
 
-        if self.tag_branch == "v23.05.2":
-            logger.info("修复iperf3冲突")
-            patch = request_get("https://github.com/openwrt/packages/commit/cea45c75c0153a190ee41dedaf6526ae08e33928.patch")
-            if patch:
-                if not apply_patch(patch, os.path.join(self.path, "feeds", "packages")):
-                    core.error("修复iperf3冲突失败, 这可能会导致编译错误。\nhttps://github.com/openwrt/packages/commit/cea45c75c0153a190ee41dedaf6526ae08e33928")
-            else:
-                core.error("获取iperf3冲突修复补丁失败, 这可能会导致编译错误。\nhttps://github.com/openwrt/packages/commit/cea45c75c0153a190ee41dedaf6526ae08e33928")
-
-        if self.tag_branch == "v23.05.3":
-            logger.info("修复libpfring")
-            patch1 = request_get("https://github.com/openwrt/packages/commit/534bd518f3fff6c31656a1edcd7e10922f3e06e5.patch")
-            patch2 = request_get("https://github.com/openwrt/packages/commit/c3a50a9fac8f9d8665f8b012abd85bb9e461e865.patch")
-            if patch1 and patch2:
-                if not (apply_patch(patch1, os.path.join(self.path, "feeds", "packages")) and
-                        apply_patch(patch2, os.path.join(self.path, "feeds", "packages"))):
-                    core.error("修复libpfring失败, 这可能会导致编译错误。\nttps://github.com/openwrt/packages/commit/c3a50a9fac8f9d8665f8b012abd85bb9e461e865")
-            else:
-                core.error("获取libpfring修复补丁失败, 这可能会导致编译错误。\nttps://github.com/openwrt/packages/commit/c3a50a9fac8f9d8665f8b012abd85bb9e461e865")
-
         # 修复bcm27xx-gpu-fw
         # logger.info("修复bcm27xx-gpu-fw")
         # 不知道为什么就是没有被执行Build/InstallDev中的命令把东西复制到KERNEL_BUILD_DIR下
@@ -250,185 +291,58 @@ class OpenWrt(OpenWrtBase):
         if not os.path.exists(path):
             self.make_defconfig()
 
-        packages = {}
-
-        makefile = None
-        package = None
-        version = None
-        section = None
-        category = None
-        title = None
-        depends = None
-        type_ = None
-
-        count = 0
-        with open(path, encoding='utf-8') as f:
-            for line in f:
-                if line.startswith("Source-Makefile: "):
-                    makefile = line.split("Source-Makefile: ")[1].strip()
-                if line.startswith("Package: "):
-                    if count != 0:
-                        packages[package] = {
-                            "makefile": makefile,
-                            "version": version,
-                            "section": section,
-                            "category": category,
-                            "title": title,
-                            "depends": depends,
-                            "type": type_,
-                        }
-                    package = line.split("Package: ")[1].strip()
-                    version = None
-                    section = None
-                    category = None
-                    title = None
-                    depends = None
-                    type_ = None
-                    count += 1
-                elif line.startswith("Version: "):
-                    version = line.split("Version: ")[1].strip()
-                elif line.startswith("Section: "):
-                    section = line.split("Section: ")[1].strip()
-                elif line.startswith("Category: "):
-                    category = line.split("Category: ")[1].strip()
-                elif line.startswith("Title: "):
-                    title = line.split("Title: ")[1].strip()
-                elif line.startswith("Depends: "):
-                    depends = line.split("Depends: ")[1].strip()
-                elif line.startswith("Type: "):
-                    type_ = line.split("Type: ")[1].strip()
-
-            if package and package not in packages:
-                packages[package] = {
-                    "makefile": makefile,
-                    "version": version,
-                    "section": section,
-                    "category": category,
-                    "title": title,
-                    "depends": depends,
-                    "type": type_,
-                }
-
-        if count == 0:
+        packages = get_metadata_cache().load("packageinfo", path)
+        if not packages:
             msg = "没有获取到任何包信息"
             raise ValueError(msg)
-        logger.debug("解析出%s个包信息", count)
+        logger.debug("解析出%s个包信息", len(packages))
         return packages
 
+    def get_depgraph(self) -> DepGraph:
+        return get_depgraph(self.get_packageinfos())
+
     def archive(self, path: str) -> None:
-        if os.path.exists(os.path.join(self.path, ".git")):
-            shutil.rmtree(os.path.join(self.path, ".git"))
-        if os.path.exists(os.path.join(self.path, "tmp")):
-            shutil.rmtree(os.path.join(self.path, "tmp"))
-        if os.path.exists(os.path.join(self.path, "dl")):
-            shutil.rmtree(os.path.join(self.path, "dl"))
-        with tarfile.open(path, "w:gz") as tar:
-            tar.add(self.path, arcname="openwrt")
+        create_archive(path, {self.path: "openwrt"}, excludes=ARCHIVE_EXCLUDES)
 
     def get_targetinfos(self) -> dict:
         path = os.path.join(self.path, "tmp", ".targetinfo")
         if not os.path.exists(path):
             self.make_defconfig()
 
-        targets = {}
-
-        target = None
-        board = None
-        name = None
-        arch = None
-        arch_packages = None
-        feature = None
-        linux_version = None
-        linux_release = None
-        linux_kernel_arch = None
-        default_packages = None
-        target_profile = {}
-
-        count = 0
-        with open(path) as f:
-            for line in f:
-                if line.startswith("Target: "):
-                    if count != 0:
-                        targets[target] = {
-                            "board": board,
-                            "name": name,
-                            "arch": arch,
-                            "arch_packages": arch_packages,
-                            "feature": feature,
-                            "linux_version": linux_version,
-                            "linux_release": linux_release,
-                            "linux_kernel_arch": linux_kernel_arch,
-                            "default_packages": default_packages,
-                            "target_profile": target_profile,
-                        }
-                    target = line.split("Target: ")[1].strip()
-                    board = None
-                    name = None
-                    arch = None
-                    arch_packages = None
-                    feature = None
-                    linux_version = None
-                    linux_release = None
-                    linux_kernel_arch = None
-                    default_packages = None
-                    target_profile = {}
-                    count += 1
-                elif line.startswith("Target-Board: "):
-                    board = line.split("Target-Board: ")[1].strip()
-                elif line.startswith("Target-Name: "):
-                    name = line.split("Target-Name: ")[1].strip()
-                elif line.startswith("Target-Arch: "):
-                    arch = line.split("Target-Arch: ")[1].strip()
-                elif line.startswith("Target-Arch-Packages: "):
-                    arch_packages = line.split("Target-Arch-Packages: ")[1].strip()
-                elif line.startswith("Target-Feature: "):
-                    feature = line.split("Target-Feature: ")[1].strip().split(" ")
-                elif line.startswith("Linux-Version: "):
-                    linux_version = line.split("Linux-Version: ")[1].strip()
-                elif line.startswith("Linux-Release: "):
-                    linux_release = line.split("Linux-Release: ")[1].strip()
-                elif line.startswith("Linux-Kernel-Arch: "):
-                    linux_kernel_arch = line.split("Linux-Kernel-Arch: ")[1].strip()
-                elif line.startswith("Default-Packages: "):
-                    default_packages = line.split("Default-Packages: ")[1].strip().split(" ")
-                elif line.startswith("Target-Profile: "):
-                    target_profile[line.split("Target-Profile: ")[1].strip()] = {}
-                elif line.startswith("Target-Profile-Name: "):
-                    target_profile[list(target_profile.keys())[-1]]["name"] = line.split("Target-Profile-Name: ")[1].strip()
-                elif line.startswith("Target-Profile-Packages: "):
-                    target_profile[list(target_profile.keys())[-1]]["packages"] = line.split("Target-Profile-Packages: ")[1].strip().split(" ")
-                elif line.startswith("Target-Profile-SupportedDevices: "):
-                    target_profile[list(target_profile.keys())[-1]]["supported_devices"] = line.split("Target-Profile-SupportedDevices: ")[1].strip().split(",")
-
-            if target and target not in targets:
-                targets[target] = {
-                    "board": board,
-                    "name": name,
-                    "arch": arch,
-                    "arch_packages": arch_packages,
-                    "feature": feature,
-                    "linux_version": linux_version,
-                    "linux_release": linux_release,
-                    "linux_kernel_arch": linux_kernel_arch,
-                    "default_packages": default_packages,
-                    "target_profile": target_profile,
-                }
-        if count == 0:
+        targets = get_metadata_cache().load("targetinfo", path)
+        if not targets:
             msg = "未解析出目标架构信息"
             raise ValueError(msg)
         return targets
 
     def get_targetinfo(self) -> dict | None:
         targets = self.get_targetinfos()
-        targetinfos = None
-        with open(os.path.join(self.path, ".config")) as f:
-            for line in f:
-                if match := re.match(r"CONFIG_TARGET_(?P<target>[^=]+)=", line):
-                    target = match.group('target').replace("_", "/")
-                    targetinfos = targets.get(target, targetinfos)
-                    if targetinfos and target:
-                        targetinfos["target"] = target
-        return targetinfos
+        targetinfo = None
+        for symbol in self.config.symbols():
+            if symbol.startswith("TARGET_"):
+                target = symbol.removeprefix("TARGET_").replace("_", "/")
+                if target in targets:
+                    # 解析结果在进程内共享, 返回副本
+                    targetinfo = {**targets[target], "target": target}
+        return targetinfo
+
+    def _rewrite_package_config(self, enable: set[str], disable: set[str]) -> bool:
+        """一次遍历 .config, 将 enable 中未设置的包设为 m, 删除 disable 中已选中的包; 返回是否有修改"""
+        path = os.path.join(self.path, ".config")
+        changed = False
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(path, encoding="utf-8") as src, open(tmp_path, "w", encoding="utf-8") as dst:
+            for line in src:
+                if (match := PACKAGE_NOT_SET_PATTERN.match(line)) and match.group("name") in enable:
+                    dst.write(f"CONFIG_PACKAGE_{match.group('name')}=m\n")
+                    changed = True
+                elif disable and (match := PACKAGE_SELECTED_PATTERN.match(line)) and match.group("name") in disable:
+                    logger.debug("取消编译包: %s", match.group("name"))
+                    changed = True
+                else:
+                    dst.write(line)
+        os.replace(tmp_path, path)
+        return changed
 
     def enable_kmods(self, exclude_list: list[str], only_kmods: bool = False) -> None:
         exclude_pattern = re.compile(r"|".join(exclude_list))
@@ -442,29 +356,41 @@ class OpenWrt(OpenWrtBase):
         else:
             default_packages = []
 
-        for _ in range(5):
-            with open(os.path.join(self.path, ".config")) as f:
-             config = f.read()
-            with open(os.path.join(self.path, ".config"), "w") as f:
-                for line in config.splitlines():
-                    if match := re.match(r"# CONFIG_PACKAGE_(?P<name>[^ ]+) is not set", line):
-                        name = match.group('name')
-                        if not exclude_pattern.match(name) and name in kmods:
-                            f.write(f"CONFIG_PACKAGE_{name}=m\n")
-                        else:
-                            f.write(line + "\n")
-                    elif only_kmods and (match := re.match(r"CONFIG_PACKAGE_(?P<name>[^=]+)=[ym]", line)):
-                        name = match.group('name')
-                        package = packages.get(name)
-                        if package and (package["section"] not in ("kernel", "base", "boot", "firmware", "sys", "system") and
-                                        package["category"] not in ("Boot Loaders", "Firmware", "Base system", "Kernel modules", "System") and
-                                        package not in default_packages):
-                            logger.debug("取消编译包: %s", name)
-                            continue
-                        f.write(line + "\n")
-                    else:
-                        f.write(line + "\n")
-                self.make_defconfig()
+        # 规则只编译一次: 需要启用的 kmod 与(only_kmods 时)需要取消编译的包
+        enable = {name for name in kmods if not exclude_pattern.match(name)}
+        graph = self.get_depgraph()
+        if unresolved := {name: deps for name, deps in graph.missing().items() if name in enable}:
+            logger.debug("以下kmod的依赖不存在, 无法启用: %s", unresolved)
+        disable = set()
+        if only_kmods:
+            disable = {name for name, package in packages.items()
+                       if package["section"] not in ("kernel", "base", "boot", "firmware", "sys", "system") and
+                       package["category"] not in ("Boot Loaders", "Firmware", "Base system", "Kernel modules", "System") and
+                       name not in default_packages}
+            # kmod 与默认包选中(+)的依赖会被 defconfig 重新选中, 不必取消
+            roots = enable | set(default_packages)
+            kept = disable & graph.closure(roots, self.config, select_only=True)
+            disable -= kept
+            if logger.isEnabledFor(logging.DEBUG):
+                for name in sorted(kept):
+                    logger.debug("保留被依赖的包 %s: %s", name, " -> ".join(graph.why(name, roots, self.config, select_only=True) or [name]))
+
+        # 启用的 kmod 可能让更多 kmod 可选, 重复直到配置不再变化
+        for round_ in range(1, ENABLE_KMODS_MAX_ROUNDS + 1):
+            before = dict(self.config.items())
+            if not self._rewrite_package_config(enable, disable) and round_ > 1:
+                logger.info("启用kmod在第%s轮达到稳定", round_ - 1)
+                break
+            self.make_defconfig()
+            after = dict(self.config.items())
+            added = [symbol for symbol, value in after.items() if value in ("y", "m") and before.get(symbol) not in ("y", "m")]
+            logger.info("启用kmod第%s轮: 新增%s个符号", round_, len(added))
+            logger.debug("第%s轮新增的符号: %s", round_, added)
+            if after == before:
+                logger.info("启用kmod在第%s轮达到稳定", round_)
+                break
+        else:
+            logger.warning("启用kmod在%s轮后仍未稳定", ENABLE_KMODS_MAX_ROUNDS)
         logger.debug("启用所有kmod, 配置差异: %s", self.get_diff_config())
 
     def __getstate__(self) -> dict:
@@ -495,9 +421,5 @@ class ImageBuilder(OpenWrtBase):
         subprocess.run(["make", "image", f'PACKAGES={" ".join(self.get_packages())}', f'FILES={os.path.join(self.path, "files")}'], cwd=self.path, check=True)
 
     def get_packages(self) -> list[str]:
-        packages = []
-        with open(os.path.join(self.path, ".config")) as f:
-            for line in f:
-                if match := re.match(r"CONFIG_PACKAGE_(?P<name>[-a-zA-Z0-9]+)=y", line):
-                    packages.append(match.group('name'))  # noqa: PERF401
-        return packages
+        return [symbol.removeprefix("PACKAGE_") for symbol, value in self.config.items()
+                if value == "y" and PACKAGE_NAME_PATTERN.fullmatch(symbol)]
@@ -0,0 +1,129 @@
+# SPDX-FileCopyrightText: Copyright (c) 2024-2025 沉默の金 <cmzj@cmzj.org>
+# SPDX-License-Identifier: MIT
+import os
+import threading
+from collections.abc import Callable, Iterable
+
+from actions_toolkit import core
+
+from .downloader import DLPriority, DLTask, dl2
+from .logger import logger
+from .network import request_get
+from .paths import paths
+from .utils import apply_patch, check_patch
+
+
+def _before_v24(tag_branch: str) -> bool:
+    return tag_branch.startswith("v") and tag_branch[1:3].isdigit() and int(tag_branch[1:3]) < 24
+
+
+class UpstreamPatch:
+    """来自上游提交的修复补丁
+
+    target 为应用补丁的目录(相对于 openwrt 源码目录), applies 根据 openwrt 的标签/分支判断是否需要该补丁。
+    """
+
+    def __init__(self, name: str, repo: str, commit: str, target: str, applies: Callable[[str], bool]) -> None:
+        self.name = name
+        self.repo = repo
+        self.commit = commit
+        self.target = target
+        self.applies = applies
+
+    @property
+    def url(self) -> str:
+        return f"https://github.com/{self.repo}/commit/{self.commit}.patch"
+
+
+UPSTREAM_PATCHES = [
+    UpstreamPatch("内核模块依赖", "openwrt/openwrt", "ecc53240945c95bc77663b79ccae6e2bd046c9c8", "", _before_v24),
+    UpstreamPatch("iperf3冲突", "openwrt/packages", "cea45c75c0153a190ee41dedaf6526ae08e33928", "feeds/packages",
+                  lambda tag_branch: tag_branch == "v23.05.2"),
+    UpstreamPatch("libpfring", "openwrt/packages", "534bd518f3fff6c31656a1edcd7e10922f3e06e5", "feeds/packages",
+                  lambda tag_branch: tag_branch == "v23.05.3"),
+    UpstreamPatch("libpfring", "openwrt/packages", "c3a50a9fac8f9d8665f8b012abd85bb9e461e865", "feeds/packages",
+                  lambda tag_branch: tag_branch == "v23.05.3"),
+]
+
+
+class PatchStore:
+    """以提交 SHA 为键的本地补丁库, 同一提交的补丁内容不会变化, 下载一次后可一直使用"""
+
+    def __init__(self, root: str) -> None:
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, patch: UpstreamPatch) -> str:
+        return os.path.join(self.root, f"{patch.commit}.patch")
+
+    def fetch(self, patches: Iterable[UpstreamPatch]) -> list[DLTask]:
+        """并发下载库中还没有的补丁, 返回下载任务"""
+        missing = {patch.commit: patch for patch in patches if not os.path.isfile(self.path(patch))}
+        return [dl2(patch.url, self.path(patch), cache=False, priority=DLPriority.HIGH) for patch in missing.values()]
+
+    def get(self, patch: UpstreamPatch) -> str | None:
+        path = self.path(patch)
+        if not os.path.isfile(path):
+            # 未预先下载时直接获取, 写入临时文件后替换, 多个进程同时获取也不会冲突
+            if not (content := request_get(patch.url)):
+                return None
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+        with open(path, encoding="utf-8") as f:
+            content = f.read()
+        if not content.startswith("From "):
+            logger.warning("补丁%s的内容无效, 已删除", path)
+            os.remove(path)
+            return None
+        return content
+
+
+_patch_store: PatchStore | None = None
+_patch_store_lock = threading.Lock()
+
+
+def get_patch_store() -> PatchStore:
+    global _patch_store  # noqa: PLW0603
+    with _patch_store_lock:
+        if _patch_store is None:
+            _patch_store = PatchStore(os.path.join(paths.workdir, "patch_store"))
+        return _patch_store
+
+
+def prefetch_upstream_patches(tag_branches: Iterable[str]) -> list[DLTask]:
+    """下载这些标签/分支需要的补丁, 供各配置的处理进程直接使用
+
+    预下载只是优化, 返回的任务应使用 wait_prefetched_patches 等待, 不要放入 wait_dl_tasks 中。
+    """
+    tag_branches = set(tag_branches)
+    return get_patch_store().fetch(patch for patch in UPSTREAM_PATCHES if any(patch.applies(tag_branch) for tag_branch in tag_branches))
+
+
+def wait_prefetched_patches(dl_tasks: list[DLTask]) -> None:
+    """等待补丁的预下载, 失败只记录日志; 应用补丁时会重新获取, 仍然失败时再报告错误"""
+    for task in dl_tasks:
+        task.wait()
+        if task.error is not None:
+            logger.warning("预下载补丁%s失败: %s", os.path.basename(task.path), task.error)
+
+
+def apply_upstream_patches(openwrt_path: str, tag_branch: str) -> None:
+    """应用需要的上游补丁, 已应用过的补丁会被跳过"""
+    store = get_patch_store()
+    for patch in UPSTREAM_PATCHES:
+        if not patch.applies(tag_branch):
+            continue
+        logger.info("修复%s", patch.name)
+        content = store.get(patch)
+        if content is None:
+            core.error(f"获取{patch.name}修复补丁失败, 这可能会导致编译错误。\n{patch.url}")
+            continue
+        target = os.path.join(openwrt_path, patch.target)
+        if check_patch(content, target, reverse=True):
+            logger.info("补丁%s已应用, 跳过", patch.commit)
+            continue
+        # 先试运行, 避免只应用了部分内容
+        if not (check_patch(content, target) and apply_patch(content, target)):
+            core.error(f"修复{patch.name}失败, 这可能会导致编译错误。\n{patch.url}")
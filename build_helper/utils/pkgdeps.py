@@ -0,0 +1,229 @@
+# SPDX-FileCopyrightText: Copyright (c) 2024-2025 沉默の金 <cmzj@cmzj.org>
+# SPDX-License-Identifier: MIT
+import re
+import threading
+from collections import deque
+from collections.abc import Iterable
+from typing import NamedTuple
+
+from .dotconfig import DotConfig
+from .logger import logger
+
+EXPRESSION_TOKEN_PATTERN = re.compile(r"\s*(\|\||&&|!=|!|=|\(|\)|[^\s|&!=()]+)")
+
+
+class Dependency(NamedTuple):
+    """Depends 中的一项: "+" 表示选中(select), condition 为 "条件:包" 形式中的条件"""
+
+    name: str
+    select: bool
+    condition: str | None
+
+
+def _split_depends(depends: str) -> list[str]:
+    """按空白拆分 Depends, 括号内的空白不拆分"""
+    tokens = []
+    depth = 0
+    current = ""
+    for char in depends:
+        if char.isspace() and depth == 0:
+            if current:
+                tokens.append(current)
+            current = ""
+            continue
+        depth += (char == "(") - (char == ")")
+        current += char
+    if current:
+        tokens.append(current)
+    return tokens
+
+
+def _split_condition(token: str) -> tuple[str | None, str]:
+    """拆分 "条件:包", 与 scripts/metadata.pm 一致以最后一个括号外的冒号为界"""
+    depth = 0
+    split = -1
+    for i, char in enumerate(token):
+        depth += (char == "(") - (char == ")")
+        if char == ":" and depth == 0:
+            split = i
+    if split == -1:
+        return None, token
+    return token[:split], token[split + 1:]
+
+
+def parse_depends(depends: str | None) -> tuple[list[Dependency], list[str]]:
+    """解析 Depends, 返回 (依赖的包, "@" 开头的 Kconfig 条件)"""
+    dependencies: list[Dependency] = []
+    conditions: list[str] = []
+    for token in _split_depends(depends or ""):
+        select = token.startswith("+")
+        item = token.removeprefix("+")
+        if item.startswith("@"):
+            conditions.append(item[1:])
+            continue
+        condition, name = _split_condition(item)
+        if name.startswith("@"):
+            conditions.append(f"!({condition}) || ({name[1:]})" if condition else name[1:])
+        elif name:
+            dependencies.append(Dependency(name, select, condition))
+    return dependencies, conditions
+
+
+class _Expression:
+    """Kconfig 表达式(符号、!、&&、||、=、!=、括号)的求值"""
+
+    def __init__(self, expression: str, config: DotConfig) -> None:
+        self.tokens = EXPRESSION_TOKEN_PATTERN.findall(expression)
+        self.pos = 0
+        self.config = config
+
+    def _peek(self) -> str | None:
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def _next(self) -> str:
+        if (token := self._peek()) is None:
+            msg = "表达式不完整"
+            raise ValueError(msg)
+        self.pos += 1
+        return token
+
+    def _value(self, symbol: str) -> str:
+        if symbol in ("y", "m", "n"):
+            return symbol
+        if symbol.startswith('"'):
+            return symbol.strip('"')
+        return self.config.get(symbol) or "n"
+
+    def _unary(self) -> bool | str:
+        part = self._next()
+        if part == "!":
+            return not self._truth(self._unary())
+        if part == "(":
+            value = self._or()
+            if self._next() != ")":
+                msg = "括号不匹配"
+                raise ValueError(msg)
+            return value
+        if part in ("&&", "||", "=", "!=", ")"):
+            msg = f"意外的符号 {part}"
+            raise ValueError(msg)
+        value = self._value(part)
+        if self._peek() in ("=", "!="):
+            equal = self._next() == "="
+            return (value == self._value(self._next())) == equal
+        return value
+
+    @staticmethod
+    def _truth(value: bool | str) -> bool:
+        return value if isinstance(value, bool) else value in ("y", "m")
+
+    def _and(self) -> bool:
+        value = self._truth(self._unary())
+        while self._peek() == "&&":
+            self._next()
+            value = self._truth(self._unary()) and value
+        return value
+
+    def _or(self) -> bool:
+        value = self._and()
+        while self._peek() == "||":
+            self._next()
+            value = self._and() or value
+        return value
+
+    def evaluate(self) -> bool:
+        value = self._or()
+        if self._peek() is not None:
+            msg = f"多余的符号 {self._peek()}"
+            raise ValueError(msg)
+        return value
+
+
+def evaluate(expression: str, config: DotConfig) -> bool:
+    """按 .config 对 Kconfig 表达式求值, 无法解析时视为成立"""
+    try:
+        return _Expression(expression, config).evaluate()
+    except ValueError as e:
+        logger.debug("无法解析表达式%s: %s", expression, e)
+        return True
+
+
+class DepGraph:
+    """由 .packageinfo 构建的软件包依赖图
+
+    未提供 config 时条件依赖全部视为成立, 得到的是可能依赖的上界; 提供 config 时按其中的符号对条件求值。
+    """
+
+    def __init__(self, packages: dict[str, dict]) -> None:
+        self.packages = packages
+        self.depends: dict[str, list[Dependency]] = {}
+        self.conditions: dict[str, list[str]] = {}
+        self.providers: dict[str, list[str]] = {}
+        for name, package in packages.items():
+            self.depends[name], self.conditions[name] = parse_depends(package["depends"])
+            for provide in (package.get("provides") or "").split():
+                if provide != name:
+                    self.providers.setdefault(provide, []).append(name)
+
+    def resolve(self, name: str) -> list[str]:
+        """包名或虚拟包名对应的实际包"""
+        return [name] if name in self.packages else self.providers.get(name, [])
+
+    def dependencies(self, package: str, config: DotConfig | None = None, select_only: bool = False) -> list[str]:
+        """直接依赖的包"""
+        result = []
+        for dependency in self.depends.get(package, ()):
+            if select_only and not dependency.select:
+                continue
+            if config is not None and dependency.condition and not evaluate(dependency.condition, config):
+                continue
+            result.extend(self.resolve(dependency.name))
+        return result
+
+    def closure(self, packages: Iterable[str], config: DotConfig | None = None, select_only: bool = False) -> set[str]:
+        """这些包及其全部传递依赖"""
+        seen = {resolved for package in packages for resolved in self.resolve(package)}
+        queue = deque(seen)
+        while queue:
+            for dependency in self.dependencies(queue.popleft(), config, select_only):
+                if dependency not in seen:
+                    seen.add(dependency)
+                    queue.append(dependency)
+        return seen
+
+    def why(self, package: str, roots: Iterable[str], config: DotConfig | None = None, select_only: bool = False) -> list[str] | None:
+        """从 roots 中的某个包到 package 的最短依赖路径, 即是谁引入了这个包"""
+        parents: dict[str, str | None] = dict.fromkeys((resolved for root in roots for resolved in self.resolve(root)), None)
+        queue = deque(parents)
+        while queue:
+            current = queue.popleft()
+            if current == package:
+                path = [current]
+                while (parent := parents[path[-1]]) is not None:
+                    path.append(parent)
+                return path[::-1]
+            for dependency in self.dependencies(current, config, select_only):
+                if dependency not in parents:
+                    parents[dependency] = current
+                    queue.append(dependency)
+        return None
+
+    def missing(self) -> dict[str, list[str]]:
+        """无条件依赖中找不到对应包的项"""
+        result: dict[str, list[str]] = {}
+        for name, dependencies in self.depends.items():
+            if missing := [dependency.name for dependency in dependencies if not dependency.condition and not self.resolve(dependency.name)]:
+                result[name] = missing
+        return result
+
+
+_depgraphs: dict[int, tuple[dict, DepGraph]] = {}
+_depgraphs_lock = threading.Lock()
+
+
+def get_depgraph(packages: dict[str, dict]) -> DepGraph:
+    """同一份包信息(get_packageinfos 的返回值)只构建一次依赖图"""
+    with _depgraphs_lock:
+        if (cached := _depgraphs.get(id(packages))) is None or cached[0] is not packages:
+            cached = _depgraphs[id(packages)] = (packages, DepGraph(packages))
+        return cached[1]
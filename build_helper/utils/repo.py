@@ -1,19 +1,17 @@
 # SPDX-FileCopyrightText: Copyright (c) 2024-2025 沉默の金 <cmzj@cmzj.org>
 # SPDX-License-Identifier: MIT
 import contextlib
+import functools
 import os
 import re
 from datetime import datetime, timedelta, timezone
 
-import github
-import github.GitRelease
-import httpx
 import pygit2
 from actions_toolkit.github import Context, get_octokit
 
-from .downloader import dl2, wait_dl_tasks
+from .downloader import DLPriority, dl2, wait_dl_tasks
 from .logger import logger
-from .network import gh_api_request
+from .network import get_client, gh_api_request, graphql_request
 from .paths import paths
 
 context = Context()
@@ -23,9 +21,25 @@ token = os.getenv('GITHUB_TOKEN')
 with contextlib.suppress(Exception):
     repo = get_octokit(token).rest.get_repo(user_repo)
 
-compiler = context.repo.owner
-if user_info := gh_api_request(f"https://api.github.com/users/{compiler}", token):
-    compiler = user_info.get("name", compiler)
+# 仓库所有者(用户或组织)的名称
+OWNER_QUERY = """
+query($owner: String!) {
+  repositoryOwner(login: $owner) {
+    ... on User { name }
+    ... on Organization { name }
+  }
+}
+"""
+
+
+@functools.cache
+def get_compiler() -> str:
+    """编译者的名称, 获取用户信息失败或未设置名称时使用用户名"""
+    compiler = context.repo.owner
+    if token and (data := graphql_request(OWNER_QUERY, {"owner": compiler}, token)):
+        compiler = (data.get("repositoryOwner") or {}).get("name") or compiler
+    return compiler
+
 
 def get_current_commit() -> str:
     current_repo = pygit2.Repository(paths.openwrt_k)
@@ -34,10 +48,93 @@ def get_current_commit() -> str:
         head_commit = head_commit.raw.hex()
     return head_commit
 
-def dl_artifact(name: str, path: str) -> str:
-    for artifact in repo.get_artifacts():
-        if artifact.workflow_run.id == context.run_id and artifact.name == name:
-            dl_url = artifact.archive_download_url
+# 一次查询获取所有发布及其资产, 发布数量超过 100 时分页
+RELEASES_QUERY = """
+query($owner: String!, $name: String!, $cursor: String) {
+  repository(owner: $owner, name: $name) {
+    releases(first: 100, after: $cursor, orderBy: {field: CREATED_AT, direction: DESC}) {
+      pageInfo { hasNextPage endCursor }
+      nodes {
+        databaseId
+        tagName
+        name
+        releaseAssets(first: 100) {
+          pageInfo { hasNextPage endCursor }
+          nodes { name downloadUrl }
+        }
+      }
+    }
+  }
+}
+"""
+# 资产数量超过 100 的发布, 分页获取其余资产
+RELEASE_ASSETS_QUERY = """
+query($owner: String!, $name: String!, $tagName: String!, $cursor: String) {
+  repository(owner: $owner, name: $name) {
+    release(tagName: $tagName) {
+      releaseAssets(first: 100, after: $cursor) {
+        pageInfo { hasNextPage endCursor }
+        nodes { name downloadUrl }
+      }
+    }
+  }
+}
+"""
+
+
+def _release_assets(tag_name: str, connection: dict) -> list[dict]:
+    """从第一页开始取出发布的所有资产"""
+    assets = []
+    while True:
+        assets.extend({"name": asset["name"], "browser_download_url": asset["downloadUrl"]} for asset in connection["nodes"])
+        if not connection["pageInfo"]["hasNextPage"]:
+            return assets
+        data = graphql_request(RELEASE_ASSETS_QUERY, {"owner": context.repo.owner, "name": context.repo.repo, "tagName": tag_name,
+                                                      "cursor": connection["pageInfo"]["endCursor"]}, token)
+        if not data or not data.get("repository") or not data["repository"].get("release"):
+            msg = f"获取发布{tag_name}的资产失败"
+            raise RuntimeError(msg)
+        connection = data["repository"]["release"]["releaseAssets"]
+
+
+@functools.cache
+def get_releases() -> list[dict]:
+    """通过 GraphQL 获取仓库的所有发布(按创建时间降序)及其资产, 结果在进程内缓存"""
+    releases = []
+    cursor = None
+    while True:
+        data = graphql_request(RELEASES_QUERY, {"owner": context.repo.owner, "name": context.repo.repo, "cursor": cursor}, token)
+        if not data or not data.get("repository"):
+            msg = "获取发布列表失败"
+            raise RuntimeError(msg)
+        connection = data["repository"]["releases"]
+        releases.extend({"id": node["databaseId"],
+                         "tag_name": node["tagName"],
+                         "name": node["name"],
+                         "assets": _release_assets(node["tagName"], node["releaseAssets"])} for node in connection["nodes"])
+        if not connection["pageInfo"]["hasNextPage"]:
+            return releases
+        cursor = connection["pageInfo"]["endCursor"]
+
+
+def get_workflow_run() -> dict:
+    """获取当前工作流运行的信息, GraphQL 中的 WorkflowRun 没有标题字段, 因此使用 REST API"""
+    if workflow_run := gh_api_request(f"https://api.github.com/repos/{user_repo}/actions/runs/{context.run_id}", token):
+        return workflow_run
+    msg = "获取工作流运行信息失败"
+    raise RuntimeError(msg)
+
+
+def dl_artifact(name: str, path: str | None = None) -> str:
+    """下载当前运行的 artifact, 返回 zip 的路径
+
+    默认保存到固定的 workdir/dl/<run_id>/<name>.zip, 进程中断重启后可以通过分片日志续传
+    """
+    # 直接按名称查询当前运行的 artifact, 不遍历仓库的所有 artifact
+    response = gh_api_request(f"https://api.github.com/repos/{user_repo}/actions/runs/{context.run_id}/artifacts?name={name}", token)
+    for artifact in response["artifacts"] if response else []:
+        if artifact["name"] == name:
+            dl_url = artifact["archive_download_url"]
             logger.debug(f'Downloading artifact {name} from {dl_url}')
             break
     else:
@@ -53,9 +150,13 @@ def dl_artifact(name: str, path: str) -> str:
                 "X-GitHub-Api-Version": "2022-11-28",
                 "Authorization": f'Bearer {token}',
             }
-    task = dl2(dl_url, os.path.join(path, name + ".zip"), headers=headers)
+    if path is None:
+        path = os.path.join(paths.workdir, "dl", str(context.run_id))
+    os.makedirs(path, exist_ok=True)
+    zip_path = os.path.join(path, name + ".zip")
+    task = dl2(dl_url, zip_path, headers=headers, cache=False, priority=DLPriority.HIGH)
     wait_dl_tasks([task])
-    return os.path.join(path, name + ".zip")
+    return zip_path
 
 def del_cache(key_prefix: str) -> None:
     headers = {
@@ -68,7 +169,7 @@ def del_cache(key_prefix: str) -> None:
             cache: dict
             if cache['key'].startswith(key_prefix):
                 logger.info(f'Deleting cache {cache["key"]}')
-                httpx.delete(f"https://api.github.com/repos/{user_repo}/actions/caches/{cache['id']}", headers=headers, timeout=10)
+                get_client().delete(f"https://api.github.com/repos/{user_repo}/actions/caches/{cache['id']}", headers=headers)
     else:
         logger.error('Failed to get caches list')
 
@@ -108,8 +209,8 @@ def new_release(cfg: dict, assets: list[str], body: str) -> None:
     f_release_name = "v" + datetime.now(timezone(timedelta(hours=8))).strftime('%Y.%m.%d') + "-{n}" + release_suffix
     f_tag_name = "v" + datetime.now(timezone(timedelta(hours=8))).strftime('%Y.%m.%d') + "-{n}" + tag_suffix
 
-    releases = repo.get_releases()
-    tag_names = [release.tag_name for release in releases]
+    releases = get_releases()
+    tag_names = [release["tag_name"] for release in releases]
 
     i = 0
     while True:
@@ -139,22 +240,22 @@ def new_release(cfg: dict, assets: list[str], body: str) -> None:
             "X-GitHub-Api-Version": "2022-11-28",
             "Authorization": f'Bearer {token}',
         }
-        for release in releases:
-            if release.tag_name.endswith(tag_suffix) and release.tag_name != tag_name:
-                logger.info("删除旧版本: %s", release.tag_name)
-                release.delete_release()
-                httpx.delete(f"https://api.github.com/repos/{user_repo}/git/refs/tags/{release.tag_name}", headers=headers, timeout=10)
+        for old_release in releases:
+            if old_release["tag_name"].endswith(tag_suffix) and old_release["tag_name"] != tag_name:
+                logger.info("删除旧版本: %s", old_release["tag_name"])
+                get_client().delete(f"https://api.github.com/repos/{user_repo}/releases/{old_release['id']}", headers=headers).raise_for_status()
+                get_client().delete(f"https://api.github.com/repos/{user_repo}/git/refs/tags/{old_release['tag_name']}", headers=headers)
 
     except Exception:
         logger.exception("删除旧版本失败")
 
 
-def match_releases(cfg: dict) -> github.GitRelease.GitRelease | None:
+def match_releases(cfg: dict) -> dict | None:
     _, suffix = get_release_suffix(cfg)
 
-    releases = repo.get_releases()
+    releases = get_releases()
 
-    matched_releases = [release for release in releases if release.tag_name.endswith(suffix)]
+    matched_releases = [release for release in releases if release["tag_name"].endswith(suffix)]
 
     if matched_releases:
         return matched_releases[0]
@@ -0,0 +1,76 @@
+# SPDX-FileCopyrightText: Copyright (c) 2024-2025 沉默の金 <cmzj@cmzj.org>
+# SPDX-License-Identifier: MIT
+import os
+import re
+import subprocess
+import time
+from collections import deque
+from collections.abc import Callable
+from typing import NamedTuple
+
+import zstandard as zstd
+
+from .logger import logger
+from .paths import paths
+
+# 失败时输出的最后行数
+TAIL_LINES = 100
+# 完整日志的 zstd 压缩等级
+LOG_COMPRESSION_LEVEL = 3
+# make 默认输出中表示进度与问题的行, 如 " make[3] -C package/libs/toolchain compile"
+MAKE_PROGRESS_PATTERN = re.compile(r"^\s*make\[\d+\] |ERROR:|WARNING:")
+
+
+class ProcessLog(NamedTuple):
+    returncode: int
+    # 最后 TAIL_LINES 行输出
+    tail: list[str]
+    # zstd 压缩的完整输出
+    log_path: str
+
+    @property
+    def output(self) -> str:
+        return "".join(self.tail)
+
+
+def _log_path(name: str) -> str:
+    log_dir = os.path.join(paths.errorinfo, "subprocess-logs")
+    os.makedirs(log_dir, exist_ok=True)
+    safe_name = re.sub(r"[^\w.-]+", "_", name)
+    return os.path.join(log_dir, f"{safe_name}-{time.time_ns()}.log.zst")
+
+
+def run_logged(args: list[str],
+               cwd: str,
+               name: str | None = None,
+               progress: re.Pattern | None = None,
+               on_line: Callable[[str], None] | None = None,
+               tail_lines: int = TAIL_LINES,
+               check: bool = False) -> ProcessLog:
+    """运行命令, 输出流式写入 zstd 压缩的日志文件
+
+    控制台只输出匹配 progress 的行, 失败时再输出最后 tail_lines 行; 内存中只保留这些行。
+    完整日志保存在错误信息目录中, 失败时随错误信息一起上传。
+    """
+    command = " ".join(args)
+    log_path = _log_path(name or args[0])
+    tail: deque[str] = deque(maxlen=tail_lines)
+    logger.debug("运行命令：%s, 日志: %s", command, log_path)
+    with (open(log_path, "wb") as f,
+          zstd.ZstdCompressor(level=LOG_COMPRESSION_LEVEL).stream_writer(f) as writer,
+          subprocess.Popen(args, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT) as process):
+        for raw in process.stdout:  # type: ignore[union-attr]
+            writer.write(raw)
+            line = raw.decode("utf-8", errors="replace")
+            tail.append(line)
+            if progress and progress.search(line):
+                # 经过 logger 输出, 立即刷新并与其他日志保持顺序
+                logger.info("%s", line.rstrip("\n"))
+            if on_line:
+                on_line(line)
+    result = ProcessLog(process.returncode, list(tail), log_path)
+    if result.returncode != 0:
+        logger.error("运行命令：%s失败, 返回码: %s, 最后%s行输出:\n%s完整日志: %s", command, result.returncode, len(tail), result.output, log_path)
+        if check:
+            raise subprocess.CalledProcessError(result.returncode, args, result.output)
+    return result
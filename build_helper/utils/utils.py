@@ -1,9 +1,12 @@
 # SPDX-FileCopyrightText: Copyright (c) 2024-2025 沉默の金 <cmzj@cmzj.org>
 # SPDX-License-Identifier: MIT
 import hashlib
+import json
 import os
 import shutil
+import stat
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
 
 from .error import ConfigParseError
 from .logger import logger
@@ -141,16 +144,77 @@ def apply_patch(patch: str, target: str) -> bool:
     return result.returncode == 0
 
 
-def hash_dirs(directories: list[str] | tuple[str,...], hash_algorithm: str = 'sha256') -> str:
-    """计算整个目录的哈希值"""
-    hash_obj = hashlib.new(hash_algorithm)
+def check_patch(patch: str, target: str, reverse: bool = False) -> bool:
+    """试运行补丁, reverse 为 True 时检查补丁是否已经应用"""
+    result = subprocess.run(["patch", "-p1", "-d", target, "--dry-run", "--force", *(["--reverse"] if reverse else [])],
+                            input=patch,
+                            text=True,
+                            capture_output=True,
+    )
+    return result.returncode == 0
 
-    # 遍历目录中的所有文件和子目录
+
+def _load_hash_cache(cache_path: str, hash_algorithm: str) -> dict[str, list]:
+    try:
+        with open(cache_path, encoding="utf-8") as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(cache, dict) or cache.get("algorithm") != hash_algorithm or not isinstance(cache.get("files"), dict):
+        return {}
+    return cache["files"]
+
+
+def _save_hash_cache(cache_path: str, hash_algorithm: str, files: dict[str, list]) -> None:
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"algorithm": hash_algorithm, "files": files}, f)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        logger.warning("写入哈希缓存失败: %s", e)
+
+
+def hash_dirs(directories: list[str] | tuple[str,...], hash_algorithm: str = 'sha256', cache_path: str | None = None) -> str:
+    """计算整个目录的哈希值
+
+    包含每个文件相对于目录上级的路径、类型与可执行权限(与 git 一样只区分是否可执行)以及内容, 文件在线程池中并行读取;
+    提供 cache_path 时以 (路径, 大小, mtime, inode) 缓存每个文件的哈希, 未变化的文件不再读取。
+    """
+    entries: list[tuple[str, str, os.stat_result]] = []
     for directory in directories:
-        for root, _, files in os.walk(directory):
-            for name in sorted(files):
-                with open(os.path.join(root, name), 'rb') as f:
-                    while chunk := f.read(8192):
-                        hash_obj.update(chunk)
+        base = os.path.dirname(os.path.abspath(directory))
+        for root, dirs, files in os.walk(directory):
+            dirs.sort()
+            # 指向目录的符号链接在 dirs 中, 同样记录
+            for name in sorted(files + [name for name in dirs if os.path.islink(os.path.join(root, name))]):
+                path = os.path.join(root, name)
+                entries.append((os.path.relpath(path, base), os.path.abspath(path), os.lstat(path)))
+
+    cache = _load_hash_cache(cache_path, hash_algorithm) if cache_path else {}
+
+    def file_hash(entry: tuple[str, str, os.stat_result]) -> str:
+        _, path, st = entry
+        if stat.S_ISLNK(st.st_mode):
+            return hashlib.new(hash_algorithm, os.readlink(path).encode()).hexdigest()
+        if (cached := cache.get(path)) and cached[:3] == [st.st_size, st.st_mtime_ns, st.st_ino]:
+            return cached[3]
+        with open(path, 'rb') as f:
+            return hashlib.file_digest(f, hash_algorithm).hexdigest()
+
+    with ThreadPoolExecutor() as executor:
+        digests = list(executor.map(file_hash, entries))
 
+    hash_obj = hashlib.new(hash_algorithm)
+    files = {}
+    for (relpath, path, st), digest in zip(entries, digests, strict=True):
+        if stat.S_ISLNK(st.st_mode):
+            kind = "l"
+        else:
+            kind = "x" if st.st_mode & 0o111 else "f"
+            files[path] = [st.st_size, st.st_mtime_ns, st.st_ino, digest]
+        hash_obj.update(f"{relpath}\0{kind}\0{digest}\n".encode())
+
+    if cache_path:
+        _save_hash_cache(cache_path, hash_algorithm, files)
     return hash_obj.hexdigest()